@@ -0,0 +1,332 @@
+# benchmark.py
+"""Офлайн-бенчмарк: ChannelMonitor.check_channels и хендлеры бота на фейковом Telegram
+и временной базе. Сеть не нужна.
+
+    python benchmark.py --channels 500 --users 2000 --cycles 20 --post-rate 0.05
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime, timezone
+from aiogram import types
+from config import DELIVERY_PER_CHAT_INTERVAL
+import database.db as db
+from database.pool import ConnectionPool
+from delivery import DeliveryQueue
+from fakes import FakeChannel, FakeNetwork, FakeTelegramClient, FakeBotSession, FakeWebhookClient
+from monitor import ChannelMonitor
+from notifier import Notifier
+import notifier as notifier_module
+from ratelimit import TokenBucket
+from scheduler import PollScheduler
+from subscribers import subscriber_index
+from webhook import start_webhook
+import bot as bot_module
+
+# Лимит, который фактически не ограничивает (0 в аргументах)
+UNLIMITED = 1e9
+
+
+class CountingPool(ConnectionPool):
+    """Пул соединений, считающий выполненные SQL-выражения"""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.statements = 0
+
+    def _trace(self, statement: str):
+        self.statements += 1
+
+    async def _connect(self, readonly: bool):
+        conn = await super()._connect(readonly)
+        await conn.set_trace_callback(self._trace)
+        return conn
+
+
+class BenchScheduler(PollScheduler):
+    """Планировщик, считающий опросы каналов; every_cycle - каждый канал в каждом цикле,
+    сколько бы ни прошло с прошлого опроса"""
+
+    def __init__(self, min_interval: float, every_cycle: bool = False):
+        super().__init__(min_interval)
+        self.every_cycle = every_cycle
+        self.polls = 0
+
+    def due(self) -> list[str]:
+        if self.every_cycle:
+            self.heap = []
+            channels = list(self.next_due)
+        else:
+            channels = super().due()
+        self.polls += len(channels)
+        return channels
+
+
+class BenchMonitor(ChannelMonitor):
+    """Монитор на фейковом клиенте: только опрос, без push и догонялок"""
+
+    def __init__(self, client: FakeTelegramClient, args, spool_dir: str):
+        super().__init__(session='benchmark', client_factory=lambda: client)
+        self.push_mode = False
+        # Медиа - во временном каталоге
+        self.spool_dir = spool_dir
+        self.scheduler = BenchScheduler(args.poll_interval, every_cycle=not args.adaptive)
+        self.api_budget = TokenBucket(args.account_rate or UNLIMITED, (args.account_rate or UNLIMITED) * 2)
+
+
+def percentiles(values, points=(50, 90, 99)) -> dict[int, float]:
+    if not values:
+        return {point: float('nan') for point in points}
+    ordered = sorted(values)
+    return {point: ordered[min(len(ordered) - 1, len(ordered) * point // 100)] for point in points}
+
+
+def format_ms(values) -> str:
+    result = percentiles(values)
+    return ", ".join(f"p{point} {value * 1000:.1f} мс" for point, value in result.items())
+
+
+async def seed(args) -> list[str]:
+    """Заполнить базу: каналы (уже подписанные), пользователи и их подписки"""
+    usernames = [f"bench{i}" for i in range(args.channels)]
+    subscriptions = set()
+    for user_id in range(1, args.users + 1):
+        for username in random.sample(usernames, min(args.subs_per_user, len(usernames))):
+            subscriptions.add((f"@user{user_id}", username))
+
+    async with db.pool.write() as conn:
+        await conn.executemany(
+            "INSERT INTO channels (username, is_subscribed, last_post_id) VALUES (?, 1, ?)",
+            [(username, args.initial_posts) for username in usernames]
+        )
+        await conn.executemany(
+            "INSERT INTO users (user_id, user_channel) VALUES (?, ?)",
+            [(user_id, f"@user{user_id}") for user_id in range(1, args.users + 1)]
+        )
+        await conn.executemany(
+            "INSERT INTO subscriptions (user_channel, channel_id) SELECT ?, id FROM channels WHERE username = ?",
+            sorted(subscriptions)
+        )
+        if args.digest_window:
+            await conn.executemany(
+                "INSERT INTO user_settings (user_id, digest_window) VALUES (?, ?)",
+                [(user_id, args.digest_window) for user_id in range(1, args.users + 1)]
+            )
+    return usernames
+
+
+async def drain(monitor: BenchMonitor, notifier: Notifier, timeout: float) -> bool:
+    """Дождаться, пока найденные посты пройдут outbox в базе и будут разосланы"""
+    async def wait():
+        while True:
+            await monitor.delivery_queue.join()
+            if not (monitor.delivery_queue.qsize() or monitor.albums or monitor.in_flight or notifier.pending
+                    or await db.get_outbox_batch(notifier.partition, notifier.partitions, 0, 1)):
+                return
+            await asyncio.sleep(0.05)
+
+    try:
+        await asyncio.wait_for(wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def bench_monitor(args, pool: CountingPool, session: FakeBotSession, usernames: list[str], spool_dir: str):
+    network = FakeNetwork(args.api_latency, args.flood_rate, args.flood_seconds)
+    channels = [
+        FakeChannel(1000 + i, username, args.post_rate, args.photo_share, args.initial_posts, args.album_share)
+        for i, username in enumerate(usernames)
+    ]
+    client = FakeTelegramClient(channels, network)
+    session.published = client.published
+
+    monitor = BenchMonitor(client, args, spool_dir)
+    monitor.is_running = True
+    await monitor.resolver.load()
+    await subscriber_index.load()
+    deliver_task = asyncio.create_task(monitor.deliver_posts())
+    # Рассылка - тем же кодом, что и в процессе notifier.py, но в этом же цикле событий
+    notifier = Notifier(0, 1, poll_interval=0.01)
+    notifier.delivery = DeliveryQueue(rate=args.delivery_rate or UNLIMITED, per_chat_interval=args.per_chat_interval)
+    await notifier.start()
+
+    durations, statements = [], []
+    started = time.monotonic()
+    for _ in range(args.cycles):
+        before, cycle_started = pool.statements, time.monotonic()
+        await monitor.check_channels()
+        durations.append(time.monotonic() - cycle_started)
+        statements.append(pool.statements - before)
+        if args.cycle_pause:
+            await asyncio.sleep(args.cycle_pause)
+    elapsed = time.monotonic() - started
+
+    drained = await drain(monitor, notifier, args.drain_timeout)
+    monitor.is_running = False
+    deliver_task.cancel()
+    await monitor.connection.stop()
+    stats = notifier.delivery.stats()
+    await notifier.stop()
+
+    print("== Монитор ==")
+    print(f"Каналов {args.channels}, пользователей {args.users}, подписок на пользователя {args.subs_per_user}")
+    print(f"Циклов {args.cycles} за {elapsed:.2f} с: {args.cycles / elapsed:.2f} циклов/с, "
+          f"цикл {format_ms(durations)}")
+    polls = max(monitor.scheduler.polls, 1)
+    print(f"Опросов каналов: {monitor.scheduler.polls} ({monitor.scheduler.polls / args.cycles:.1f} на цикл)")
+    print(f"SQL-выражений на цикл: {sum(statements) / len(statements):.1f} (макс. {max(statements)}), "
+          f"на опрос канала: {sum(statements) / polls:.2f}")
+    print(f"Вызовов Telegram API на цикл: {network.calls / args.cycles:.1f}, на опрос канала: "
+          f"{network.calls / polls:.2f}, FloodWait: {network.floods}")
+    print(f"Доставлено {stats['sent']}, ошибок {stats['failed']}, повторов {stats['retried']}"
+          + ("" if drained else f" (очередь не разобрана за {args.drain_timeout} с)"))
+    print(f"Задержка публикация -> доставка: {format_ms(session.latencies)}")
+    print(f"Запросов к Bot API: {dict(session.requests)}")
+
+
+def user(user_id: int) -> types.User:
+    return types.User(id=user_id, is_bot=False, first_name="bench")
+
+
+def message_update(update_id: int, user_id: int, text: str) -> types.Update:
+    return types.Update(update_id=update_id, message=types.Message(
+        message_id=update_id, date=datetime.now(timezone.utc),
+        chat=types.Chat(id=user_id, type='private'), from_user=user(user_id), text=text
+    ))
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> types.Update:
+    return types.Update(update_id=update_id, callback_query=types.CallbackQuery(
+        id=str(update_id), from_user=user(user_id), chat_instance="bench", data=data,
+        message=types.Message(
+            message_id=update_id, date=datetime.now(timezone.utc),
+            chat=types.Chat(id=user_id, type='private'), text="menu"
+        )
+    ))
+
+
+async def bench_handlers(args, pool: CountingPool, session: FakeBotSession, usernames: list[str]):
+    users = min(args.handler_users, args.users)
+    if not users:
+        return
+    update_ids = iter(range(1, 10 ** 9))
+    latencies, errors = [], []
+    semaphore = asyncio.Semaphore(args.handler_concurrency)
+
+    webhook = sender = None
+    if args.webhook:
+        # Апдейты идут по HTTP через локальный webhook-сервер, как их доставлял бы Telegram
+        runner, webhook = await start_webhook(
+            bot_module.dp, bot_module.bot, url="", port=args.webhook_port,
+            secret="bench", max_concurrency=args.webhook_concurrency
+        )
+        sender = FakeWebhookClient(f"http://127.0.0.1:{args.webhook_port}/webhook", "bench")
+
+    async def feed(update: types.Update):
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                if sender:
+                    # Время до ответа сервера: обработка идёт в фоне
+                    await sender.send(update)
+                else:
+                    await bot_module.dp.feed_update(bot_module.bot, update)
+            except Exception:
+                # RetryAfter и прочие ошибки Bot API хендлер не обрабатывает - просто считаем
+                errors.append(update.update_id)
+            latencies.append(time.monotonic() - started)
+
+    async def scenario(user_id: int):
+        # Типичный путь: меню -> мои каналы -> добавить мониторинг -> ввод канала -> домой
+        await feed(message_update(next(update_ids), user_id, "/start"))
+        await feed(callback_update(next(update_ids), user_id, "my_channels"))
+        await feed(callback_update(next(update_ids), user_id, f"add_monitor:@user{user_id}"))
+        await feed(message_update(next(update_ids), user_id, f"@{random.choice(usernames)}"))
+        await feed(callback_update(next(update_ids), user_id, "home"))
+
+    session.requests.clear()
+    bot_module.cleaner.start()
+    before, started = pool.statements, time.monotonic()
+    await asyncio.gather(*(scenario(user_id) for user_id in range(1, users + 1)))
+    if webhook:
+        await webhook.drain()
+    elapsed = time.monotonic() - started
+    statements = pool.statements - before
+    await bot_module.cleaner.stop()
+
+    print("== Хендлеры бота ==")
+    print(f"Апдейтов {len(latencies)} от {users} пользователей за {elapsed:.2f} с: "
+          f"{len(latencies) / elapsed:.1f} апдейтов/с")
+    if webhook:
+        print(f"Время до ответа webhook: {format_ms(latencies)}, ответов по кодам: {dict(sender.statuses)}")
+        await sender.close()
+        await runner.cleanup()
+    else:
+        print(f"Время обработки апдейта: {format_ms(latencies)}, ошибок {len(errors)}")
+    print(f"SQL-выражений на апдейт: {statements / len(latencies):.1f}")
+    print(f"Запросов к Bot API: {dict(session.requests)}")
+
+
+async def main(args):
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        pool = CountingPool(os.path.join(directory, "bench.db"))
+        db.pool = pool
+        session = FakeBotSession(FakeNetwork(args.bot_latency, args.bot_flood_rate, args.flood_seconds))
+        bot_module.bot.session = session
+        notifier_module.bot.session = session
+        try:
+            await db.init_db()
+            usernames = await seed(args)
+            await bench_monitor(args, pool, session, usernames, os.path.join(directory, "media"))
+            await bench_handlers(args, pool, session, usernames)
+        finally:
+            await db.close_db()
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Пиковый RSS: {peak_rss:.1f} МБ")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк монитора каналов и бота")
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--subs-per-user", type=int, default=5)
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--cycle-pause", type=float, default=0.0, help="пауза между циклами, с")
+    parser.add_argument("--adaptive", action="store_true", help="адаптивное расписание вместо опроса всех каналов")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="минимальный интервал при --adaptive")
+    parser.add_argument("--post-rate", type=float, default=0.05, help="постов в секунду на канал")
+    parser.add_argument("--photo-share", type=float, default=0.2, help="доля постов с фото")
+    parser.add_argument("--album-share", type=float, default=0.3, help="доля постов с фото, выходящих альбомом")
+    parser.add_argument("--initial-posts", type=int, default=10)
+    parser.add_argument("--api-latency", type=float, default=0.02, help="задержка Telegram API, с")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="вероятность FloodWait на вызов API")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--account-rate", type=float, default=0, help="запросов/с на аккаунт, 0 - без лимита")
+    parser.add_argument("--bot-latency", type=float, default=0.01, help="задержка Bot API, с")
+    parser.add_argument("--bot-flood-rate", type=float, default=0.0, help="вероятность RetryAfter на вызов Bot API")
+    parser.add_argument("--delivery-rate", type=float, default=0, help="сообщений/с боту, 0 - без лимита")
+    parser.add_argument("--per-chat-interval", type=float, default=DELIVERY_PER_CHAT_INTERVAL)
+    parser.add_argument("--digest-window", type=int, default=0, help="окно дайджеста у всех пользователей, с")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--handler-users", type=int, default=200)
+    parser.add_argument("--handler-concurrency", type=int, default=50)
+    parser.add_argument("--webhook", action="store_true", help="слать апдейты через локальный webhook-сервер")
+    parser.add_argument("--webhook-port", type=int, default=8089)
+    parser.add_argument("--webhook-concurrency", type=int, default=20, help="одновременных апдейтов в обработке")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    asyncio.run(main(args))
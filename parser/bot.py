@@ -5,52 +5,83 @@ from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMar
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import API_TOKEN
-from database.db import init_db, add_user_channel, add_monitor_channel, get_user_channels, get_monitor_channels, user_channel_exists, remove_monitor_channel
+from config import API_TOKEN, FSM_PURGE_INTERVAL, METRICS_BOT_PORT, BOT_WEBHOOK_URL, FILTERS_MAX_PER_SUBSCRIPTION, DIGEST_WINDOWS
+from database.db import init_db, close_db, add_user_channel, add_monitor_channel, get_user_channels, get_monitor_channels, user_channel_exists, remove_monitor_channel, normalize_username, replace_bot_messages
+from database.db import get_subscription_filters, add_subscription_filter, remove_subscription_filter, get_digest_window, set_digest_window
+from filters import INCLUDE, EXCLUDE, parse_pattern, format_pattern
+from storage import SQLiteStorage
+from cleanup import MessageCleaner
+from webhook import start_webhook
+import metrics
+from metrics import UPDATE_SECONDS
+import logging
 
-# Инициализация с MemoryStorage
-storage = MemoryStorage()
+logger = logging.getLogger(__name__)
+
+# Состояние FSM хранится в базе и переживает рестарт
+storage = SQLiteStorage()
 bot = Bot(token=API_TOKEN)
 dp = Dispatcher(storage=storage)
+cleaner = MessageCleaner(bot)
+
+@dp.update.outer_middleware()
+async def measure_update(handler, event: types.Update, data):
+    """Время обработки апдейта - в parser_bot_update_seconds"""
+    with UPDATE_SECONDS.labels(event.event_type).time():
+        return await handler(event, data)
 
 # Состояния для FSM
 class Form(StatesGroup):
     waiting_for_user_channel = State()
     waiting_for_monitor_channel = State()
-
-# Словарь для хранения ID последних сообщений
-user_last_messages = {}
+    waiting_for_filter = State()
 
 # ===== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ =====
-async def delete_previous_messages(user_id: int):
-    """Удаляет предыдущие сообщения пользователя"""
-    if user_id in user_last_messages:
-        for msg_id in user_last_messages[user_id]:
-            try:
-                await bot.delete_message(user_id, msg_id)
-            except:
-                pass
-        user_last_messages[user_id] = []
-
 async def send_message_with_cleanup(user_id: int, text: str, reply_markup=None):
-    """Отправляет сообщение с очисткой предыдущих"""
-    await delete_previous_messages(user_id)
+    """Отправляет сообщение, а предыдущее меню пользователя удаляет в фоне"""
     message = await bot.send_message(user_id, text, reply_markup=reply_markup)
-    if user_id not in user_last_messages:
-        user_last_messages[user_id] = []
-    user_last_messages[user_id].append(message.message_id)
+    # В базе хранится только последнее сообщение каждого пользователя
+    cleaner.schedule(user_id, await replace_bot_messages(user_id, message.message_id))
     return message
 
+async def purge_fsm():
+    """Периодически удалять истёкшие состояния FSM"""
+    while True:
+        await asyncio.sleep(FSM_PURGE_INTERVAL)
+        try:
+            removed = await storage.purge()
+            if removed:
+                logger.info(f"Удалено {removed} истёкших состояний FSM")
+        except Exception as e:
+            logger.error(f"Ошибка очистки FSM: {e}")
+
 # ===== КЛАВИАТУРЫ =====
 def get_main_menu():
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="📌 Мои каналы", callback_data='my_channels'))
     builder.add(InlineKeyboardButton(text="➕ Добавить канал", callback_data='add_channel'))
+    builder.add(InlineKeyboardButton(text="📰 Дайджест", callback_data='digest'))
     builder.add(InlineKeyboardButton(text="ℹ️ Справка", callback_data='info'))
     builder.adjust(2)
     return builder.as_markup()
 
+def format_window(window: int) -> str:
+    if not window:
+        return "каждый пост сразу"
+    if window % 3600 == 0:
+        return f"раз в {window // 3600} ч"
+    return f"раз в {window // 60} мин"
+
+def get_digest_keyboard(current: int):
+    builder = InlineKeyboardBuilder()
+    for window in DIGEST_WINDOWS:
+        mark = "✅ " if window == current else ""
+        builder.add(InlineKeyboardButton(text=f"{mark}{format_window(window).capitalize()}", callback_data=f'digest_set:{window}'))
+    builder.add(InlineKeyboardButton(text="◀️ Назад", callback_data='back'))
+    builder.add(InlineKeyboardButton(text="🏠 Домой", callback_data='home'))
+    builder.adjust(*([1] * len(DIGEST_WINDOWS)), 2)
+    return builder.as_markup()
+
 def get_back_home_keyboard():
     builder = InlineKeyboardBuilder()
     builder.add(InlineKeyboardButton(text="◀️ Назад", callback_data='back'))
@@ -70,10 +101,23 @@ def get_monitor_channels_keyboard(monitor_channels: tuple, user_channel: str):
     builder = InlineKeyboardBuilder()
     for channel in monitor_channels:
         builder.add(InlineKeyboardButton(text=f"❌ {channel}", callback_data=f'remove_monitor:{user_channel}:{channel}'))
+        builder.add(InlineKeyboardButton(text="🔍 Фильтры", callback_data=f'filters:{user_channel}:{channel}'))
     builder.add(InlineKeyboardButton(text="➕ Добавить ещё", callback_data=f'add_monitor:{user_channel}'))
     builder.add(InlineKeyboardButton(text="◀️ Назад", callback_data=f'back_to_channel:{user_channel}'))
     builder.add(InlineKeyboardButton(text="🏠 Домой", callback_data='home'))
-    builder.adjust(1)
+    builder.adjust(*([2] * len(monitor_channels)), 1)
+    return builder.as_markup()
+
+def get_filters_keyboard(filters: tuple, user_channel: str):
+    builder = InlineKeyboardBuilder()
+    for i, (kind, pattern, is_regex) in enumerate(filters):
+        sign = "+" if kind == INCLUDE else "−"
+        builder.add(InlineKeyboardButton(text=f"❌ {sign} {format_pattern(pattern, is_regex)}", callback_data=f'filter_del:{i}'))
+    builder.add(InlineKeyboardButton(text="➕ Только со словом", callback_data=f'filter_add:{INCLUDE}'))
+    builder.add(InlineKeyboardButton(text="➖ Без слова", callback_data=f'filter_add:{EXCLUDE}'))
+    builder.add(InlineKeyboardButton(text="◀️ Назад", callback_data=f'show_monitor:{user_channel}'))
+    builder.add(InlineKeyboardButton(text="🏠 Домой", callback_data='home'))
+    builder.adjust(*([1] * len(filters)), 2)
     return builder.as_markup()
 
 async def make_channels_buttons(channels: tuple):
@@ -99,7 +143,8 @@ async def cmd_help(callback: types.CallbackQuery):
                                   "❓ Справка:\n\n"
                                   "📌 'Мой канал' — укажи свой канал.\n"
                                   "➕ 'Добавить канал для мониторинга' — добавь каналы, за которыми следить.\n"
-                                  "Можно добавлять несколько!", 
+                                  "Можно добавлять несколько!\n"
+                                  "📰 'Дайджест' — получать посты сводкой со ссылками, а не по одному.", 
                                   reply_markup=get_back_home_keyboard())
     await callback.answer()
 
@@ -181,6 +226,105 @@ async def remove_monitor_channel_handler(callback: types.CallbackQuery):
                                       reply_markup=get_channel_management_keyboard(user_channel))
     await callback.answer()
 
+# ===== ФИЛЬТРЫ ПОДПИСКИ =====
+async def show_filters(user_id: int, state: FSMContext):
+    """Меню фильтров подписки, выбранной в состоянии FSM"""
+    data = await state.get_data()
+    user_channel, monitor_channel = data.get("filter_user_channel"), data.get("filter_channel")
+    filters = await get_subscription_filters(user_channel, monitor_channel)
+    # Кнопки удаления ссылаются на фильтр по номеру в этом списке
+    await state.update_data(filters=[list(item) for item in filters])
+
+    include = [format_pattern(pattern, is_regex) for kind, pattern, is_regex in filters if kind == INCLUDE]
+    exclude = [format_pattern(pattern, is_regex) for kind, pattern, is_regex in filters if kind == EXCLUDE]
+    text = f"🔍 Фильтры {monitor_channel} для {user_channel}:\n\n"
+    if filters:
+        if include:
+            text += "Только посты, где есть хотя бы одно из:\n" + "\n".join(f"• {item}" for item in include) + "\n\n"
+        if exclude:
+            text += "Кроме постов, где есть:\n" + "\n".join(f"• {item}" for item in exclude) + "\n\n"
+    else:
+        text += "Фильтров нет - приходят все посты.\n\n"
+    text += "Слово ищется без учёта регистра, /выражение/ - регулярное выражение."
+    await send_message_with_cleanup(user_id, text, reply_markup=get_filters_keyboard(filters, user_channel))
+
+@dp.callback_query(lambda c: c.data.startswith('filters:'))
+async def filters_handler(callback: types.CallbackQuery, state: FSMContext):
+    data = callback.data.split(':')
+    await state.update_data(filter_user_channel=data[1], filter_channel=data[2])
+    await show_filters(callback.from_user.id, state)
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('filter_add:'))
+async def add_filter_handler(callback: types.CallbackQuery, state: FSMContext):
+    kind = callback.data.split(':')[1]
+    await state.update_data(filter_kind=kind)
+    await state.set_state(Form.waiting_for_filter)
+    prompt = "которое должно быть в посте" if kind == INCLUDE else "с которым посты не присылать"
+    await send_message_with_cleanup(callback.from_user.id,
+                                  f"📩 Отправь слово, {prompt}, или /регулярное выражение/:",
+                                  reply_markup=get_back_home_keyboard())
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('filter_del:'))
+async def remove_filter_handler(callback: types.CallbackQuery, state: FSMContext):
+    index = int(callback.data.split(':')[1])
+    data = await state.get_data()
+    filters = data.get("filters") or []
+    if data.get("filter_channel") and index < len(filters):
+        kind, pattern, is_regex = filters[index]
+        await remove_subscription_filter(data["filter_user_channel"], data["filter_channel"], kind, pattern, is_regex)
+        await show_filters(callback.from_user.id, state)
+    else:
+        # Состояние истекло - номер фильтра уже не к чему привязать
+        await send_message_with_cleanup(callback.from_user.id, "🏠 Главное меню:", reply_markup=get_main_menu())
+    await callback.answer()
+
+# Обработка ввода фильтра
+@dp.message(Form.waiting_for_filter)
+async def save_filter(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+    data = await state.get_data()
+    user_channel, monitor_channel = data.get("filter_user_channel"), data.get("filter_channel")
+    # Данные о подписке остаются в состоянии - после ввода возвращаемся в меню фильтров
+    await state.set_state(None)
+
+    if not user_channel or not monitor_channel:
+        await send_message_with_cleanup(user_id, "🏠 Главное меню:", reply_markup=get_main_menu())
+        return
+    try:
+        pattern, is_regex = parse_pattern(message.text or "")
+        if len(await get_subscription_filters(user_channel, monitor_channel)) >= FILTERS_MAX_PER_SUBSCRIPTION:
+            raise ValueError(f"у подписки уже {FILTERS_MAX_PER_SUBSCRIPTION} фильтров")
+    except ValueError as e:
+        await send_message_with_cleanup(user_id, f"❌ Фильтр не добавлен: {e}", reply_markup=get_back_home_keyboard())
+        return
+
+    await add_subscription_filter(user_channel, monitor_channel, data.get("filter_kind", INCLUDE), pattern, is_regex)
+    await show_filters(user_id, state)
+
+# ===== ДАЙДЖЕСТ =====
+@dp.callback_query(lambda c: c.data == "digest")
+async def digest_handler(callback: types.CallbackQuery):
+    window = await get_digest_window(callback.from_user.id)
+    await send_message_with_cleanup(callback.from_user.id,
+                                  f"📰 Дайджест: посты приходят {format_window(window)}.\n\n"
+                                  "В режиме дайджеста посты за окно собираются в одно сообщение со ссылками на оригиналы.",
+                                  reply_markup=get_digest_keyboard(window))
+    await callback.answer()
+
+@dp.callback_query(lambda c: c.data.startswith('digest_set:'))
+async def set_digest_handler(callback: types.CallbackQuery):
+    window = int(callback.data.split(':')[1])
+    if window not in DIGEST_WINDOWS:
+        window = 0
+    await set_digest_window(callback.from_user.id, window)
+    # Процесс рассылки подхватит настройку в течение DIGEST_SETTINGS_REFRESH
+    await send_message_with_cleanup(callback.from_user.id,
+                                  f"✅ Теперь посты приходят {format_window(window)}.",
+                                  reply_markup=get_digest_keyboard(window))
+    await callback.answer()
+
 # ===== ДОБАВЛЕНИЕ КАНАЛОВ =====
 @dp.callback_query(lambda c: c.data == "add_channel")
 async def add_user_channel_handler(callback: types.CallbackQuery, state: FSMContext):
@@ -214,20 +358,28 @@ async def save_user_channel(message: types.Message, state: FSMContext):
 @dp.message(Form.waiting_for_monitor_channel)
 async def save_monitor_channel(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    monitor_channel = message.text.strip()
+    # @foo, foo и t.me/foo - один и тот же канал
+    monitor_channel = normalize_username(message.text)
     
     # Получаем user_channel из состояния
     data = await state.get_data()
     user_channel = data.get("user_channel")
     
-    if user_channel and await user_channel_exists(user_channel):
+    if not monitor_channel:
+        await send_message_with_cleanup(user_id, 
+                                  "❌ Ошибка: не удалось распознать канал. Пришли @username или ссылку t.me/...", 
+                                  reply_markup=get_main_menu())
+        await state.clear()
+    elif user_channel and await user_channel_exists(user_channel):
         await add_monitor_channel(user_channel, monitor_channel)
         await state.clear()
         
-        # Просто добавляем в базу, подписка произойдет при следующей проверке
+        # Только запись в базу: монитор (отдельный процесс) увидит подписку в течение
+        # SUBSCRIPTIONS_SYNC_INTERVAL, а вступит в канал фоновой очередью с учётом лимитов Telegram
         await send_message_with_cleanup(user_id, 
                                   f"✅ Канал {monitor_channel} добавлен для мониторинга!\n"
-                                  f"Бот попытается подписаться на него в течение 5 минут.", 
+                                  f"Монитор подпишется на него в фоне - обычно за минуту, при лимитах Telegram дольше. "
+                                  f"Новые посты начнут приходить сразу после подписки.", 
                                   reply_markup=get_main_menu())
     else:
         await send_message_with_cleanup(user_id, 
@@ -277,7 +429,28 @@ async def back_to_channel(callback: types.CallbackQuery):
 # ===== ЗАПУСК =====
 async def main():
     await init_db()
-    await dp.start_polling(bot)
+    metrics_runner = await metrics.start_server(METRICS_BOT_PORT)
+    cleaner.start()
+    purge_task = asyncio.create_task(purge_fsm())
+    webhook_runner = None
+    try:
+        if BOT_WEBHOOK_URL:
+            # Апдейты приходят на локальный HTTP-сервер, getUpdates не опрашивается
+            webhook_runner, _ = await start_webhook(dp, bot)
+            await asyncio.Event().wait()
+        else:
+            # После запуска в режиме webhook Telegram не отдаёт getUpdates, пока webhook не снят
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        purge_task.cancel()
+        if webhook_runner:
+            await webhook_runner.cleanup()
+            await bot.session.close()
+        await cleaner.stop()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,158 @@
+# catchup.py
+import itertools
+from datetime import datetime, timezone
+from telethon import utils
+from telethon.tl import types
+from telethon.tl.functions.messages import GetPeerDialogsRequest
+from telethon.tl.functions.updates import GetStateRequest, GetDifferenceRequest, GetChannelDifferenceRequest
+from telethon.tl.types.updates import (
+    DifferenceEmpty, DifferenceSlice, DifferenceTooLong, ChannelDifferenceEmpty, ChannelDifferenceTooLong
+)
+from config import CHANNEL_DIFFERENCE_LIMIT
+from database.db import get_update_state, save_update_state
+import logging
+
+logger = logging.getLogger(__name__)
+
+# channel_id общего состояния аккаунта в таблице update_state
+COMMON = 0
+# Сколько диалогов запрашивать за раз при получении начальных pts
+DIALOGS_CHUNK = 100
+
+
+def _channel_id(update):
+    """channel_id канального обновления или None"""
+    channel_id = getattr(update, 'channel_id', None)
+    if channel_id is None:
+        peer = getattr(getattr(update, 'message', None), 'peer_id', None)
+        channel_id = getattr(peer, 'channel_id', None)
+    return channel_id
+
+
+def _finish(messages, client, diff):
+    """Достроить сообщения из сырого ответа до полноценных (с клиентом и сущностями)"""
+    entities = {utils.get_peer_id(x): x for x in itertools.chain(diff.users, diff.chats)}
+    result = []
+    for message in messages:
+        if isinstance(message, types.Message):
+            message._finish_init(client, entities, None)
+            result.append(message)
+    return result
+
+
+class UpdateCatchUp:
+    """Сохранённое состояние обновлений аккаунта и догонялки через getDifference/getChannelDifference"""
+
+    def __init__(self, session: str):
+        self.session = session
+        self.state = None       # (pts, qts, date, seq) аккаунта
+        self.channel_pts = {}   # channel_id -> pts
+        self.dirty = {}
+
+    async def load(self):
+        states = await get_update_state(self.session)
+        self.state = states.pop(COMMON, None)
+        self.channel_pts = {channel_id: state[0] for channel_id, state in states.items()}
+
+    def _set_channel_pts(self, channel_id: int, pts: int):
+        if pts > self.channel_pts.get(channel_id, 0):
+            self.channel_pts[channel_id] = pts
+            self.dirty[channel_id] = (pts, 0, 0, 0)
+
+    async def on_raw(self, update):
+        """Raw-обработчик Telethon: запоминаем pts каналов из пришедших обновлений"""
+        pts = getattr(update, 'pts', None)
+        channel_id = _channel_id(update)
+        if pts and channel_id:
+            self._set_channel_pts(channel_id, pts)
+
+    async def save(self, client):
+        """Сохранить текущее состояние аккаунта и накопленные pts каналов"""
+        state = await client(GetStateRequest())
+        self.state = (state.pts, state.qts, int(state.date.timestamp()), state.seq)
+        states, self.dirty = self.dirty, {}
+        states[COMMON] = self.state
+        await save_update_state(self.session, states)
+
+    async def _seed(self, client, peers: dict):
+        """Начальные pts каналов, о которых ещё ничего не знаем (из диалогов, пачками)"""
+        unknown = [peer for channel_id, peer in peers.items() if channel_id not in self.channel_pts]
+        for start in range(0, len(unknown), DIALOGS_CHUNK):
+            chunk = unknown[start:start + DIALOGS_CHUNK]
+            result = await client(GetPeerDialogsRequest([types.InputDialogPeer(peer) for peer in chunk]))
+            for dialog in result.dialogs:
+                if isinstance(dialog.peer, types.PeerChannel) and dialog.pts:
+                    self._set_channel_pts(dialog.peer.channel_id, dialog.pts)
+
+    async def _channel_difference(self, client, channel_id: int, peer) -> tuple[list, bool]:
+        """Пропущенные сообщения канала; второй элемент - удалось ли догнать полностью"""
+        messages = []
+        while True:
+            diff = await client(GetChannelDifferenceRequest(
+                channel=peer,
+                filter=types.ChannelMessagesFilterEmpty(),
+                pts=self.channel_pts[channel_id],
+                limit=CHANNEL_DIFFERENCE_LIMIT
+            ))
+            if isinstance(diff, ChannelDifferenceTooLong):
+                # Слишком давно - историю канала догонит обычный опрос по курсору
+                self._set_channel_pts(channel_id, diff.dialog.pts)
+                return messages, False
+            self._set_channel_pts(channel_id, diff.pts)
+            if isinstance(diff, ChannelDifferenceEmpty):
+                return messages, True
+            messages.extend(_finish(diff.new_messages, client, diff))
+            if diff.final:
+                return messages, True
+
+    async def catch_up(self, client, peers: dict) -> tuple[list, set]:
+        """Догнать пропущенное с момента сохранённого состояния.
+        peers: channel_id -> input peer отслеживаемых каналов.
+        Возвращает новые сообщения каналов (по возрастанию id) и channel_id каналов,
+        которые догнаны полностью и не требуют опроса истории"""
+        if self.state is None:
+            # Первый запуск: запоминаем точку отсчёта, пропущенное догонит опрос
+            await self._seed(client, peers)
+            await self.save(client)
+            return [], set()
+
+        known = {channel_id for channel_id in peers if channel_id in self.channel_pts}
+        messages = []
+        flagged = set()
+        pts, qts, date, _ = self.state
+        while True:
+            diff = await client(GetDifferenceRequest(
+                pts=pts, date=datetime.fromtimestamp(date, timezone.utc), qts=qts
+            ))
+            if isinstance(diff, DifferenceEmpty):
+                break
+            if isinstance(diff, DifferenceTooLong):
+                logger.warning("Разрыв обновлений слишком большой - каналы догонит опрос")
+                known = set()
+                break
+
+            for update in diff.other_updates:
+                channel_id = _channel_id(update)
+                if isinstance(update, types.UpdateChannelTooLong):
+                    flagged.add(channel_id)
+                elif isinstance(update, types.UpdateNewChannelMessage) and channel_id in peers:
+                    messages.extend(_finish([update.message], client, diff))
+                    self._set_channel_pts(channel_id, update.pts)
+
+            state = diff.intermediate_state if isinstance(diff, DifferenceSlice) else diff.state
+            pts, qts, date = state.pts, state.qts, int(state.date.timestamp())
+            if not isinstance(diff, DifferenceSlice):
+                break
+
+        # Каналы с новыми событиями догоняем отдельно, остальным догонять нечего
+        covered = known - flagged
+        for channel_id in flagged & known:
+            channel_messages, complete = await self._channel_difference(client, channel_id, peers[channel_id])
+            messages.extend(channel_messages)
+            if complete:
+                covered.add(channel_id)
+
+        await self._seed(client, peers)
+        await self.save(client)
+        messages.sort(key=lambda message: (message.peer_id.channel_id, message.id))
+        return messages, covered
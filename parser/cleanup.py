@@ -0,0 +1,74 @@
+# cleanup.py
+import asyncio
+from collections import OrderedDict
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from config import CLEANUP_RATE, CLEANUP_MAX_PENDING
+from ratelimit import TokenBucket
+from metrics import RETRY_AFTER, QUEUE_DEPTH
+import logging
+
+logger = logging.getLogger(__name__)
+
+# deleteMessages принимает не больше 100 id за вызов
+DELETE_BATCH = 100
+
+
+class MessageCleaner:
+    """Фоновое удаление старых сообщений меню пачками через deleteMessages"""
+
+    def __init__(self, bot: Bot, rate: float = CLEANUP_RATE, max_pending: int = CLEANUP_MAX_PENDING):
+        self.bot = bot
+        self.rate = TokenBucket(rate)
+        self.max_pending = max_pending
+        self.pending = OrderedDict()  # chat_id -> set id сообщений, в порядке постановки
+        self.wakeup = asyncio.Event()
+        self.task = None
+        QUEUE_DEPTH.labels("cleanup").set_function(lambda: len(self.pending))
+
+    def schedule(self, chat_id: int, message_ids):
+        """Поставить сообщения на удаление; хендлер не ждёт самого удаления"""
+        if not message_ids:
+            return
+        self.pending.setdefault(chat_id, set()).update(message_ids)
+        self.pending.move_to_end(chat_id)
+        # Удаление косметическое: при переполнении теряем самые старые, память не растёт
+        while len(self.pending) > self.max_pending:
+            self.pending.popitem(last=False)
+        self.wakeup.set()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                chat_id, message_ids = self.pending.popitem(last=False)
+                message_ids = sorted(message_ids)
+                for i in range(0, len(message_ids), DELETE_BATCH):
+                    await self._delete(chat_id, message_ids[i:i + DELETE_BATCH])
+
+    async def _delete(self, chat_id: int, message_ids: list[int]):
+        await self.rate.acquire()
+        try:
+            await self.bot.delete_messages(chat_id, message_ids)
+        except TelegramRetryAfter as e:
+            RETRY_AFTER.labels("cleanup").inc()
+            # Возвращаем в очередь и ждём, сколько попросил Telegram
+            self.schedule(chat_id, message_ids)
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            # Сообщение старше 48 часов, чат недоступен и т.п. - удалять уже нечего
+            logger.debug(f"Не удалось удалить сообщения в {chat_id}: {e}")
@@ -4,4 +4,145 @@ API_HASH = "27f2c8f4ea5a997a0314ac812ed04317"
 DB_NAME = "database/bot.db"
 PHONE_NUMBER = '+16318956428'
 CHECK_INTERVAL = 60
-RECONNECT_INTERVAL = 1800
+
+# Соединение аккаунта: пинг раз в CONNECTION_PING_INTERVAL с, переподключение после
+# CONNECTION_PING_FAILURES неудачных пингов подряд с паузой от RECONNECT_BACKOFF_BASE до RECONNECT_BACKOFF_MAX
+CONNECTION_PING_INTERVAL = 60
+CONNECTION_PING_TIMEOUT = 10
+CONNECTION_PING_FAILURES = 2
+RECONNECT_BACKOFF_BASE = 1
+RECONNECT_BACKOFF_MAX = 300
+
+# Режим push: новые посты приходят через update-события Telethon,
+# периодический опрос остаётся редкой сверкой
+PUSH_MODE = True
+RECONCILE_INTERVAL = 900
+CHANNELS_REFRESH_INTERVAL = 15
+
+# Подписки меняет бот в своём процессе: монитор раз в SUBSCRIPTIONS_SYNC_INTERVAL с применяет
+# к индексу подписчиков новые записи журнала изменений, записи старше SUBSCRIPTION_CHANGES_TTL удаляются
+SUBSCRIPTIONS_SYNC_INTERVAL = 2
+SUBSCRIPTION_CHANGES_TTL = 24 * 3600
+
+# Параллельная проверка каналов
+CHECK_CONCURRENCY = 8
+ACCOUNT_REQUESTS_PER_SECOND = 5
+ACCOUNT_REQUESTS_BURST = 10
+
+# Пул соединений с базой
+DB_READERS = 4
+DB_STATEMENT_CACHE = 256
+
+# Кэш резолва каналов (username -> peer) в памяти
+PEER_CACHE_SIZE = 1024
+
+# Рассылка уведомлений: лимиты Bot API (~30 сообщений/с всего, ~1/с в один чат)
+DELIVERY_WORKERS = 4
+DELIVERY_GLOBAL_RATE = 25
+DELIVERY_PER_CHAT_INTERVAL = 1.0
+DELIVERY_MAX_ATTEMPTS = 5
+
+# Кэш file_id загруженных медиа
+MEDIA_CACHE_TTL = 3600
+MEDIA_CACHE_SIZE = 512
+
+# Догонялки после простоя: сколько постов читать за раз и сколько последних слать при большом разрыве
+CATCHUP_MAX_POSTS = 200
+CATCHUP_TAIL_POSTS = 5
+
+# Шардирование монитора: shard_id -> (файл сессии, телефон аккаунта).
+# Запуск шарда: python monitor.py <shard_id>
+SHARDS = {}
+SHARD_HEARTBEAT_INTERVAL = 30
+SHARD_TTL = 90
+SHARD_VNODES = 64
+
+# Адаптивный опрос: интервал канала от CHECK_INTERVAL (RECONCILE_INTERVAL в push-режиме)
+# до POLL_MAX_INTERVAL в зависимости от частоты его постов
+POLL_MAX_INTERVAL = 3600
+POLL_RATE_SMOOTHING = 0.3
+POLL_TARGET_POSTS = 1
+
+# Догонялки через getDifference после рестарта/переподключения
+UPDATE_STATE_SAVE_INTERVAL = 60
+CHANNEL_DIFFERENCE_LIMIT = 100
+
+# Фоновая подписка на каналы: пауза между вступлениями и экспоненциальные повторы при ошибках
+JOIN_INTERVAL = 3
+JOIN_RETRY_BASE = 60
+JOIN_RETRY_MAX = 6 * 3600
+
+# Бот: время жизни состояния FSM и фоновая очистка старых сообщений меню
+FSM_TTL = 24 * 3600
+FSM_PURGE_INTERVAL = 600
+CLEANUP_RATE = 10
+CLEANUP_MAX_PENDING = 10000
+
+# Webhook вместо long polling: если BOT_WEBHOOK_URL (публичный https-адрес) задан, бот слушает
+# WEBHOOK_HOST:WEBHOOK_PORT + WEBHOOK_PATH. Пустой WEBHOOK_SECRET - случайный на каждый запуск.
+# Одновременно обрабатывается не больше WEBHOOK_MAX_CONCURRENCY апдейтов; сверх этого запрос ждёт
+# WEBHOOK_QUEUE_TIMEOUT с и получает 503, и Telegram повторяет доставку позже
+BOT_WEBHOOK_URL = ""
+WEBHOOK_HOST = "127.0.0.1"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_SECRET = ""
+WEBHOOK_MAX_CONNECTIONS = 40
+WEBHOOK_MAX_CONCURRENCY = 100
+WEBHOOK_QUEUE_TIMEOUT = 5
+
+# Метрики в формате Prometheus: http://METRICS_HOST:порт/metrics, 0 - не поднимать эндпоинт.
+# Шарды монитора занимают порты METRICS_MONITOR_PORT + номер шарда в SHARDS
+METRICS_HOST = "127.0.0.1"
+METRICS_BOT_PORT = 9100
+METRICS_MONITOR_PORT = 9101
+
+# Альбомы: сколько ждать остальные части после первой, с; лимит размера файла для загрузки ботом
+ALBUM_WAIT = 2
+MEDIA_MAX_SIZE = 50 * 1024 * 1024
+
+# Подавление дублей: один и тот же контент из разных каналов пользователь получает один раз
+# за DEDUP_WINDOW секунд; в памяти - DEDUP_MEMORY_SIZE отпечатков, остальные в базе
+DEDUP_WINDOW = 24 * 3600
+DEDUP_MEMORY_SIZE = 50000
+
+# Фильтры подписок: монитор перечитывает их раз в FILTERS_REFRESH_INTERVAL с;
+# лимиты на число фильтров одной подписки и длину слова/выражения
+FILTERS_REFRESH_INTERVAL = 60
+FILTERS_MAX_PER_SUBSCRIPTION = 20
+FILTER_PATTERN_MAX_LENGTH = 200
+# Выражение, проверка которого на одном посте заняла дольше FILTER_REGEX_BUDGET с, отключается
+FILTER_REGEX_BUDGET = 0.05
+
+# Дайджесты: пользователь может получать посты сводкой со ссылками раз в окно из DIGEST_WINDOWS
+# (с, 0 - каждый пост отдельным сообщением). Если у пользователя в рассылке скопилось
+# DIGEST_BACKLOG_THRESHOLD неотправленных сообщений, новые посты и без настройки собираются
+# в дайджест за DIGEST_BACKLOG_WINDOW с. Процесс рассылки перечитывает настройки раз в DIGEST_SETTINGS_REFRESH с
+DIGEST_WINDOWS = (0, 15 * 60, 3600, 3 * 3600)
+DIGEST_BACKLOG_THRESHOLD = 20
+DIGEST_BACKLOG_WINDOW = 60
+DIGEST_SETTINGS_REFRESH = 60
+DIGEST_ITEM_LENGTH = 100
+
+# Многопроцессный запуск (python supervisor.py): бот, мониторы (по одному на шард) и DELIVERY_PROCESSES
+# процессов рассылки. Мониторы пишут посты и доставки в outbox в базе, процесс рассылки k забирает
+# доставки пользователей с user_id % DELIVERY_PROCESSES == k пачками по OUTBOX_BATCH и держит в работе
+# не больше OUTBOX_MAX_PENDING; лимит DELIVERY_GLOBAL_RATE делится между процессами.
+# Медиа постов лежат в MEDIA_SPOOL_DIR, пока пост не разослан всем
+DELIVERY_PROCESSES = 2
+OUTBOX_POLL_INTERVAL = 1
+OUTBOX_BATCH = 500
+OUTBOX_MAX_PENDING = 5000
+MEDIA_SPOOL_DIR = "database/media"
+METRICS_DELIVERY_PORT = 9200
+SUPERVISOR_RESTART_BASE = 1
+SUPERVISOR_RESTART_MAX = 60
+SUPERVISOR_STABLE_TIME = 60
+
+# Пост, который монитор не смог записать в outbox (ошибка базы и т.п.), повторяется через POST_RETRY_DELAY с;
+# после POST_RETRY_ATTEMPTS попыток он пропускается, и курсор канала идёт дальше. Отметки о разосланных
+# доставках хранятся OUTBOX_SENT_TTL с: если монитор перечитает уже разосланный пост, он не уйдёт повторно
+POST_RETRY_ATTEMPTS = 3
+POST_RETRY_DELAY = 30
+OUTBOX_SENT_TTL = 7 * 24 * 3600
+SUPERVISOR_STOP_TIMEOUT = 30
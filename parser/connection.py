@@ -0,0 +1,154 @@
+# connection.py
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Callable
+from telethon import TelegramClient
+from telethon.tl.functions import PingRequest
+from config import (
+    API_ID, API_HASH, CONNECTION_PING_INTERVAL, CONNECTION_PING_TIMEOUT, CONNECTION_PING_FAILURES,
+    RECONNECT_BACKOFF_BASE, RECONNECT_BACKOFF_MAX
+)
+from metrics import CONNECTION_STATE, CONNECTION_TRANSITIONS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Состояния соединения
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+RECONNECTING = "reconnecting"
+STATES = (DISCONNECTED, CONNECTING, CONNECTED, RECONNECTING)
+
+# Сколько последних переходов хранить для диагностики
+HISTORY_SIZE = 50
+
+
+class ConnectionSupervisor:
+    """Одно долгоживущее соединение аккаунта: пинги, переподключение только при реальном сбое.
+
+    Клиент не пересоздаётся - сессия, кэш сущностей и обработчики событий остаются на месте"""
+
+    def __init__(self, session: str, phone: str, client_factory: Callable[[], TelegramClient] = None):
+        self.session = session
+        self.phone = phone
+        self.client_factory = client_factory or (lambda: TelegramClient(session, API_ID, API_HASH))
+        self.client = None
+        self.state = DISCONNECTED
+        self.history = deque(maxlen=HISTORY_SIZE)  # (time.time(), из, в)
+        self.listeners = []                        # callback(старое состояние, новое)
+        self.failures = 0
+        self.check_requested = asyncio.Event()
+        self.reconnect_lock = asyncio.Lock()
+        self.task = None
+        for state in STATES:
+            CONNECTION_STATE.labels(session, state).set_function(lambda state=state: float(self.state == state))
+
+    @property
+    def connected(self) -> bool:
+        return self.state == CONNECTED and self.client is not None and self.client.is_connected()
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        old, self.state = self.state, state
+        self.history.append((time.time(), old, state))
+        CONNECTION_TRANSITIONS.labels(self.session, state).inc()
+        logger.info(f"Соединение {self.session}: {old} -> {state}")
+        for listener in self.listeners:
+            try:
+                listener(old, state)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика состояния соединения: {e}")
+
+    async def connect(self) -> bool:
+        """Первое подключение с авторизацией; дальше соединение поддерживает фоновая задача"""
+        if self.client is not None:
+            return self.connected
+        self._set_state(CONNECTING)
+        try:
+            client = self.client_factory()
+            await client.start(phone=self.phone)
+        except Exception as e:
+            logger.error(f"Ошибка подключения: {e}")
+            self._set_state(DISCONNECTED)
+            return False
+
+        self.client = client
+        self._set_state(CONNECTED)
+        self.task = asyncio.create_task(self._supervise())
+        return True
+
+    def check_now(self):
+        """Запрос проверить соединение, не дожидаясь очередного пинга (например, после ошибки сети)"""
+        self.check_requested.set()
+
+    async def _supervise(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.check_requested.wait(), CONNECTION_PING_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.check_requested.clear()
+
+            if await self._healthy():
+                self.failures = 0
+                continue
+            self.failures += 1
+            logger.warning(f"Проверка соединения {self.session} не прошла ({self.failures} подряд)")
+            if self.failures >= CONNECTION_PING_FAILURES or not self.client.is_connected():
+                await self.reconnect()
+
+    async def _healthy(self) -> bool:
+        if not self.client.is_connected():
+            return False
+        try:
+            await asyncio.wait_for(
+                self.client(PingRequest(ping_id=random.getrandbits(63))), CONNECTION_PING_TIMEOUT
+            )
+            return True
+        except Exception as e:
+            logger.debug(f"Пинг {self.session} не прошёл: {e}")
+            return False
+
+    def backoff(self, attempt: int) -> float:
+        """Экспоненциальная пауза с джиттером, чтобы шарды не переподключались синхронно"""
+        return min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def reconnect(self):
+        """Переподключить тот же клиент; повторяем с нарастающей паузой до успеха"""
+        async with self.reconnect_lock:
+            if await self._healthy():
+                self.failures = 0
+                return
+            self._set_state(RECONNECTING)
+            attempt = 0
+            while True:
+                try:
+                    if self.client.is_connected():
+                        await self.client.disconnect()
+                    await self.client.connect()
+                    if not await self.client.is_user_authorized():
+                        raise ConnectionError("сессия больше не авторизована")
+                    break
+                except Exception as e:
+                    delay = self.backoff(attempt)
+                    attempt += 1
+                    logger.error(f"Переподключение {self.session} не удалось ({e}), повтор через {delay:.1f} с")
+                    await asyncio.sleep(delay)
+            self.failures = 0
+            self._set_state(CONNECTED)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.client is not None and self.client.is_connected():
+            await self.client.disconnect()
+        self._set_state(DISCONNECTED)
@@ -1,81 +1,113 @@
-import aiosqlite
 from config import DB_NAME
+from database.pool import ConnectionPool
+from database.migrations import migrate
+from database.utils import normalize_username
+from metrics import timed, DB_QUERY_SECONDS
 
-async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-        # Таблица пользователей (user_id, личный канал)
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER,
-            user_channel TEXT PRIMARY KEY
-        )
-        """)
+# Общий пул соединений; открывается в init_db, закрывается в close_db
+pool = ConnectionPool(DB_NAME)
 
-        # Таблица каналов для мониторинга
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS monitor_channels (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_channel TEXT,
-            monitor_channel TEXT,
-            is_subscribed INTEGER DEFAULT 0,
-            FOREIGN KEY(user_channel) REFERENCES users(user_channel)
-        )
-        """)
+# Каналы, у которых есть хотя бы один подписчик (индекс idx_subscriptions_channel)
+MONITORED = "EXISTS (SELECT 1 FROM subscriptions s WHERE s.channel_id = c.id)"
 
-        # Таблица для хранения последних проверенных постов
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS last_posts (
-            monitor_channel TEXT PRIMARY KEY,
-            last_post_id INTEGER DEFAULT 0
-        )
-        """)
-        await db.commit()
+# Каналы хранятся по каноническому username (см. normalize_username);
+# функции принимают и ссылку в любом виде.
+# Время каждой функции пишется в parser_db_query_seconds{function=...}
+
+async def init_db():
+    await pool.open()
+    async with pool.write() as db:
+        await migrate(db)
+
+async def close_db():
+    await pool.close()
 
 # Функции для работы с подписками
+@timed(DB_QUERY_SECONDS)
 async def set_channel_subscribed(monitor_channel: str, subscribed: bool = True):
-    async with aiosqlite.connect(DB_NAME) as db:
+    # Любая смена статуса начинает попытки подписки заново
+    async with pool.write() as db:
         await db.execute("""
-        UPDATE monitor_channels SET is_subscribed = ? WHERE monitor_channel = ?
-        """, (1 if subscribed else 0, monitor_channel))
-        await db.commit()
+        UPDATE channels SET is_subscribed = ?, join_attempts = 0, join_error = NULL, join_retry_at = 0
+        WHERE username = ?
+        """, (1 if subscribed else 0, normalize_username(monitor_channel)))
 
+@timed(DB_QUERY_SECONDS)
 async def is_channel_subscribed(monitor_channel: str) -> bool:
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute(
-                "SELECT is_subscribed FROM monitor_channels WHERE monitor_channel = ? LIMIT 1",
-                (monitor_channel,)
+                "SELECT is_subscribed FROM channels WHERE username = ?",
+                (normalize_username(monitor_channel),)
         ) as cursor:
             result = await cursor.fetchone()
             return bool(result[0]) if result else False
 
+@timed(DB_QUERY_SECONDS)
 async def get_channels_to_subscribe() -> tuple[str]:
-    """Получить каналы, на которые нужно подписаться"""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("""
-            SELECT DISTINCT monitor_channel 
-            FROM monitor_channels 
-            WHERE is_subscribed = 0
+    """Получить каналы, на которые нужно подписаться и время повтора для которых подошло"""
+    async with pool.read() as db:
+        async with db.execute(f"""
+            SELECT username FROM channels c
+            WHERE is_subscribed = 0 AND join_retry_at <= strftime('%s', 'now') AND {MONITORED}
+            ORDER BY join_attempts, join_retry_at
         """) as cursor:
             rows = await cursor.fetchall()
             return tuple(row[0] for row in rows)
 
-async def add_user_channel(user_id: int, user_channel: str):
-    async with aiosqlite.connect(DB_NAME) as db:
+@timed(DB_QUERY_SECONDS)
+async def get_next_join_retry() -> int | None:
+    """Ближайшее время (unix) повторной попытки подписки, если такие есть"""
+    async with pool.read() as db:
+        async with db.execute(f"""
+            SELECT MIN(join_retry_at) FROM channels c
+            WHERE is_subscribed = 0 AND {MONITORED}
+        """) as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else None
+
+@timed(DB_QUERY_SECONDS)
+async def record_join_failure(monitor_channel: str, error: str, retry_at: int):
+    async with pool.write() as db:
         await db.execute("""
+        UPDATE channels SET join_attempts = join_attempts + 1, join_error = ?, join_retry_at = ?
+        WHERE username = ?
+        """, (error, retry_at, normalize_username(monitor_channel)))
+
+@timed(DB_QUERY_SECONDS)
+async def get_join_attempts(monitor_channel: str) -> int:
+    async with pool.read() as db:
+        async with db.execute(
+                "SELECT join_attempts FROM channels WHERE username = ?",
+                (normalize_username(monitor_channel),)
+        ) as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else 0
+
+@timed(DB_QUERY_SECONDS)
+async def add_user_channel(user_id: int, user_channel: str):
+    async with pool.write() as db:
+        cursor = await db.execute("""
         INSERT OR IGNORE INTO users (user_id, user_channel) VALUES (?, ?)
         """, (user_id, user_channel))
-        await db.commit()
+        if cursor.rowcount:
+            await _log_subscription_change(db, 'user', user_id, user_channel, None)
 
+@timed(DB_QUERY_SECONDS)
 async def add_monitor_channel(user_channel: str, monitor_channel: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-        INSERT INTO monitor_channels (user_channel, monitor_channel) VALUES (?, ?)
-        """, (user_channel, monitor_channel))
-        await db.commit()
+    async with pool.write() as db:
+        username = normalize_username(monitor_channel)
+        await db.execute("INSERT OR IGNORE INTO channels (username) VALUES (?)", (username,))
+        cursor = await db.execute("""
+        INSERT OR IGNORE INTO subscriptions (user_channel, channel_id)
+        SELECT ?, id FROM channels WHERE username = ?
+        """, (user_channel, username))
+        if cursor.rowcount:
+            await _log_subscription_change(db, 'add', None, user_channel, username)
 
 # Получить все каналы пользователя
+@timed(DB_QUERY_SECONDS)
 async def get_user_channels(user_id: int) -> tuple[str, ...]:
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute(
                 "SELECT user_channel FROM users WHERE user_id = ?",
                 (user_id,)
@@ -84,18 +116,21 @@ async def get_user_channels(user_id: int) -> tuple[str, ...]:
             return tuple(row[0] for row in rows)
 
 # Получить все мониторинговые каналы для пользовательского канала
+@timed(DB_QUERY_SECONDS)
 async def get_monitor_channels(user_channel: str) -> tuple[str, ...]:
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute(
-                "SELECT monitor_channel FROM monitor_channels WHERE user_channel = ?",
-                (user_channel,)
-        ) as cursor:
+    async with pool.read() as db:
+        async with db.execute("""
+            SELECT c.username FROM subscriptions s
+            JOIN channels c ON c.id = s.channel_id
+            WHERE s.user_channel = ?
+        """, (user_channel,)) as cursor:
             rows = await cursor.fetchall()
             return tuple(row[0] for row in rows)
 
 # Проверить существует ли пользовательский канал
+@timed(DB_QUERY_SECONDS)
 async def user_channel_exists(user_channel: str) -> bool:
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute(
                 "SELECT 1 FROM users WHERE user_channel = ?",
                 (user_channel,)
@@ -103,45 +138,476 @@ async def user_channel_exists(user_channel: str) -> bool:
             return await cursor.fetchone() is not None
 
 # Удалить мониторинговый канал
+@timed(DB_QUERY_SECONDS)
 async def remove_monitor_channel(user_channel: str, monitor_channel: str):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-                "DELETE FROM monitor_channels WHERE user_channel = ? AND monitor_channel = ?",
-                (user_channel, monitor_channel)
-        )
-        await db.commit()
+    username = normalize_username(monitor_channel)
+    async with pool.write() as db:
+        # Фильтры подписки удаляются вместе с ней
+        removed = 0
+        for table in ("subscriptions", "subscription_filters"):
+            cursor = await db.execute(f"""
+            DELETE FROM {table}
+            WHERE user_channel = ? AND channel_id = (SELECT id FROM channels WHERE username = ?)
+            """, (user_channel, username))
+            removed = removed or cursor.rowcount
+        if removed:
+            await _log_subscription_change(db, 'remove', None, user_channel, username)
 
+@timed(DB_QUERY_SECONDS)
 async def get_last_post_id(monitor_channel: str) -> int:
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute(
-                "SELECT last_post_id FROM last_posts WHERE monitor_channel = ?",
-                (monitor_channel,)
+                "SELECT last_post_id FROM channels WHERE username = ?",
+                (normalize_username(monitor_channel),)
         ) as cursor:
             result = await cursor.fetchone()
             return result[0] if result else 0
 
+@timed(DB_QUERY_SECONDS)
 async def update_last_post_id(monitor_channel: str, post_id: int):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         await db.execute("""
-        INSERT OR REPLACE INTO last_posts (monitor_channel, last_post_id) VALUES (?, ?)
-        """, (monitor_channel, post_id))
-        await db.commit()
+        UPDATE channels SET last_post_id = MAX(last_post_id, ?) WHERE username = ?
+        """, (post_id, normalize_username(monitor_channel)))
 
 # Получить всех пользователей, которые мониторят канал
+@timed(DB_QUERY_SECONDS)
 async def get_users_monitoring_channel(monitor_channel: str) -> tuple[int]:
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         async with db.execute("""
-            SELECT DISTINCT u.user_id 
-            FROM users u 
-            JOIN monitor_channels mc ON u.user_channel = mc.user_channel 
-            WHERE mc.monitor_channel = ?
-        """, (monitor_channel,)) as cursor:
+            SELECT DISTINCT u.user_id
+            FROM channels c
+            JOIN subscriptions s ON s.channel_id = c.id
+            JOIN users u ON u.user_channel = s.user_channel
+            WHERE c.username = ?
+        """, (normalize_username(monitor_channel),)) as cursor:
             rows = await cursor.fetchall()
             return tuple(row[0] for row in rows)
 
 # Получить все уникальные каналы для мониторинга
+@timed(DB_QUERY_SECONDS)
 async def get_all_monitor_channels() -> tuple[str]:
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT DISTINCT monitor_channel FROM monitor_channels") as cursor:
+    async with pool.read() as db:
+        async with db.execute(f"SELECT username FROM channels c WHERE {MONITORED}") as cursor:
+            rows = await cursor.fetchall()
+            return tuple(row[0] for row in rows)
+
+# Получить каналы, на которые уже оформлена подписка
+@timed(DB_QUERY_SECONDS)
+async def get_subscribed_channels() -> tuple[str]:
+    async with pool.read() as db:
+        async with db.execute(f"""
+            SELECT username FROM channels c
+            WHERE is_subscribed = 1 AND {MONITORED}
+        """) as cursor:
+            rows = await cursor.fetchall()
+            return tuple(row[0] for row in rows)
+
+# Загрузить состояние всех каналов одним запросом: {канал: (last_post_id, is_subscribed)}
+@timed(DB_QUERY_SECONDS)
+async def get_channels_state() -> dict[str, tuple[int, bool]]:
+    async with pool.read() as db:
+        async with db.execute(f"""
+            SELECT username, last_post_id, is_subscribed FROM channels c
+            WHERE {MONITORED}
+        """) as cursor:
+            rows = await cursor.fetchall()
+            return {row[0]: (row[1], bool(row[2])) for row in rows}
+
+# Записать продвинутые курсоры пачкой в одной транзакции
+@timed(DB_QUERY_SECONDS)
+async def update_last_post_ids(cursors: dict[str, int]):
+    if not cursors:
+        return
+    async with pool.write() as db:
+        await db.executemany("""
+        UPDATE channels SET last_post_id = MAX(last_post_id, ?) WHERE username = ?
+        """, [(post_id, normalize_username(channel)) for channel, post_id in cursors.items()])
+
+# Кэш резолва каналов
+@timed(DB_QUERY_SECONDS)
+async def get_channel_peer(session: str, username: str) -> tuple[int, int] | None:
+    async with pool.read() as db:
+        async with db.execute(
+                "SELECT channel_id, access_hash FROM channel_peers WHERE session = ? AND username = ?",
+                (session, username)
+        ) as cursor:
+            result = await cursor.fetchone()
+            return (result[0], result[1]) if result else None
+
+@timed(DB_QUERY_SECONDS)
+async def get_channel_peers(session: str, limit: int) -> dict[str, tuple[int, int]]:
+    """Последние сохранённые пиры - для прогрева кэша при старте"""
+    async with pool.read() as db:
+        async with db.execute("""
+            SELECT username, channel_id, access_hash FROM channel_peers
+            WHERE session = ? ORDER BY updated_at DESC LIMIT ?
+        """, (session, limit)) as cursor:
+            rows = await cursor.fetchall()
+            return {row[0]: (row[1], row[2]) for row in rows}
+
+@timed(DB_QUERY_SECONDS)
+async def save_channel_peer(session: str, username: str, channel_id: int, access_hash: int):
+    async with pool.write() as db:
+        await db.execute("""
+        INSERT OR REPLACE INTO channel_peers (session, username, channel_id, access_hash, updated_at)
+        VALUES (?, ?, ?, ?, strftime('%s', 'now'))
+        """, (session, username, channel_id, access_hash))
+
+@timed(DB_QUERY_SECONDS)
+async def delete_channel_peer(session: str, username: str):
+    async with pool.write() as db:
+        await db.execute(
+                "DELETE FROM channel_peers WHERE session = ? AND username = ?",
+                (session, username)
+        )
+
+# Полная выгрузка подписок - для индекса подписчиков в памяти
+@timed(DB_QUERY_SECONDS)
+async def get_all_user_channels() -> tuple[tuple[int, str], ...]:
+    async with pool.read() as db:
+        async with db.execute("SELECT user_id, user_channel FROM users") as cursor:
+            rows = await cursor.fetchall()
+            return tuple((row[0], row[1]) for row in rows)
+
+@timed(DB_QUERY_SECONDS)
+async def get_all_subscriptions() -> tuple[tuple[str, str], ...]:
+    async with pool.read() as db:
+        async with db.execute("""
+            SELECT s.user_channel, c.username FROM subscriptions s
+            JOIN channels c ON c.id = s.channel_id
+        """) as cursor:
+            rows = await cursor.fetchall()
+            return tuple((row[0], row[1]) for row in rows)
+
+# Журнал изменений подписок: по нему индекс подписчиков в других процессах догоняет базу
+async def _log_subscription_change(db, op: str, user_id: int | None, user_channel: str, monitor_channel: str | None):
+    """Запись в журнал - в транзакции самого изменения"""
+    await db.execute("""
+    INSERT INTO subscription_changes (op, user_id, user_channel, monitor_channel) VALUES (?, ?, ?, ?)
+    """, (op, user_id, user_channel, monitor_channel))
+
+@timed(DB_QUERY_SECONDS)
+async def get_subscriptions_version() -> int:
+    """Номер последнего изменения подписок (не уменьшается и после очистки журнала)"""
+    async with pool.read() as db:
+        async with db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'subscription_changes'") as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else 0
+
+@timed(DB_QUERY_SECONDS)
+async def get_subscription_changes(after: int) -> tuple[int | None, tuple[tuple[int, str, int | None, str, str | None], ...]]:
+    """Самая старая версия в журнале и изменения после after: (version, op, user_id, user_channel, канал)"""
+    async with pool.read() as db:
+        async with db.execute("SELECT MIN(version) FROM subscription_changes") as cursor:
+            first = (await cursor.fetchone())[0]
+        async with db.execute("""
+            SELECT version, op, user_id, user_channel, monitor_channel FROM subscription_changes
+            WHERE version > ? ORDER BY version
+        """, (after,)) as cursor:
+            return first, tuple(await cursor.fetchall())
+
+@timed(DB_QUERY_SECONDS)
+async def delete_old_subscription_changes(ttl: int):
+    async with pool.write() as db:
+        await db.execute(
+                "DELETE FROM subscription_changes WHERE created_at < strftime('%s', 'now') - ?",
+                (ttl,)
+        )
+
+# Фильтры подписок (см. filters.py)
+@timed(DB_QUERY_SECONDS)
+async def get_subscription_filters(user_channel: str, monitor_channel: str) -> tuple[tuple[str, str, bool], ...]:
+    """Фильтры подписки: (kind, pattern, is_regex)"""
+    async with pool.read() as db:
+        async with db.execute("""
+            SELECT f.kind, f.pattern, f.is_regex FROM subscription_filters f
+            JOIN channels c ON c.id = f.channel_id
+            WHERE f.user_channel = ? AND c.username = ?
+            ORDER BY f.kind, f.pattern
+        """, (user_channel, normalize_username(monitor_channel))) as cursor:
+            rows = await cursor.fetchall()
+            return tuple((row[0], row[1], bool(row[2])) for row in rows)
+
+@timed(DB_QUERY_SECONDS)
+async def add_subscription_filter(user_channel: str, monitor_channel: str, kind: str, pattern: str, is_regex: bool):
+    async with pool.write() as db:
+        await db.execute("""
+        INSERT OR IGNORE INTO subscription_filters (user_channel, channel_id, kind, pattern, is_regex)
+        SELECT ?, id, ?, ?, ? FROM channels WHERE username = ?
+        """, (user_channel, kind, pattern, int(is_regex), normalize_username(monitor_channel)))
+
+@timed(DB_QUERY_SECONDS)
+async def remove_subscription_filter(user_channel: str, monitor_channel: str, kind: str, pattern: str, is_regex: bool):
+    async with pool.write() as db:
+        await db.execute("""
+        DELETE FROM subscription_filters
+        WHERE user_channel = ? AND channel_id = (SELECT id FROM channels WHERE username = ?)
+          AND kind = ? AND pattern = ? AND is_regex = ?
+        """, (user_channel, normalize_username(monitor_channel), kind, pattern, int(is_regex)))
+
+@timed(DB_QUERY_SECONDS)
+async def get_all_filters() -> tuple[tuple[str, str, str, str, bool], ...]:
+    """Все фильтры: (user_channel, канал, kind, pattern, is_regex)"""
+    async with pool.read() as db:
+        async with db.execute("""
+            SELECT f.user_channel, c.username, f.kind, f.pattern, f.is_regex FROM subscription_filters f
+            JOIN channels c ON c.id = f.channel_id
+        """) as cursor:
+            rows = await cursor.fetchall()
+            return tuple((row[0], row[1], row[2], row[3], bool(row[4])) for row in rows)
+
+# Настройки пользователя: окно дайджеста (см. digest.py)
+@timed(DB_QUERY_SECONDS)
+async def get_digest_window(user_id: int) -> int:
+    async with pool.read() as db:
+        async with db.execute("SELECT digest_window FROM user_settings WHERE user_id = ?", (user_id,)) as cursor:
+            result = await cursor.fetchone()
+            return result[0] if result else 0
+
+@timed(DB_QUERY_SECONDS)
+async def set_digest_window(user_id: int, window: int):
+    async with pool.write() as db:
+        await db.execute("""
+        INSERT INTO user_settings (user_id, digest_window) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET digest_window = excluded.digest_window
+        """, (user_id, window))
+
+@timed(DB_QUERY_SECONDS)
+async def get_digest_windows() -> dict[int, int]:
+    """Пользователи с включённым дайджестом: user_id -> окно, с"""
+    async with pool.read() as db:
+        async with db.execute("SELECT user_id, digest_window FROM user_settings WHERE digest_window > 0") as cursor:
+            return {row[0]: row[1] for row in await cursor.fetchall()}
+
+# Шардирование каналов между аккаунтами
+@timed(DB_QUERY_SECONDS)
+async def shard_heartbeat(shard_id: str):
+    async with pool.write() as db:
+        await db.execute("""
+        INSERT OR REPLACE INTO shards (shard_id, heartbeat) VALUES (?, strftime('%s', 'now'))
+        """, (shard_id,))
+
+@timed(DB_QUERY_SECONDS)
+async def remove_shard(shard_id: str):
+    async with pool.write() as db:
+        await db.execute("DELETE FROM shards WHERE shard_id = ?", (shard_id,))
+
+@timed(DB_QUERY_SECONDS)
+async def get_live_shards(ttl: int) -> tuple[str, ...]:
+    async with pool.read() as db:
+        async with db.execute(
+                "SELECT shard_id FROM shards WHERE heartbeat >= strftime('%s', 'now') - ? ORDER BY shard_id",
+                (ttl,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+            return tuple(row[0] for row in rows)
+
+@timed(DB_QUERY_SECONDS)
+async def get_channel_assignments() -> dict[str, str]:
+    async with pool.read() as db:
+        async with db.execute(f"""
+            SELECT username, shard_id FROM channels c
+            WHERE shard_id IS NOT NULL AND {MONITORED}
+        """) as cursor:
+            rows = await cursor.fetchall()
+            return {row[0]: row[1] for row in rows}
+
+@timed(DB_QUERY_SECONDS)
+async def get_shard_channels(shard_id: str) -> tuple[str, ...]:
+    async with pool.read() as db:
+        async with db.execute(
+                "SELECT username FROM channels WHERE shard_id = ?",
+                (shard_id,)
+        ) as cursor:
             rows = await cursor.fetchall()
             return tuple(row[0] for row in rows)
+
+@timed(DB_QUERY_SECONDS)
+async def save_channel_assignments(assignments: dict[str, str], moved: list[str]):
+    """Записать новое распределение; переехавшие каналы новый аккаунт должен подписать заново"""
+    async with pool.write() as db:
+        await db.execute("UPDATE channels SET shard_id = NULL WHERE shard_id IS NOT NULL")
+        await db.executemany(
+                "UPDATE channels SET shard_id = ? WHERE username = ?",
+                [(shard_id, normalize_username(channel)) for channel, shard_id in assignments.items()]
+        )
+        await db.executemany(
+                "UPDATE channels SET is_subscribed = 0, join_attempts = 0, join_error = NULL, join_retry_at = 0 "
+                "WHERE username = ?",
+                [(normalize_username(channel),) for channel in moved]
+        )
+
+# Состояние обновлений Telegram: {channel_id: (pts, qts, date, seq)}, channel_id = 0 - общее
+@timed(DB_QUERY_SECONDS)
+async def get_update_state(session: str) -> dict[int, tuple[int, int, int, int]]:
+    async with pool.read() as db:
+        async with db.execute(
+                "SELECT channel_id, pts, qts, date, seq FROM update_state WHERE session = ?",
+                (session,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+            return {row[0]: (row[1], row[2], row[3], row[4]) for row in rows}
+
+@timed(DB_QUERY_SECONDS)
+async def save_update_state(session: str, states: dict[int, tuple[int, int, int, int]]):
+    if not states:
+        return
+    async with pool.write() as db:
+        await db.executemany("""
+        INSERT OR REPLACE INTO update_state (session, channel_id, pts, qts, date, seq)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, [(session, channel_id, *state) for channel_id, state in states.items()])
+
+# Хранилище FSM бота: state/data по ключу с временем истечения (unix)
+@timed(DB_QUERY_SECONDS)
+async def get_fsm_record(key: str) -> tuple[str | None, str | None] | None:
+    async with pool.read() as db:
+        async with db.execute(
+                "SELECT state, data FROM fsm_state WHERE key = ? AND expires_at > strftime('%s', 'now')",
+                (key,)
+        ) as cursor:
+            result = await cursor.fetchone()
+            return (result[0], result[1]) if result else None
+
+@timed(DB_QUERY_SECONDS)
+async def set_fsm_state(key: str, state: str | None, ttl: int):
+    async with pool.write() as db:
+        await db.execute("""
+        INSERT INTO fsm_state (key, state, expires_at) VALUES (?, ?, strftime('%s', 'now') + ?)
+        ON CONFLICT(key) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at
+        """, (key, state, ttl))
+        # Пустая запись не нужна - держим таблицу компактной
+        await db.execute("DELETE FROM fsm_state WHERE key = ? AND state IS NULL AND data IS NULL", (key,))
+
+@timed(DB_QUERY_SECONDS)
+async def set_fsm_data(key: str, data: str | None, ttl: int):
+    async with pool.write() as db:
+        await db.execute("""
+        INSERT INTO fsm_state (key, data, expires_at) VALUES (?, ?, strftime('%s', 'now') + ?)
+        ON CONFLICT(key) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+        """, (key, data, ttl))
+        await db.execute("DELETE FROM fsm_state WHERE key = ? AND state IS NULL AND data IS NULL", (key,))
+
+@timed(DB_QUERY_SECONDS)
+async def delete_expired_fsm() -> int:
+    async with pool.write() as db:
+        cursor = await db.execute("DELETE FROM fsm_state WHERE expires_at <= strftime('%s', 'now')")
+        return cursor.rowcount
+
+# Последнее сообщение меню пользователя: заменить новым и вернуть предыдущие для удаления
+@timed(DB_QUERY_SECONDS)
+async def replace_bot_messages(user_id: int, message_id: int) -> tuple[int, ...]:
+    async with pool.write() as db:
+        async with db.execute(
+                "SELECT message_id FROM bot_messages WHERE user_id = ?",
+                (user_id,)
+        ) as cursor:
+            previous = tuple(row[0] for row in await cursor.fetchall())
+        await db.execute("DELETE FROM bot_messages WHERE user_id = ?", (user_id,))
+        await db.execute(
+                "INSERT INTO bot_messages (user_id, message_id) VALUES (?, ?)",
+                (user_id, message_id)
+        )
+        return previous
+
+# Отпечатки доставленных постов: кто уже получил контент (см. dedup.py)
+@timed(DB_QUERY_SECONDS)
+async def get_delivered_users(fingerprints: list[str]) -> dict[str, set[int]]:
+    placeholders = ",".join("?" * len(fingerprints))
+    async with pool.read() as db:
+        async with db.execute(f"""
+            SELECT fingerprint, user_id FROM delivered_posts
+            WHERE fingerprint IN ({placeholders}) AND expires_at > strftime('%s', 'now')
+        """, fingerprints) as cursor:
+            result = {}
+            for fingerprint, user_id in await cursor.fetchall():
+                result.setdefault(fingerprint, set()).add(user_id)
+            return result
+
+@timed(DB_QUERY_SECONDS)
+async def save_delivered(rows: list[tuple[str, int, int]]):
+    if not rows:
+        return
+    async with pool.write() as db:
+        await db.executemany("""
+        INSERT OR REPLACE INTO delivered_posts (fingerprint, user_id, expires_at) VALUES (?, ?, ?)
+        """, rows)
+
+@timed(DB_QUERY_SECONDS)
+async def delete_expired_delivered():
+    async with pool.write() as db:
+        await db.execute("DELETE FROM delivered_posts WHERE expires_at <= strftime('%s', 'now')")
+
+# Outbox: посты и доставки мониторы -> процессы рассылки (см. notifier.py)
+@timed(DB_QUERY_SECONDS)
+async def enqueue_post(post_key: str | None, channel: str, payload: str | None, user_ids, cursor: int) -> bool:
+    """Записать пост и доставку каждому получателю в той же транзакции, что и курсор канала.
+    Повторная запись того же поста ничего не дублирует, в том числе уже разосланного (outbox_sent).
+    Возвращает False, если доставлять пост некому"""
+    async with pool.write() as db:
+        queued = False
+        if payload is not None and user_ids:
+            await db.execute(
+                    "INSERT OR IGNORE INTO outbox_posts (post_key, channel, payload) VALUES (?, ?, ?)",
+                    (post_key, normalize_username(channel), payload)
+            )
+            await db.executemany("""
+            INSERT OR IGNORE INTO outbox (post_key, user_id) SELECT ?1, ?2
+            WHERE NOT EXISTS (SELECT 1 FROM outbox_sent WHERE post_key = ?1 AND user_id = ?2)
+            """, [(post_key, user_id) for user_id in user_ids])
+            async with db.execute("SELECT 1 FROM outbox WHERE post_key = ? LIMIT 1", (post_key,)) as rows:
+                queued = await rows.fetchone() is not None
+            if not queued:
+                # Пост уже разослан всем получателям - перечитан после отставшего курсора
+                await db.execute("DELETE FROM outbox_posts WHERE post_key = ?", (post_key,))
+        await db.execute("""
+        UPDATE channels SET last_post_id = MAX(last_post_id, ?) WHERE username = ?
+        """, (cursor, normalize_username(channel)))
+        return queued
+
+@timed(DB_QUERY_SECONDS)
+async def get_outbox_batch(partition: int, partitions: int, after_id: int, limit: int
+                           ) -> tuple[tuple[int, str, int, str, str], ...]:
+    """Доставки раздела после after_id: (id, post_key, user_id, channel, payload)"""
+    async with pool.read() as db:
+        async with db.execute("""
+            SELECT o.id, o.post_key, o.user_id, p.channel, p.payload
+            FROM outbox o JOIN outbox_posts p ON p.post_key = o.post_key
+            WHERE o.id > ? AND o.user_id % ? = ?
+            ORDER BY o.id LIMIT ?
+        """, (after_id, partitions, partition, limit)) as cursor:
+            return tuple(await cursor.fetchall())
+
+@timed(DB_QUERY_SECONDS)
+async def ack_outbox(ids: list[int], sent_ttl: int) -> tuple[str, ...]:
+    """Удалить выполненные доставки и посты, доставок которых не осталось; отметки о доставке
+    хранятся sent_ttl с. Возвращает payload удалённых постов (по ним чистятся файлы медиа)"""
+    if not ids:
+        return ()
+    async with pool.write() as db:
+        placeholders = ",".join("?" * len(ids))
+        await db.execute(f"""
+            INSERT OR REPLACE INTO outbox_sent (post_key, user_id, expires_at)
+            SELECT post_key, user_id, strftime('%s', 'now') + ? FROM outbox WHERE id IN ({placeholders})
+        """, (sent_ttl, *ids))
+        async with db.execute(
+                f"SELECT DISTINCT post_key FROM outbox WHERE id IN ({placeholders})", ids
+        ) as cursor:
+            post_keys = [row[0] for row in await cursor.fetchall()]
+        await db.execute(f"DELETE FROM outbox WHERE id IN ({placeholders})", ids)
+
+        placeholders = ",".join("?" * len(post_keys))
+        async with db.execute(f"""
+            SELECT post_key, payload FROM outbox_posts p
+            WHERE post_key IN ({placeholders})
+              AND NOT EXISTS (SELECT 1 FROM outbox o WHERE o.post_key = p.post_key)
+        """, post_keys) as cursor:
+            finished = await cursor.fetchall()
+        await db.executemany("DELETE FROM outbox_posts WHERE post_key = ?", [(row[0],) for row in finished])
+        return tuple(row[1] for row in finished)
+
+@timed(DB_QUERY_SECONDS)
+async def delete_expired_outbox_sent():
+    async with pool.write() as db:
+        await db.execute("DELETE FROM outbox_sent WHERE expires_at <= strftime('%s', 'now')")
@@ -0,0 +1,341 @@
+import logging
+from database.utils import normalize_username
+
+logger = logging.getLogger(__name__)
+
+# Номер применённой миграции хранится в PRAGMA user_version.
+# Новые миграции добавляются только в конец MIGRATIONS.
+
+
+async def _migration_1(db):
+    """Исходная схема (до нормализации каналов); базы, созданные до миграций, уже содержат её"""
+    # Таблица пользователей (user_id, личный канал)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER,
+        user_channel TEXT PRIMARY KEY
+    )
+    """)
+
+    # Таблица каналов для мониторинга
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS monitor_channels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_channel TEXT,
+        monitor_channel TEXT,
+        is_subscribed INTEGER DEFAULT 0,
+        FOREIGN KEY(user_channel) REFERENCES users(user_channel)
+    )
+    """)
+
+    # Таблица для хранения последних проверенных постов
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS last_posts (
+        monitor_channel TEXT PRIMARY KEY,
+        last_post_id INTEGER DEFAULT 0
+    )
+    """)
+
+
+async def _migration_2(db):
+    """Кэш резолва каналов: username -> channel_id + access_hash"""
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS channel_peers (
+        username TEXT PRIMARY KEY,
+        channel_id INTEGER NOT NULL,
+        access_hash INTEGER NOT NULL,
+        updated_at INTEGER DEFAULT (strftime('%s', 'now'))
+    )
+    """)
+
+
+async def _migration_3(db):
+    """Кэш резолва по сессиям: access_hash у каждого аккаунта свой, кэш без сессии сбрасываем"""
+    async with db.execute("PRAGMA table_info(channel_peers)") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if 'session' in columns:
+        return  # база уже с кэшем по сессиям (создана до появления миграций)
+    await db.execute("DROP TABLE channel_peers")
+    await db.execute("""
+    CREATE TABLE channel_peers (
+        session TEXT NOT NULL,
+        username TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        access_hash INTEGER NOT NULL,
+        updated_at INTEGER DEFAULT (strftime('%s', 'now')),
+        PRIMARY KEY (session, username)
+    )
+    """)
+
+
+async def _migration_4(db):
+    """Шарды монитора (по аккаунту на шард) и распределение каналов между ними"""
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS shards (
+        shard_id TEXT PRIMARY KEY,
+        heartbeat INTEGER NOT NULL
+    )
+    """)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS channel_shards (
+        monitor_channel TEXT PRIMARY KEY,
+        shard_id TEXT NOT NULL
+    )
+    """)
+
+
+async def _migration_5(db):
+    """Канонические каналы с целочисленным id вместо введённых пользователем строк"""
+    # Один канал - одна строка: подписка аккаунта, курсор и шард живут здесь
+    await db.execute("""
+    CREATE TABLE channels (
+        id INTEGER PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        is_subscribed INTEGER NOT NULL DEFAULT 0,
+        last_post_id INTEGER NOT NULL DEFAULT 0,
+        shard_id TEXT
+    )
+    """)
+    await db.execute("CREATE INDEX idx_channels_shard ON channels (shard_id)")
+
+    # Подписки пользовательских каналов; дубликаты невозможны
+    await db.execute("""
+    CREATE TABLE subscriptions (
+        user_channel TEXT NOT NULL REFERENCES users(user_channel),
+        channel_id INTEGER NOT NULL REFERENCES channels(id),
+        PRIMARY KEY (user_channel, channel_id)
+    ) WITHOUT ROWID
+    """)
+    # Покрывающие индексы для обхода в обратную сторону
+    await db.execute("CREATE INDEX idx_subscriptions_channel ON subscriptions (channel_id, user_channel)")
+    await db.execute("CREATE INDEX idx_users_user_id ON users (user_id, user_channel)")
+
+    # Переносим данные, сводя @foo, foo и t.me/foo к одному каналу
+    channels = {}  # username -> [is_subscribed, last_post_id, shard_id]
+
+    def channel(name):
+        return channels.setdefault(normalize_username(name), [0, 0, None])
+
+    async with db.execute("SELECT user_channel, monitor_channel, is_subscribed FROM monitor_channels") as cursor:
+        subscriptions = await cursor.fetchall()
+    for _, monitor_channel, is_subscribed in subscriptions:
+        row = channel(monitor_channel)
+        row[0] = max(row[0], is_subscribed or 0)
+    async with db.execute("SELECT monitor_channel, last_post_id FROM last_posts") as cursor:
+        for monitor_channel, last_post_id in await cursor.fetchall():
+            row = channel(monitor_channel)
+            row[1] = max(row[1], last_post_id or 0)
+    async with db.execute("SELECT monitor_channel, shard_id FROM channel_shards") as cursor:
+        for monitor_channel, shard_id in await cursor.fetchall():
+            channel(monitor_channel)[2] = shard_id
+
+    channels.pop('', None)
+    await db.executemany(
+        "INSERT INTO channels (username, is_subscribed, last_post_id, shard_id) VALUES (?, ?, ?, ?)",
+        [(username, *row) for username, row in channels.items()]
+    )
+    await db.executemany("""
+    INSERT OR IGNORE INTO subscriptions (user_channel, channel_id)
+    SELECT ?, id FROM channels WHERE username = ?
+    """, [(user_channel, normalize_username(monitor_channel))
+          for user_channel, monitor_channel, _ in subscriptions if user_channel])
+
+    await db.execute("DROP TABLE monitor_channels")
+    await db.execute("DROP TABLE last_posts")
+    await db.execute("DROP TABLE channel_shards")
+
+
+async def _migration_6(db):
+    """Сохранённое состояние обновлений Telegram для догонялок через getDifference"""
+    # channel_id = 0 - общее состояние аккаунта (pts/qts/date/seq), иначе pts канала
+    await db.execute("""
+    CREATE TABLE update_state (
+        session TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        pts INTEGER NOT NULL,
+        qts INTEGER NOT NULL DEFAULT 0,
+        date INTEGER NOT NULL DEFAULT 0,
+        seq INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (session, channel_id)
+    ) WITHOUT ROWID
+    """)
+
+
+async def _migration_7(db):
+    """Состояние повторных попыток подписки для фонового join-воркера"""
+    await db.execute("ALTER TABLE channels ADD COLUMN join_attempts INTEGER NOT NULL DEFAULT 0")
+    await db.execute("ALTER TABLE channels ADD COLUMN join_error TEXT")
+    await db.execute("ALTER TABLE channels ADD COLUMN join_retry_at INTEGER NOT NULL DEFAULT 0")
+
+
+async def _migration_8(db):
+    """Хранилище FSM бота и последние сообщения меню пользователей"""
+    await db.execute("""
+    CREATE TABLE fsm_state (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX idx_fsm_state_expires ON fsm_state(expires_at)")
+    await db.execute("""
+    CREATE TABLE bot_messages (
+        user_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, message_id)
+    ) WITHOUT ROWID
+    """)
+
+
+async def _migration_9(db):
+    """Отпечатки уже доставленных постов, вытесненные из памяти (подавление дублей)"""
+    await db.execute("""
+    CREATE TABLE delivered_posts (
+        fingerprint TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        expires_at INTEGER NOT NULL,
+        PRIMARY KEY (fingerprint, user_id)
+    ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX idx_delivered_posts_expires ON delivered_posts(expires_at)")
+
+
+async def _migration_10(db):
+    """Очередь постов от мониторов к процессам рассылки: строка на пост и раздел получателей"""
+    await db.execute("""
+    CREATE TABLE post_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        partition INTEGER NOT NULL,
+        post_key TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+    )
+    """)
+    await db.execute("CREATE INDEX idx_post_queue_partition ON post_queue(partition, id)")
+    await db.execute("CREATE INDEX idx_post_queue_post_key ON post_queue(post_key)")
+
+
+async def _migration_11(db):
+    """Транзакционный outbox вместо post_queue: пост и доставка каждому получателю
+    пишутся вместе со сдвигом курсора канала; (post_key, user_id) - ключ идемпотентности"""
+    await db.execute("""
+    CREATE TABLE outbox_posts (
+        post_key TEXT PRIMARY KEY,
+        channel TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+    ) WITHOUT ROWID
+    """)
+    await db.execute("""
+    CREATE TABLE outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        post_key TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        UNIQUE (post_key, user_id)
+    )
+    """)
+
+    # Неразосланное из старой очереди - нынешним подписчикам канала
+    await db.execute("""
+    INSERT OR IGNORE INTO outbox_posts (post_key, channel, payload, created_at)
+    SELECT post_key, channel, payload, MIN(created_at) FROM post_queue GROUP BY post_key
+    """)
+    await db.execute("""
+    INSERT OR IGNORE INTO outbox (post_key, user_id)
+    SELECT p.post_key, u.user_id
+    FROM outbox_posts p
+    JOIN channels c ON c.username = p.channel
+    JOIN subscriptions s ON s.channel_id = c.id
+    JOIN users u ON u.user_channel = s.user_channel
+    ORDER BY p.created_at
+    """)
+    await db.execute("DROP TABLE post_queue")
+
+
+async def _migration_12(db):
+    """Фильтры подписок: слова и регулярные выражения, которые пост должен содержать (include)
+    или не должен (exclude)"""
+    await db.execute("""
+    CREATE TABLE subscription_filters (
+        user_channel TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('include', 'exclude')),
+        pattern TEXT NOT NULL,
+        is_regex INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_channel, channel_id, kind, pattern, is_regex),
+        FOREIGN KEY (channel_id) REFERENCES channels(id)
+    ) WITHOUT ROWID
+    """)
+
+
+async def _migration_13(db):
+    """Настройки пользователя: окно дайджеста, с (0 - посты приходят по одному)"""
+    await db.execute("""
+    CREATE TABLE user_settings (
+        user_id INTEGER PRIMARY KEY,
+        digest_window INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+
+async def _migration_14(db):
+    """Журнал изменений подписок: бот, монитор и рассылка - разные процессы, и индекс подписчиков
+    в памяти монитора догоняет базу по этому журналу (см. SubscriberIndex.sync)"""
+    await db.execute("""
+    CREATE TABLE subscription_changes (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        op TEXT NOT NULL CHECK (op IN ('user', 'add', 'remove')),
+        user_id INTEGER,
+        user_channel TEXT NOT NULL,
+        monitor_channel TEXT,
+        created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+    )
+    """)
+
+
+async def _migration_15(db):
+    """Отметки о разосланных доставках outbox: (post_key, user_id) остаётся ключом идемпотентности
+    и после ack, если монитор перечитает пост (курсор в базе отстал от разосланного)"""
+    await db.execute("""
+    CREATE TABLE outbox_sent (
+        post_key TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        expires_at INTEGER NOT NULL,
+        PRIMARY KEY (post_key, user_id)
+    ) WITHOUT ROWID
+    """)
+    await db.execute("CREATE INDEX idx_outbox_sent_expires ON outbox_sent(expires_at)")
+
+
+MIGRATIONS = [
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+    _migration_7,
+    _migration_8,
+    _migration_9,
+    _migration_10,
+    _migration_11,
+    _migration_12,
+    _migration_13,
+    _migration_14,
+    _migration_15,
+]
+
+
+async def migrate(db):
+    """Довести схему до последней версии; каждая миграция - в своей транзакции"""
+    async with db.execute("PRAGMA user_version") as cursor:
+        version = (await cursor.fetchone())[0]
+
+    for number in range(version + 1, len(MIGRATIONS) + 1):
+        await db.execute("BEGIN")
+        await MIGRATIONS[number - 1](db)
+        await db.execute(f"PRAGMA user_version = {number}")
+        await db.commit()
+        logger.info(f"Схема базы обновлена до версии {number}")
@@ -0,0 +1,96 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiosqlite
+from config import DB_READERS, DB_STATEMENT_CACHE
+
+# Настройки соединений: WAL позволяет читателям не ждать писателя
+PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+)
+
+
+class ConnectionPool:
+    """Долгоживущие соединения с SQLite: один писатель и несколько читателей"""
+
+    def __init__(self, path: str, readers: int = DB_READERS):
+        self.path = path
+        self.size = readers
+        self.writer = None
+        self.readers = None
+        self.connections = []
+        self.write_lock = asyncio.Lock()
+        self.open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.writer is not None
+
+    async def _connect(self, readonly: bool) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=DB_STATEMENT_CACHE)
+        self.connections.append(conn)
+        pragmas = PRAGMAS + (("PRAGMA query_only = ON",) if readonly else ("PRAGMA journal_mode = WAL",))
+        for pragma in pragmas:
+            # Курсор закрываем сразу, чтобы PRAGMA не держала блокировку
+            async with conn.execute(pragma):
+                pass
+        return conn
+
+    async def _close_all(self):
+        for conn in self.connections:
+            await conn.close()
+        self.connections = []
+        self.writer = None
+        self.readers = None
+
+    async def open(self):
+        """Открыть соединения (повторный вызов ничего не делает)"""
+        async with self.open_lock:
+            if self.is_open:
+                return
+            try:
+                # Писатель первым переводит базу в WAL
+                writer = await self._connect(readonly=False)
+                readers = asyncio.Queue()
+                for _ in range(self.size):
+                    readers.put_nowait(await self._connect(readonly=True))
+            except Exception:
+                await self._close_all()
+                raise
+            self.readers = readers
+            self.writer = writer
+
+    async def close(self):
+        """Закрыть все соединения"""
+        async with self.open_lock:
+            async with self.write_lock:
+                await self._close_all()
+
+    @asynccontextmanager
+    async def read(self):
+        """Взять соединение-читатель из пула"""
+        if not self.is_open:
+            await self.open()
+        readers = self.readers
+        conn = await readers.get()
+        try:
+            yield conn
+        finally:
+            readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Эксклюзивный доступ к писателю; коммит при выходе, откат при ошибке"""
+        if not self.is_open:
+            await self.open()
+        async with self.write_lock:
+            try:
+                yield self.writer
+                await self.writer.commit()
+            except BaseException:
+                await self.writer.rollback()
+                raise
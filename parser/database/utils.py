@@ -0,0 +1,10 @@
+def normalize_username(channel: str) -> str:
+    """Привести ссылку на канал к username: @foo, t.me/foo, https://t.me/foo -> foo"""
+    channel = channel.strip()
+    for prefix in ('https://', 'http://'):
+        if channel.startswith(prefix):
+            channel = channel[len(prefix):]
+    for prefix in ('t.me/', 'telegram.me/', '@'):
+        if channel.startswith(prefix):
+            channel = channel[len(prefix):]
+    return channel.split('/')[0].lower()
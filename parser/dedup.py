@@ -0,0 +1,100 @@
+# dedup.py
+import hashlib
+import time
+from collections import OrderedDict
+from telethon import utils
+from config import DEDUP_WINDOW, DEDUP_MEMORY_SIZE
+from database.db import get_delivered_users, save_delivered, delete_expired_delivered
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_text(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def fingerprints(messages: list) -> list[str]:
+    """Отпечатки поста (одного сообщения или альбома).
+
+    Совпадение любого из них означает тот же контент:
+    - хэш нормализованного текста и id медиа - ловит копии без пересылки;
+    - источник поста: для пересланного - исходный канал и пост, иначе сам пост.
+      Это сводит оригинал и все его пересылки к одному ключу."""
+    first = messages[0]
+    keys = []
+
+    text = _normalize_text(" ".join(msg.message for msg in messages if msg.message))
+    media = [str(media.id) for msg in messages if (media := msg.photo or msg.document)]
+    if text or media:
+        content = "\n".join([text] + media).encode()
+        keys.append("c:" + hashlib.blake2b(content, digest_size=16).hexdigest())
+
+    forward = first.fwd_from
+    if forward and forward.from_id and forward.channel_post:
+        keys.append(f"o:{utils.get_peer_id(forward.from_id)}:{forward.channel_post}")
+    elif first.peer_id:
+        keys.append(f"o:{utils.get_peer_id(first.peer_id)}:{first.id}")
+    return keys
+
+
+class DeliveredPosts:
+    """Кому какой контент уже отправлен за последние window секунд.
+
+    Свежие отпечатки - в памяти, вытесненные старые - в SQLite."""
+
+    def __init__(self, window: int = DEDUP_WINDOW, size: int = DEDUP_MEMORY_SIZE):
+        self.window = window
+        self.size = size
+        self.entries = OrderedDict()  # отпечаток -> (истекает, set user_id), от старых к новым
+
+    async def filter(self, keys: list[str], user_ids) -> list[int]:
+        """Оставить получателей, которые ещё не получали этот контент, и запомнить их"""
+        if not keys:
+            return list(user_ids)
+        now = time.time()
+        # Вытесненные и неизвестные отпечатки - одним запросом к базе
+        missing = [key for key in keys if key not in self.entries or self.entries[key][0] <= now]
+        if missing:
+            stored = await get_delivered_users(missing)
+            for key in missing:
+                self.entries[key] = (now, stored.get(key, set()))
+
+        seen = set().union(*(self.entries[key][1] for key in keys))
+        targets = [user_id for user_id in user_ids if user_id not in seen]
+
+        for key in keys:
+            self.entries[key] = (now + self.window, self.entries[key][1] | set(targets))
+            self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            await self._spill()
+        return targets
+
+    def forget(self, keys: list[str], user_ids):
+        """Снять отметку о доставке с получателей, которым отправка так и не ушла"""
+        for key in keys:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries[key] = (entry[0], entry[1] - set(user_ids))
+
+    async def _spill(self):
+        """Выгрузить в базу старейшую половину отпечатков"""
+        now = time.time()
+        rows = []
+        while len(self.entries) > self.size // 2:
+            key, (expires, users) = self.entries.popitem(last=False)
+            if expires > now:
+                rows.extend((key, user_id, int(expires)) for user_id in users)
+        await save_delivered(rows)
+        await delete_expired_delivered()
+
+    async def flush(self):
+        """Сохранить всё в базу (при остановке - чтобы не слать повторы после рестарта)"""
+        now = time.time()
+        rows = [
+            (key, user_id, int(expires))
+            for key, (expires, users) in self.entries.items() if expires > now
+            for user_id in users
+        ]
+        await save_delivered(rows)
+        logger.info(f"Отпечатки доставленных постов сохранены: {len(self.entries)}")
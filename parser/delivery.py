@@ -0,0 +1,173 @@
+# delivery.py
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+from config import (
+    DELIVERY_WORKERS, DELIVERY_GLOBAL_RATE, DELIVERY_PER_CHAT_INTERVAL, DELIVERY_MAX_ATTEMPTS
+)
+from ratelimit import TokenBucket
+from metrics import SEND_SECONDS, SENT, RETRY_AFTER, QUEUE_DEPTH
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Окно, по которому считается пропускная способность
+THROUGHPUT_WINDOW = 60
+# Размер chat_next, после которого выбрасываем прошедшие слоты
+CHAT_PRUNE_THRESHOLD = 10000
+
+
+@dataclass
+class DeliveryJob:
+    """Одна отправка одному получателю"""
+    chat_id: int
+    send: Callable[[int], Awaitable]
+    on_done: Callable[[], None] | None = None
+    attempts: int = 0
+    scheduled: bool = False
+    booked: float = 0.0   # когда забронирован слот в чате
+    created: float = field(default_factory=time.monotonic)
+
+
+class DeliveryQueue:
+    """Очередь рассылки: общий лимит бота, пауза между сообщениями в один чат, повтор по RetryAfter
+    (RetryAfter останавливает всю рассылку бота на указанное время)"""
+
+    def __init__(self, workers: int = DELIVERY_WORKERS, rate: float = DELIVERY_GLOBAL_RATE,
+                 per_chat_interval: float = DELIVERY_PER_CHAT_INTERVAL):
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.bucket = TokenBucket(rate, rate)
+        self.queue = asyncio.Queue()
+        self.chat_next = {}  # chat_id -> время, раньше которого в чат не пишем
+        self.chat_paused = {}  # chat_id -> когда чат получил RetryAfter (слоты до этого недействительны)
+        self.delayed = 0     # задачи, ждущие своего слота вне очереди
+        self.tasks = []
+        # Статистика
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.sent_times = deque()
+        QUEUE_DEPTH.labels("delivery").set_function(lambda: self.queue.qsize() + self.delayed)
+
+    def start(self):
+        for _ in range(self.workers):
+            self.tasks.append(asyncio.create_task(self._sender()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, chat_id: int, send: Callable[[int], Awaitable], on_done: Callable[[], None] = None):
+        """Поставить отправку в очередь; send(chat_id) выполняет сам запрос к Bot API,
+        on_done() вызывается, когда отправка завершена (успешно или окончательно нет)"""
+        self.queue.put_nowait(DeliveryJob(chat_id, send, on_done))
+
+    def _schedule(self, job: DeliveryJob, delay: float):
+        """Вернуть задачу в очередь через delay секунд"""
+        job.scheduled = True
+        self.delayed += 1
+
+        def requeue():
+            self.delayed -= 1
+            self.queue.put_nowait(job)
+
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    async def _sender(self):
+        while True:
+            job = await self.queue.get()
+            finished = True
+            try:
+                finished = await self._deliver(job)
+            except Exception as e:
+                logger.error(f"Ошибка рассылки в {job.chat_id}: {e}")
+            finally:
+                if finished and job.on_done:
+                    job.on_done()
+                self.queue.task_done()
+
+    async def _deliver(self, job: DeliveryJob) -> bool:
+        """Одна попытка; False - задача отложена и вернётся в очередь"""
+        now = time.monotonic()
+        if job.scheduled and job.booked < self.chat_paused.get(job.chat_id, 0):
+            # Слот забронирован до RetryAfter в этот чат - бронируем заново, за отложенной отправкой.
+            # Задачи просыпаются в порядке старых слотов, поэтому порядок сообщений сохраняется
+            job.scheduled = False
+        if not job.scheduled:
+            # Бронируем слот в чате: сообщения одному получателю идут по порядку и с паузой
+            if self._book(job, now) > now:
+                return False
+
+        await self.bucket.acquire()
+        job.attempts += 1
+        try:
+            with SEND_SECONDS.time():
+                await job.send(job.chat_id)
+        except TelegramRetryAfter as e:
+            self.retried += 1
+            RETRY_AFTER.labels("delivery").inc()
+            if job.attempts >= DELIVERY_MAX_ATTEMPTS:
+                self.failed += 1
+                SENT.labels("failed").inc()
+                logger.error(f"Не доставлено в {job.chat_id}: исчерпаны попытки")
+                return True
+            logger.warning(f"RetryAfter {e.retry_after} с для {job.chat_id}")
+            # Лимит рассылки общий для бота: остальные чаты получили бы тот же 429, поэтому пауза для всех
+            self.bucket.pause(e.retry_after)
+            # Чат на паузе: отложенная отправка идёт первой, остальные слоты чата сдвигаются за ней
+            now = time.monotonic()
+            self.chat_paused[job.chat_id] = now
+            self.chat_next[job.chat_id] = now + e.retry_after
+            self._book(job, now)
+            return False
+        except TelegramForbiddenError:
+            # Пользователь заблокировал бота - повторять бессмысленно
+            self.failed += 1
+            SENT.labels("forbidden").inc()
+            return True
+        except Exception as e:
+            self.failed += 1
+            SENT.labels("failed").inc()
+            logger.error(f"Ошибка отправки пользователю {job.chat_id}: {e}")
+            return True
+
+        self.sent += 1
+        SENT.labels("sent").inc()
+        self.sent_times.append(time.monotonic())
+        if len(self.chat_next) > CHAT_PRUNE_THRESHOLD:
+            self._prune_chats()
+        return True
+
+    def _book(self, job: DeliveryJob, now: float) -> float:
+        """Забронировать задаче следующий слот чата; если он не сейчас - отложить до него"""
+        slot = max(now, self.chat_next.get(job.chat_id, 0))
+        self.chat_next[job.chat_id] = slot + self.per_chat_interval
+        job.booked = now
+        if slot > now:
+            self._schedule(job, slot - now)
+        return slot
+
+    def _prune_chats(self):
+        # Не держим записи о чатах, слот которых уже прошёл
+        now = time.monotonic()
+        self.chat_next = {chat_id: slot for chat_id, slot in self.chat_next.items() if slot > now}
+        self.chat_paused = {chat_id: at for chat_id, at in self.chat_paused.items() if chat_id in self.chat_next}
+
+    def stats(self) -> dict:
+        """Глубина очереди и пропускная способность"""
+        border = time.monotonic() - THROUGHPUT_WINDOW
+        while self.sent_times and self.sent_times[0] < border:
+            self.sent_times.popleft()
+        return {
+            'queue_depth': self.queue.qsize() + self.delayed,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'throughput': len(self.sent_times) / THROUGHPUT_WINDOW,
+        }
@@ -0,0 +1,84 @@
+# digest.py
+"""Дайджесты: посты пользователя копятся в течение окна и уходят одним сообщением со ссылками.
+
+Окно выбирает сам пользователь (DIGEST_WINDOWS в меню бота), а при большой очереди неотправленного
+процесс рассылки включает короткое окно DIGEST_BACKLOG_WINDOW сам - вместо часов ожидания
+по сообщению в секунду пользователь получает сводку.
+"""
+import time
+from config import DIGEST_ITEM_LENGTH
+
+# Сообщение Bot API - не длиннее 4096 символов
+MESSAGE_LIMIT = 4096
+# Место под строку о постах, не поместившихся в сообщение
+TAIL_RESERVE = 600
+
+
+def post_summary(post: dict) -> str:
+    """Строка поста в дайджесте: краткий текст из монитора, у старых записей - первая строка текста"""
+    summary = post.get('summary')
+    if not summary:
+        # После заголовка "📢 Новый пост в ...:" и пустой строки идёт текст поста
+        body = post.get('text', '').split('\n\n', 1)[-1].replace('*', '').strip()
+        summary = body.split('\n')[0]
+    if len(summary) > DIGEST_ITEM_LENGTH:
+        summary = summary[:DIGEST_ITEM_LENGTH - 1] + "…"
+    return summary
+
+
+def post_link(post: dict, channel: str) -> str:
+    return post.get('link') or f"https://t.me/{channel}"
+
+
+def format_digest(items: list) -> str:
+    """Текст дайджеста по [(канал, post)]; что не влезло в сообщение - счётчиком по каналам со ссылками"""
+    text = f"📰 Дайджест, новых постов: {len(items)}\n\n"
+    shown = 0
+    for channel, post in items:
+        entry = f"• {channel}: {post_summary(post)}\n{post_link(post, channel)}\n\n"
+        if len(text) + len(entry) > MESSAGE_LIMIT - TAIL_RESERVE:
+            break
+        text += entry
+        shown += 1
+
+    if shown < len(items):
+        rest = {}
+        for channel, _ in items[shown:]:
+            rest[channel] = rest.get(channel, 0) + 1
+        tail = f"…и ещё {len(items) - shown}: " + ", ".join(
+            f"{channel} ({count}) https://t.me/{channel}" for channel, count in rest.items()
+        )
+        text += tail[:MESSAGE_LIMIT - len(text)]
+    return text.rstrip()
+
+
+class DigestBuffer:
+    """Посты, ждущие дайджеста, по пользователям. Окно отсчитывается от первого поста в буфере"""
+
+    def __init__(self):
+        self.items = {}      # user_id -> [элемент]
+        self.deadlines = {}  # user_id -> время отправки (monotonic)
+        self.reasons = {}    # user_id -> 'user' (настройка) или 'backlog' (очередь)
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self.items.values())
+
+    def add(self, user_id: int, item, window: float, reason: str):
+        self.items.setdefault(user_id, []).append(item)
+        deadline = time.monotonic() + window
+        if deadline < self.deadlines.get(user_id, deadline + 1):
+            self.deadlines[user_id] = deadline
+            self.reasons[user_id] = reason
+
+    def _pop(self, user_id: int) -> tuple[list, str]:
+        del self.deadlines[user_id]
+        return self.items.pop(user_id), self.reasons.pop(user_id)
+
+    def due(self) -> list[tuple[int, list, str]]:
+        """Забрать буферы, окно которых истекло: [(user_id, элементы, причина)]"""
+        now = time.monotonic()
+        return [(user_id, *self._pop(user_id)) for user_id, deadline in list(self.deadlines.items()) if deadline <= now]
+
+    def drain(self) -> list[tuple[int, list, str]]:
+        """Забрать все буферы"""
+        return [(user_id, *self._pop(user_id)) for user_id in list(self.deadlines)]
@@ -0,0 +1,352 @@
+# fakes.py
+"""Фейковые Telegram-клиент, сессия бота и отправитель webhook для офлайн-бенчмарков (см. benchmark.py)"""
+import asyncio
+import random
+import re
+import time
+from collections import defaultdict
+from functools import partial
+from datetime import datetime, timezone
+import aiohttp
+from aiogram import methods, types
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from telethon import errors, utils
+from telethon._updates import EntityCache
+from telethon.tl.functions import PingRequest
+from telethon.tl.functions.channels import JoinChannelRequest
+from telethon.tl.functions.messages import GetPeerDialogsRequest
+from telethon.tl.functions.updates import GetStateRequest, GetDifferenceRequest, GetChannelDifferenceRequest
+from telethon.tl.types import (
+    Channel, ChatPhotoEmpty, InputPeerChannel, Message, MessageMediaPhoto, PeerChannel, Photo, PhotoSize, Pong,
+    Dialog, PeerNotifySettings, UpdateChannelTooLong
+)
+from telethon.tl.types.messages import PeerDialogs
+from telethon.tl.types.updates import (
+    State, Difference, DifferenceEmpty, ChannelDifference, ChannelDifferenceEmpty
+)
+
+SEND_MEDIA = (
+    (methods.SendPhoto, 'photo'), (methods.SendVideo, 'video'), (methods.SendDocument, 'document')
+)
+
+# Метка поста в тексте: по ней сессия бота находит время публикации
+POST_MARK = re.compile(r"post (\d+):(\d+)")
+
+
+class FakeNetwork:
+    """Задержка и FloodWait одного API: задержка равномерная в [latency/2, latency*3/2]"""
+
+    def __init__(self, latency: float = 0.0, flood_rate: float = 0.0, flood_seconds: int = 1):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.calls = 0
+        self.floods = 0
+
+    async def call(self, flood_error):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        if self.flood_rate and random.random() < self.flood_rate:
+            self.floods += 1
+            raise flood_error(self.flood_seconds)
+
+
+class FakeChannel:
+    """Канал, который публикует посты с заданной частотой (пуассоновский поток)"""
+
+    def __init__(self, channel_id: int, username: str, post_rate: float, photo_share: float,
+                 initial_posts: int, album_share: float = 0.0):
+        self.entity = Channel(
+            id=channel_id, title=username, photo=ChatPhotoEmpty(), date=None,
+            broadcast=True, access_hash=channel_id * 7919, username=username
+        )
+        self.post_rate = post_rate
+        self.photo_share = photo_share
+        self.album_share = album_share    # доля постов с фото, которые выходят альбомом из 2-5 фото
+        self.messages = []                # от старых к новым
+        self.published = {}               # id поста -> time.monotonic() публикации
+        self.next_post = self._next_post_time(time.monotonic())
+        for _ in range(initial_posts):
+            self._publish(time.monotonic())
+
+    def _next_post_time(self, now: float) -> float:
+        return now + random.expovariate(self.post_rate) if self.post_rate else float('inf')
+
+    def _publish(self, when: float):
+        first_id = len(self.messages) + 1
+        parts, grouped_id = 1, None
+        has_photo = random.random() < self.photo_share
+        if has_photo and random.random() < self.album_share:
+            parts, grouped_id = random.randint(2, 5), first_id
+        for post_id in range(first_id, first_id + parts):
+            media = MessageMediaPhoto(photo=Photo(
+                id=post_id, access_hash=0, file_reference=b"", date=datetime.now(timezone.utc),
+                sizes=[PhotoSize(type="x", w=1280, h=720, size=64 * 1024)], dc_id=2
+            )) if has_photo else None
+            self.messages.append(Message(
+                id=post_id, peer_id=PeerChannel(self.entity.id), date=datetime.now(timezone.utc),
+                # Подпись альбома - только у первой части
+                message=f"post {self.entity.id}:{post_id}" if post_id == first_id else "",
+                media=media, post=True, grouped_id=grouped_id
+            ))
+            self.published[post_id] = when
+
+    def tick(self, now: float):
+        """Опубликовать посты, время которых уже наступило"""
+        while self.next_post <= now:
+            self._publish(self.next_post)
+            self.next_post = self._next_post_time(self.next_post)
+
+
+class FakeTelegramClient:
+    """Замена TelegramClient для ChannelMonitor: get_entity, iter_messages, download_media и сырые запросы
+    монитора (см. SUPPORTED_REQUESTS).
+
+    pts канала - id его последнего поста (каждый пост - одно событие), общий pts аккаунта - число
+    постов во всех каналах. getDifference не знает, в каких каналах были события после состояния,
+    и помечает UpdateChannelTooLong все каналы - как делает Telegram при большом разрыве"""
+
+    SUPPORTED_REQUESTS = (
+        JoinChannelRequest, PingRequest, GetStateRequest, GetDifferenceRequest,
+        GetChannelDifferenceRequest, GetPeerDialogsRequest
+    )
+
+    def __init__(self, channels: list[FakeChannel], network: FakeNetwork, media_size: int = 64 * 1024):
+        self.channels = {channel.entity.id: channel for channel in channels}
+        self.by_username = {channel.entity.username: channel for channel in channels}
+        self.network = network
+        self.media_size = media_size
+        self.joined = set()
+        self.connected = False
+        # То, что Message._finish_init берёт у настоящего клиента: id аккаунта и кэш сущностей
+        self._self_id = 1
+        self._mb_entity_cache = EntityCache()
+
+    def _flood(self, seconds: int):
+        return errors.FloodWaitError(request=None, capture=seconds)
+
+    def published(self, channel_id: int, post_id: int) -> float | None:
+        channel = self.channels.get(channel_id)
+        return channel.published.get(post_id) if channel else None
+
+    def tick(self):
+        now = time.monotonic()
+        for channel in self.channels.values():
+            channel.tick(now)
+
+    # Жизненный цикл соединения
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def connect(self):
+        await self.network.call(self._flood)
+        self.connected = True
+
+    async def start(self, phone=None):
+        await self.connect()
+        return self
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def disconnect(self):
+        self.connected = False
+
+    def add_event_handler(self, callback, event=None):
+        pass
+
+    def remove_event_handler(self, callback, event=None):
+        pass
+
+    # API
+    async def get_entity(self, username: str):
+        await self.network.call(self._flood)
+        channel = self.by_username.get(username)
+        if channel is None:
+            raise errors.UsernameNotOccupiedError(request=None)
+        return channel.entity
+
+    def _state(self) -> State:
+        pts = sum(len(channel.messages) for channel in self.channels.values())
+        return State(pts=pts, qts=0, date=datetime.now(timezone.utc), seq=0, unread_count=0)
+
+    def _channel(self, peer) -> FakeChannel:
+        return self.channels[peer.channel_id if isinstance(peer, InputPeerChannel) else peer.id]
+
+    async def __call__(self, request):
+        if not isinstance(request, self.SUPPORTED_REQUESTS):
+            supported = ", ".join(cls.__name__ for cls in self.SUPPORTED_REQUESTS)
+            raise TypeError(f"FakeTelegramClient не умеет {type(request).__name__}; поддерживаются: {supported}")
+        await self.network.call(self._flood)
+        self.tick()
+
+        if isinstance(request, JoinChannelRequest):
+            # Монитор вступает через JoinChannelRequest, метода join_channel у клиента нет
+            self.joined.add(request.channel.channel_id)
+            return None
+        if isinstance(request, PingRequest):
+            return Pong(msg_id=0, ping_id=request.ping_id)
+        if isinstance(request, GetStateRequest):
+            return self._state()
+
+        if isinstance(request, GetPeerDialogsRequest):
+            channels = [self._channel(dialog_peer.peer) for dialog_peer in request.peers]
+            dialogs = [
+                Dialog(
+                    peer=PeerChannel(channel.entity.id), top_message=len(channel.messages),
+                    read_inbox_max_id=0, read_outbox_max_id=0, unread_count=0, unread_mentions_count=0,
+                    unread_reactions_count=0, unread_poll_votes_count=0,
+                    notify_settings=PeerNotifySettings(), pts=len(channel.messages)
+                )
+                for channel in channels
+            ]
+            return PeerDialogs(dialogs=dialogs, messages=[], chats=[channel.entity for channel in channels],
+                               users=[], state=self._state())
+
+        if isinstance(request, GetDifferenceRequest):
+            state = self._state()
+            if request.pts >= state.pts:
+                return DifferenceEmpty(date=state.date, seq=state.seq)
+            channels = list(self.channels.values())
+            return Difference(
+                new_messages=[], new_encrypted_messages=[],
+                other_updates=[UpdateChannelTooLong(channel_id=channel.entity.id) for channel in channels],
+                chats=[channel.entity for channel in channels], users=[], state=state
+            )
+
+        # GetChannelDifferenceRequest
+        channel = self._channel(request.channel)
+        pts = len(channel.messages)
+        if request.pts >= pts:
+            return ChannelDifferenceEmpty(pts=pts, final=True)
+        new = channel.messages[request.pts:request.pts + request.limit]
+        return ChannelDifference(
+            pts=new[-1].id, new_messages=new, other_updates=[], chats=[channel.entity], users=[],
+            final=new[-1].id >= pts
+        )
+
+    async def iter_messages(self, entity, min_id: int = 0, limit: int = None):
+        channel = self.channels[entity.channel_id if isinstance(entity, InputPeerChannel) else entity.id]
+        self.tick()
+        # Как и Telethon: от новых к старым, страницами по 100
+        newer = [msg for msg in reversed(channel.messages) if msg.id > min_id][:limit]
+        for i, message in enumerate(newer):
+            if i % 100 == 0:
+                await self.network.call(self._flood)
+            # То, что делает Message._finish_init у настоящего клиента
+            message._client = self
+            message._chat, message._input_chat = channel.entity, utils.get_input_peer(channel.entity)
+            yield message
+
+    async def download_media(self, message, file=None, **kwargs):
+        await self.network.call(self._flood)
+        if isinstance(file, str):
+            with open(file, 'wb') as f:
+                f.write(bytes(self.media_size))
+            return file
+        return bytes(self.media_size)
+
+
+class FakeBotSession(BaseSession):
+    """Сессия aiogram без сети: отвечает на методы бота и замеряет задержку от публикации до доставки"""
+
+    def __init__(self, network: FakeNetwork, published=None):
+        super().__init__()
+        self.network = network
+        self.published = published     # функция (channel_id, post_id) -> время публикации или None
+        self.latencies = []
+        self.requests = defaultdict(int)
+        self.message_id = 0
+        self.file_id = 0
+
+    @staticmethod
+    def _flood(method, seconds: int):
+        return TelegramRetryAfter(method=method, message="Flood control exceeded", retry_after=seconds)
+
+    def _message(self, chat_id, **fields) -> types.Message:
+        self.message_id += 1
+        return types.Message(
+            message_id=self.message_id, date=datetime.now(timezone.utc),
+            chat=types.Chat(id=chat_id, type='private'), **fields
+        )
+
+    def _media(self, kind: str, media) -> dict:
+        """Поля сообщения с медиа; загруженный файл получает новый file_id"""
+        if isinstance(media, str):
+            file_id = media
+        else:
+            self.file_id += 1
+            file_id = f"{kind}-{self.file_id}"
+        if kind == 'photo':
+            return {'photo': [types.PhotoSize(file_id=file_id, file_unique_id=file_id, width=1280, height=720)]}
+        if kind == 'video':
+            return {'video': types.Video(file_id=file_id, file_unique_id=file_id, width=1280, height=720, duration=10)}
+        return {'document': types.Document(file_id=file_id, file_unique_id=file_id)}
+
+    def _record(self, text: str | None):
+        if not text or self.published is None:
+            return
+        # В дайджесте - несколько постов
+        for mark in POST_MARK.finditer(text):
+            published = self.published(int(mark.group(1)), int(mark.group(2)))
+            if published is not None:
+                self.latencies.append(time.monotonic() - published)
+
+    async def make_request(self, bot, method, timeout=None):
+        await self.network.call(partial(self._flood, method))
+        self.requests[type(method).__name__] += 1
+
+        if isinstance(method, methods.SendMessage):
+            self._record(method.text)
+            return self._message(method.chat_id, text=method.text)
+        for method_type, kind in SEND_MEDIA:
+            if isinstance(method, method_type):
+                self._record(method.caption)
+                return self._message(method.chat_id, caption=method.caption,
+                                     **self._media(kind, getattr(method, kind)))
+        if isinstance(method, methods.SendMediaGroup):
+            self._record(method.media[0].caption)
+            return [self._message(method.chat_id, **self._media(item.type, item.media)) for item in method.media]
+        # answerCallbackQuery, deleteMessages и прочее - просто успех
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class FakeWebhookClient:
+    """Доставка апдейтов на webhook бота так, как это делает Telegram:
+    POST с X-Telegram-Bot-Api-Secret-Token и повтор, пока сервер не ответит 200"""
+
+    def __init__(self, url: str, secret: str, retry_delay: float = 0.1):
+        self.url = url
+        self.secret = secret
+        self.retry_delay = retry_delay
+        self.statuses = defaultdict(int)
+        self.session = None
+
+    async def send(self, update: types.Update) -> float:
+        """Доставить апдейт; возвращает время до принятия сервером, с"""
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        body = update.model_dump_json(exclude_none=True)
+        headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": self.secret}
+        started = time.monotonic()
+        while True:
+            async with self.session.post(self.url, data=body, headers=headers) as response:
+                self.statuses[response.status] += 1
+                if response.status == 200:
+                    return time.monotonic() - started
+                if response.status == 401:
+                    raise PermissionError("webhook отклонил секретный токен")
+            await asyncio.sleep(self.retry_delay)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,262 @@
+# filters.py
+"""Фильтры подписок: пост из канала уходит владельцу подписки, только если проходит её фильтры.
+
+- include - пост должен содержать хотя бы одно из слов/выражений (если include заданы);
+- exclude - пост не должен содержать ни одного.
+
+Слово ищется без учёта регистра как подстрока, /выражение/ - регулярное выражение.
+Фильтры всех подписок на канал собираются в один ChannelMatcher: каждое уникальное слово
+или выражение проверяется один раз на пост, сколько бы подписок его ни использовало.
+
+Выражения выполняются в цикле событий монитора, поэтому выражения с экспоненциальным перебором
+(вложенные квантификаторы, альтернатива под квантификатором) не принимаются, а выражение,
+проверка которого заняла дольше FILTER_REGEX_BUDGET, отключается до рестарта.
+"""
+import re
+import time
+from collections import deque
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+from config import FILTER_PATTERN_MAX_LENGTH, FILTER_REGEX_BUDGET
+from database.db import get_all_filters
+from subscribers import subscriber_index
+from metrics import FILTERED_OUT
+import logging
+
+logger = logging.getLogger(__name__)
+
+INCLUDE = 'include'
+EXCLUDE = 'exclude'
+
+
+def _backtracks(parsed, repeated: bool = False) -> bool:
+    """Есть ли в разобранном выражении повтор внутри повтора или альтернатива под повтором -
+    конструкции, на которых re перебирает варианты экспоненциально долго"""
+    for op, arg in parsed:
+        name = str(op)
+        if name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'):
+            _, high, sub = arg
+            repeats = high > 1
+            if repeats and repeated:
+                return True
+            if _backtracks(sub, repeated or repeats):
+                return True
+        elif name == 'BRANCH':
+            if repeated:
+                return True
+            if any(_backtracks(sub, repeated) for sub in arg[1]):
+                return True
+        elif name in ('SUBPATTERN', 'ASSERT', 'ASSERT_NOT'):
+            if _backtracks(arg[-1], repeated):
+                return True
+        elif name == 'ATOMIC_GROUP':
+            if _backtracks(arg, repeated):
+                return True
+        elif name == 'GROUPREF_EXISTS':
+            if any(sub is not None and _backtracks(sub, repeated) for sub in arg[1:]):
+                return True
+    return False
+
+
+def check_regex(pattern: str):
+    """ValueError, если выражение не компилируется или опасно для цикла событий"""
+    try:
+        re.compile(pattern)
+        parsed = sre_parse.parse(pattern)
+    except re.error as e:
+        raise ValueError(f"ошибка в регулярном выражении: {e}")
+    if _backtracks(parsed):
+        raise ValueError("выражение со вложенными повторами вроде (a+)+ или (a|b)* слишком медленное")
+
+
+def parse_pattern(text: str) -> tuple[str, bool]:
+    """Ввод пользователя -> (pattern, is_regex); недопустимый ввод - ValueError"""
+    text = text.strip()
+    if len(text) > FILTER_PATTERN_MAX_LENGTH:
+        raise ValueError(f"длиннее {FILTER_PATTERN_MAX_LENGTH} символов")
+    if len(text) > 2 and text.startswith('/') and text.endswith('/'):
+        pattern = text[1:-1]
+        check_regex(pattern)
+        return pattern, True
+    if not text:
+        raise ValueError("пустое слово")
+    return text.casefold(), False
+
+
+def format_pattern(pattern: str, is_regex: bool) -> str:
+    return f"/{pattern}/" if is_regex else pattern
+
+
+class AhoCorasick:
+    """Поиск всех слов из набора за один проход по тексту"""
+
+    def __init__(self, keywords):
+        self.goto = [{}]      # узел -> {символ: узел}
+        self.fail = [0]
+        self.output = [set()]  # узел -> индексы слов, заканчивающихся в нём
+        for index, keyword in enumerate(keywords):
+            node = 0
+            for char in keyword:
+                following = self.goto[node].get(char)
+                if following is None:
+                    following = len(self.goto)
+                    self.goto[node][char] = following
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                node = following
+            self.output[node].add(index)
+
+        # Ссылки неудач - обходом в ширину
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, following in self.goto[node].items():
+                queue.append(following)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[following] = target if target != following else 0
+                self.output[following] |= self.output[self.fail[following]]
+
+    def search(self, text: str) -> set[int]:
+        """Индексы слов, встречающихся в тексте"""
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            if self.output[node]:
+                found |= self.output[node]
+        return found
+
+
+class ChannelMatcher:
+    """Фильтры всех подписок одного канала"""
+
+    def __init__(self, rules: dict[str, frozenset]):
+        # rules: user_channel -> {(kind, pattern, is_regex)}
+        patterns = sorted({(pattern, is_regex) for filters in rules.values() for _, pattern, is_regex in filters})
+        self.keywords = [pattern for pattern, is_regex in patterns if not is_regex]
+        self.regexes = [pattern for pattern, is_regex in patterns if is_regex]
+        keyword_index = {pattern: i for i, pattern in enumerate(self.keywords)}
+        regex_index = {pattern: i for i, pattern in enumerate(self.regexes)}
+        self.automaton = AhoCorasick(self.keywords) if self.keywords else None
+        self.compiled = [re.compile(pattern, re.IGNORECASE) for pattern in self.regexes]
+        self.slow = set()  # выражения, проверка которых заняла дольше FILTER_REGEX_BUDGET
+
+        # Подписка -> (include, exclude) в виде ссылок на найденное: ('k', i) или ('r', i)
+        self.subscriptions = {}
+        for user_channel, filters in rules.items():
+            include, exclude = [], []
+            for kind, pattern, is_regex in filters:
+                ref = ('r', regex_index[pattern]) if is_regex else ('k', keyword_index[pattern])
+                (include if kind == INCLUDE else exclude).append(ref)
+            self.subscriptions[user_channel] = (include, exclude)
+
+    def rejected(self, text: str) -> list[str]:
+        """Подписки, фильтры которых пост не проходит"""
+        found = set()
+        if self.automaton:
+            found |= {('k', i) for i in self.automaton.search(text.casefold())}
+        for i, regex in enumerate(self.compiled):
+            started = time.perf_counter()
+            if regex.search(text):
+                found.add(('r', i))
+            if time.perf_counter() - started > FILTER_REGEX_BUDGET:
+                self.slow.add(self.regexes[i])
+
+        rejected = []
+        for user_channel, (include, exclude) in self.subscriptions.items():
+            if (include and not found.intersection(include)) or found.intersection(exclude):
+                rejected.append(user_channel)
+        return rejected
+
+
+class FilterIndex:
+    """Фильтры подписок в памяти монитора; матчер канала пересобирается, только если его фильтры изменились"""
+
+    def __init__(self):
+        self.rules = {}     # канал -> {user_channel: frozenset((kind, pattern, is_regex))}
+        self.matchers = {}  # канал -> ChannelMatcher
+        self.disabled = set()  # выражения, которые не проверяются (опасные или медленные)
+
+    async def refresh(self):
+        """Перечитать фильтры из базы (их меняет бот в своём процессе)"""
+        loaded = {}
+        for user_channel, channel, kind, pattern, is_regex in await get_all_filters():
+            loaded.setdefault(channel, {}).setdefault(user_channel, set()).add((kind, pattern, is_regex))
+        rules = {
+            channel: {user_channel: frozenset(filters) for user_channel, filters in subscriptions.items()}
+            for channel, subscriptions in loaded.items()
+        }
+
+        changed = {channel for channel in rules.keys() | self.rules.keys()
+                   if rules.get(channel) != self.rules.get(channel)}
+        for channel in changed:
+            self.matchers.pop(channel, None)
+        self.rules = rules
+        if changed:
+            logger.info(f"Фильтры обновлены для {len(changed)} каналов")
+
+    def usable(self, pattern: str, is_regex: bool) -> bool:
+        """Выражения из базы проверяются заново: их могли сохранить до появления проверки"""
+        if not is_regex:
+            return True
+        if pattern in self.disabled:
+            return False
+        try:
+            check_regex(pattern)
+            return True
+        except ValueError as e:
+            self.disabled.add(pattern)
+            logger.warning(f"Фильтр /{pattern}/ отключён: {e}")
+            return False
+
+    def matcher(self, channel: str) -> ChannelMatcher | None:
+        matcher = self.matchers.get(channel)
+        if matcher is None:
+            # Отключённый фильтр просто не действует: подписка без него получает посты как раньше
+            rules = {
+                user_channel: frozenset(item for item in filters if self.usable(item[1], item[2]))
+                for user_channel, filters in self.rules.get(channel, {}).items()
+            }
+            rules = {user_channel: filters for user_channel, filters in rules.items() if filters}
+            if not rules:
+                return None
+            matcher = self.matchers[channel] = ChannelMatcher(rules)
+        return matcher
+
+    def select(self, channel: str, text: str, user_ids) -> tuple[int, ...]:
+        """Получатели поста после фильтров. Пользователь с несколькими своими каналами,
+        подписанными на канал, отсеивается, только если пост не прошёл фильтры ни одной из подписок"""
+        matcher = self.matcher(channel)
+        if matcher is None:
+            return tuple(user_ids)
+
+        rejected = {}  # user_id -> число подписок, не прошедших фильтры
+        for user_channel in matcher.rejected(text):
+            owner = subscriber_index.owners.get(user_channel)
+            if owner is not None:
+                rejected[owner] = rejected.get(owner, 0) + 1
+        if matcher.slow:
+            # Медленное выражение держит весь цикл событий - больше его не проверяем
+            logger.warning(f"Фильтры {channel} отключены за медленную проверку: {sorted(matcher.slow)}")
+            self.disabled |= matcher.slow
+            self.matchers.pop(channel, None)
+        if not rejected:
+            return tuple(user_ids)
+
+        counts = subscriber_index.by_channel.get(channel, {})
+        selected = tuple(user_id for user_id in user_ids if rejected.get(user_id, 0) < counts.get(user_id, 1))
+        if len(selected) < len(user_ids):
+            FILTERED_OUT.inc(len(user_ids) - len(selected))
+        return selected
+
+
+# Фильтры для монитора
+filter_index = FilterIndex()
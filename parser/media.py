@@ -0,0 +1,68 @@
+# media.py
+import asyncio
+import time
+from typing import Awaitable, Callable
+from aiogram.exceptions import TelegramRetryAfter
+from config import MEDIA_CACHE_TTL, MEDIA_CACHE_SIZE
+
+# Результат неудачной загрузки для ожидающих: загрузить заново должен один из них
+RETRY_UPLOAD = object()
+
+
+class MediaCache:
+    """file_id уже загруженных в бота медиа по ключу (канал, id поста) с TTL"""
+
+    def __init__(self, ttl: float = MEDIA_CACHE_TTL, size: int = MEDIA_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.entries = {}  # ключ -> (истекает, future с file_id)
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, future = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        return future
+
+    def _put(self, key, future):
+        if len(self.entries) >= self.size:
+            now = time.monotonic()
+            self.entries = {k: v for k, v in self.entries.items() if v[0] >= now}
+            # Всё ещё полно - выбрасываем самые старые записи
+            while len(self.entries) >= self.size:
+                del self.entries[next(iter(self.entries))]
+        self.entries[key] = (time.monotonic() + self.ttl, future)
+
+    async def send_once(self, key, upload: Callable[[], Awaitable[str | list[str]]],
+                        send_by_id: Callable[[str | list[str]], Awaitable]):
+        """Первый получатель загружает медиа через upload() (возвращает file_id
+        или список file_id альбома), остальные получают его через send_by_id.
+
+        Ошибка загрузки может касаться только первого получателя (заблокировал бота и т.п.),
+        поэтому ожидающим она не передаётся: один из них загружает заново. Исключение -
+        RetryAfter: это лимит бота, и повторная загрузка упрётся в него же"""
+        while True:
+            future = self._get(key)
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self._put(key, future)
+                try:
+                    file_id = await upload()
+                except BaseException as e:
+                    self.entries.pop(key, None)
+                    if isinstance(e, TelegramRetryAfter):
+                        future.set_exception(e)
+                        future.exception()  # ожидающих может не быть
+                    else:
+                        future.set_result(RETRY_UPLOAD)
+                    raise
+                future.set_result(file_id)
+                return
+
+            file_id = await asyncio.shield(future)
+            if file_id is not RETRY_UPLOAD:
+                await send_by_id(file_id)
+                return
@@ -0,0 +1,244 @@
+# metrics.py
+"""Счётчики и гистограммы в памяти процесса и HTTP-эндпоинт /metrics в формате Prometheus"""
+import bisect
+import functools
+import math
+import time
+from aiohttp import web
+from config import METRICS_HOST
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм задержек, с
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Текстовый формат экспозиции Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = []
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        REGISTRY.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Метрика с конкретными значениями меток (создаётся при первом обращении)"""
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._new_child()
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class _Value:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function):
+        """Значение вычисляется в момент запроса /metrics"""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function else self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+            for values, child in self.children.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    """Контекстный менеджер: записать в гистограмму время выполнения блока"""
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _samples(self):
+        lines = []
+        for values, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+def timed(histogram: Histogram):
+    """Декоратор корутины: время вызова - в гистограмму с меткой по имени функции"""
+    def decorator(func):
+        child = histogram.labels(func.__name__)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            logger.error(f"Ошибка сбора метрики {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_server(port: int, host: str = METRICS_HOST) -> web.AppRunner | None:
+    """Поднять /metrics на host:port; port = 0 - метрики по HTTP не отдаются"""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
+
+
+# ===== МЕТРИКИ =====
+# Монитор
+CHECK_CYCLE_SECONDS = Histogram("parser_check_cycle_seconds", "Длительность цикла проверки каналов")
+CHANNEL_FETCH_SECONDS = Histogram("parser_channel_fetch_seconds", "Время получения новых постов одного канала")
+CHANNELS_CHECKED = Counter("parser_channels_checked_total", "Проверено каналов")
+POSTS_FOUND = Counter("parser_posts_found_total", "Найдено новых постов", ("source",))
+FLOOD_WAITS = Counter("parser_flood_wait_total", "FloodWaitError от Telegram", ("operation",))
+FLOOD_WAIT_SECONDS = Counter("parser_flood_wait_seconds_total", "Суммарная длительность FloodWait, с", ("operation",))
+QUEUE_DEPTH = Gauge("parser_queue_depth", "Глубина очередей", ("queue",))
+MONITORED_CHANNELS = Gauge("parser_monitored_channels", "Каналов в расписании опроса")
+CONNECTION_STATE = Gauge("parser_connection_state", "Текущее состояние соединения аккаунта (1 - активно)", ("session", "state"))
+CONNECTION_TRANSITIONS = Counter("parser_connection_transitions_total", "Переходы состояния соединения", ("session", "state"))
+
+# Рассылка
+SEND_SECONDS = Histogram("parser_send_seconds", "Время отправки одного сообщения через Bot API")
+SENT = Counter("parser_sent_total", "Результаты отправки", ("result",))
+RETRY_AFTER = Counter("parser_retry_after_total", "TelegramRetryAfter от Bot API", ("operation",))
+FILTERED_OUT = Counter("parser_filtered_out_total", "Не отправлено постов, не прошедших фильтры подписки")
+DIGEST_POSTS = Counter("parser_digest_posts_total", "Постов, отправленных в составе дайджестов", ("reason",))
+DUPLICATES_SUPPRESSED = Counter("parser_duplicates_suppressed_total", "Не отправлено повторов уже полученного контента")
+
+# База
+DB_QUERY_SECONDS = Histogram("parser_db_query_seconds", "Время запросов к базе по функциям", ("function",))
+
+# Бот
+UPDATE_SECONDS = Histogram("parser_bot_update_seconds", "Время обработки апдейта ботом", ("event",))
+WEBHOOK_REJECTED = Counter("parser_webhook_rejected_total", "Апдейтов webhook, отклонённых с 503 из-за перегрузки")
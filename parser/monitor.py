@@ -1,300 +1,841 @@
 # monitor.py
 import asyncio
-from telethon import TelegramClient, errors
-from telethon.tl.types import Message, MessageMediaPhoto, Channel, Chat
-from config import API_ID, API_HASH, CHECK_INTERVAL, PHONE_NUMBER
+import json
+import os
+import sys
+import time
+from telethon import errors, events, utils
+from telethon.tl.functions.channels import JoinChannelRequest
+from telethon.tl.types import Message, MessageMediaPhoto, Channel, Chat, InputPeerChannel
+from config import (
+    CHECK_INTERVAL, PHONE_NUMBER,
+    PUSH_MODE, RECONCILE_INTERVAL, CHANNELS_REFRESH_INTERVAL, SUBSCRIPTIONS_SYNC_INTERVAL, SUBSCRIPTION_CHANGES_TTL,
+    CHECK_CONCURRENCY, ACCOUNT_REQUESTS_PER_SECOND, ACCOUNT_REQUESTS_BURST,
+    CATCHUP_MAX_POSTS, CATCHUP_TAIL_POSTS, SHARDS, SHARD_HEARTBEAT_INTERVAL,
+    UPDATE_STATE_SAVE_INTERVAL, JOIN_INTERVAL, JOIN_RETRY_BASE, JOIN_RETRY_MAX,
+    METRICS_MONITOR_PORT, ALBUM_WAIT, MEDIA_MAX_SIZE, MEDIA_SPOOL_DIR, FILTERS_REFRESH_INTERVAL,
+    DIGEST_ITEM_LENGTH, POST_RETRY_ATTEMPTS, POST_RETRY_DELAY
+)
 from database.db import (
-    get_all_monitor_channels, get_last_post_id, update_last_post_id, 
-    get_users_monitoring_channel, set_channel_subscribed, is_channel_subscribed,
-    get_channels_to_subscribe
+    init_db, close_db, get_last_post_id, set_channel_subscribed,
+    get_channels_to_subscribe, get_subscribed_channels,
+    get_channels_state, update_last_post_ids, normalize_username,
+    get_next_join_retry, record_join_failure, get_join_attempts, enqueue_post,
+    delete_old_subscription_changes, delete_expired_outbox_sent
+)
+from ratelimit import TokenBucket
+from subscribers import subscriber_index
+from resolver import PeerResolver
+from sharding import ShardCoordinator
+from scheduler import PollScheduler
+from catchup import UpdateCatchUp
+from dedup import fingerprints
+from filters import filter_index
+from connection import ConnectionSupervisor, CONNECTED
+import metrics
+from metrics import (
+    CHECK_CYCLE_SECONDS, CHANNEL_FETCH_SECONDS, CHANNELS_CHECKED, POSTS_FOUND,
+    FLOOD_WAITS, FLOOD_WAIT_SECONDS, QUEUE_DEPTH, MONITORED_CHANNELS
 )
-from bot import bot
 import logging
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def remove_files(media: list):
+    """Удалить скачанные файлы медиа [(вид, путь)]"""
+    for _, path in media:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def media_kind(message) -> str | None:
+    """Вид медиа, которое пересылаем файлом: photo, video или document"""
+    if message.photo:
+        return 'photo'
+    if message.video:
+        return 'video'
+    if message.document:
+        return 'document'
+    return None
+
+
 class ChannelMonitor:
-    def __init__(self):
-        self.client = None
+    def __init__(self, session: str = 'user_session', phone: str = PHONE_NUMBER, shard_id: str = None,
+                 client_factory=None):
+        self.session = session
+        self.phone = phone
+        # В шардированном режиме монитор ведёт только назначенные ему каналы
+        self.shard = ShardCoordinator(shard_id) if shard_id else None
+        # Одно долгоживущее соединение: пинги и переподключение при сбое ведёт супервизор
+        self.connection = ConnectionSupervisor(session, phone, client_factory)
+        self.connection.listeners.append(self.on_connection_state)
         self.is_running = False
-        self.is_connected = False
+        self.push_mode = PUSH_MODE
+        # Состояние push-режима
+        self.push_entities = {}        # monitor_channel -> entity
+        self.channel_by_peer = {}      # peer_id -> monitor_channel
+        self.handler_channels = None   # каналы, под которые собран текущий обработчик
+        self.new_message_event = None
+        self.channel_locks = {}
+        # Параллельная проверка: общий бюджет запросов аккаунта и очередь доставки
+        self.connect_lock = asyncio.Lock()
+        self.api_budget = TokenBucket(ACCOUNT_REQUESTS_PER_SECOND, ACCOUNT_REQUESTS_BURST)
+        self.resolver = PeerResolver(session)
+        # Рассылкой занимаются процессы notifier.py: посты уходят к ним через outbox в базе
+        self.spool_dir = MEDIA_SPOOL_DIR
+        self.delivery_queue = asyncio.Queue()
+        self.albums = {}               # (канал, grouped_id) -> части альбома, ждущие отправки
+        self.album_timers = {}         # (канал, grouped_id) -> таймер отправки альбома
+        self.album_tasks = set()       # запущенные по таймеру отправки (asyncio держит задачи слабо)
+        QUEUE_DEPTH.labels("posts").set_function(self.delivery_queue.qsize)
+        self.last_cycle_duration = None
+        # Каждый канал опрашивается по своему расписанию
+        self.scheduler = PollScheduler(RECONCILE_INTERVAL if self.push_mode else CHECK_INTERVAL)
+        # Состояние обновлений Telegram: после рестарта/переподключения догоняем через getDifference
+        self.catchup = UpdateCatchUp(session)
+        self.needs_catch_up = False
+        # Курсоры каналов в памяти; в базу пишутся пачкой
+        self.cursors = {}
+        self.dirty_cursors = {}
+        # Прочитанные, но ещё не записанные в outbox посты: курсор в базе не обгоняет их,
+        # и после падения они будут прочитаны заново
+        self.in_flight = {}            # канал -> {id постов}
+        self.post_attempts = {}        # (канал, id первого сообщения) -> неудачных попыток записи
+        self.retry_tasks = set()       # отложенные повторы записи постов
 
-    async def ensure_connection(self):
-        """Убедиться, что соединение установлено"""
-        if self.is_connected and self.client and self.client.is_connected():
-            return True
-        
+    def channel_lock(self, channel: str) -> asyncio.Lock:
+        """Блокировка курсора канала (опрос и push не должны доставить пост дважды)"""
+        lock = self.channel_locks.get(channel)
+        if lock is None:
+            lock = self.channel_locks[channel] = asyncio.Lock()
+        return lock
+
+    def owns(self, channel: str) -> bool:
+        """Ведёт ли этот монитор канал"""
+        return self.shard is None or channel in self.shard.assigned
+
+    def advance_cursor(self, channel: str, post_id: int, posts=()):
+        """Сдвинуть курсор канала (запись в базу - в flush_cursors); posts - id постов,
+        которые ещё предстоит записать в outbox"""
+        if posts:
+            self.in_flight.setdefault(channel, set()).update(posts)
+        if post_id > self.cursors.get(channel, 0):
+            self.cursors[channel] = post_id
+            self.dirty_cursors[channel] = post_id
+
+    def durable_cursor(self, channel: str, done=()) -> int:
+        """Курсор, который можно сохранить: не дальше первого поста, ещё не записанного в outbox
+        (done - посты, записываемые прямо сейчас)"""
+        waiting = self.in_flight.get(channel, set()).difference(done)
+        if waiting:
+            return min(waiting) - 1
+        return self.cursors.get(channel, 0)
+
+    def finish_posts(self, channel: str, posts):
+        """Посты записаны в outbox вместе с курсором"""
+        waiting = self.in_flight.get(channel)
+        if waiting is not None:
+            waiting.difference_update(posts)
+            if not waiting:
+                del self.in_flight[channel]
+
+    async def flush_cursors(self):
+        """Записать накопленные курсоры одной транзакцией"""
+        if not self.dirty_cursors:
+            return
+        self.dirty_cursors, dirty = {}, self.dirty_cursors
+        cursors = {channel: self.durable_cursor(channel) for channel in dirty}
         try:
-            if self.client:
-                await self.client.disconnect()
-            
-            self.client = TelegramClient('user_session', API_ID, API_HASH)
-            await self.client.start(phone=PHONE_NUMBER)
-            self.is_connected = True
+            await update_last_post_ids(cursors)
+        except Exception:
+            # Вернём несохранённое, чтобы записать в следующий раз
+            for channel, post_id in cursors.items():
+                self.dirty_cursors[channel] = max(post_id, self.dirty_cursors.get(channel, 0))
+            raise
+
+    @property
+    def client(self):
+        return self.connection.client
+
+    @property
+    def is_connected(self) -> bool:
+        return self.connection.connected
+
+    def on_connection_state(self, old: str, new: str):
+        """После (пере)подключения догоняем пропущенное через getDifference"""
+        if new == CONNECTED:
+            self.needs_catch_up = True
+
+    async def ensure_connection(self):
+        """Убедиться, что соединение установлено.
+
+        Первое подключение выполняется здесь; обрывы дальше чинит супервизор,
+        а воркеры до его окончания просто пропускают свою итерацию"""
+        if self.connection.client is not None:
+            return self.is_connected
+
+        async with self.connect_lock:
+            # Пока ждали блокировку, соединение мог поднять другой воркер
+            if self.connection.client is not None:
+                return self.is_connected
+            if not await self.connection.connect():
+                return False
+            # Клиент живёт всё время работы монитора - обработчики регистрируются один раз
+            self.client.add_event_handler(self.catchup.on_raw, events.Raw)
             logger.info("Соединение с Telegram установлено")
             return True
-            
-        except Exception as e:
-            logger.error(f"Ошибка подключения: {e}")
-            self.is_connected = False
-            return False
 
     async def start(self):
         """Запуск монитора"""
         self.is_running = True
         logger.info("Монитор каналов запущен")
-        
+
+        # Резолв каналов берём из сохранённого кэша, а не из Telegram
+        await self.resolver.load()
+        await self.catchup.load()
+        if not subscriber_index.loaded:
+            await subscriber_index.load()
+        await filter_index.refresh()
+
+        # Получаем свою долю каналов до первой подписки
+        if self.shard:
+            await self.shard.heartbeat()
+            asyncio.create_task(self.shard_heartbeat())
+
         # Устанавливаем соединение
         if await self.ensure_connection():
-            # Подписываемся на необходимые каналы
-            await self.subscribe_to_channels()
+            # Догоняем пропущенное за время простоя до первого опроса
+            await self.catch_up_missed()
         
-        # Запускаем периодическую проверку
+        # Запускаем передачу постов в рассылку и периодическую проверку
+        asyncio.create_task(self.deliver_posts())
         asyncio.create_task(self.periodic_check())
+        asyncio.create_task(self.sync_subscribers())
+        # Подписка на новые каналы - в фоне, опрос её не ждёт
+        asyncio.create_task(self.join_worker())
+
+        if self.push_mode:
+            asyncio.create_task(self.watch_channels())
 
     async def stop(self):
         """Остановка монитора"""
         self.is_running = False
-        if self.client and self.client.is_connected():
-            await self.client.disconnect()
-        self.is_connected = False
-        logger.info("Монитор каналов остановлен")
-
-    async def subscribe_to_channels(self):
-        """Подписаться на все необходимые каналы"""
+        # Альбомы, ждущие остальных частей, отправляем сразу - пока есть соединение для загрузки медиа
         try:
-            if not await self.ensure_connection():
-                logger.error("Не удалось установить соединение для подписки")
-                return
-                
-            channels_to_subscribe = await get_channels_to_subscribe()
-            logger.info(f"Найдено {len(channels_to_subscribe)} каналов для подписки")
-            
-            for channel_username in channels_to_subscribe:
-                try:
-                    success = await self.subscribe_to_channel(channel_username)
-                    if success:
-                        await set_channel_subscribed(channel_username, True)
-                        logger.info(f"Успешно подписались на {channel_username}")
-                    else:
-                        logger.warning(f"Не удалось подписаться на {channel_username}")
-                    
-                    await asyncio.sleep(3)  # Пауза между подписками
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка подписки на {channel_username}: {e}")
-                    
+            for group in list(self.albums):
+                await self.flush_album(group)
+            if self.album_tasks:
+                await asyncio.gather(*self.album_tasks, return_exceptions=True)
         except Exception as e:
-            logger.error(f"Ошибка в subscribe_to_channels: {e}")
-
-    async def subscribe_to_channel(self, channel_username: str) -> bool:
-        """Подписаться на конкретный канал"""
-        try:
-            if not await self.ensure_connection():
-                logger.error("Нет соединения для подписки")
-                return False
-                
-            if channel_username.startswith('@'):
-                channel_username = channel_username[1:]
-            
-            # Пробуем найти канал
+            logger.error(f"Не удалось отправить ожидающие альбомы: {e}")
+        # Посты, ждущие повтора, остаются в in_flight: курсор в базе перед ними, после рестарта они прочитаются снова
+        for task in self.retry_tasks:
+            task.cancel()
+        if self.shard:
+            await self.shard.leave()
+        if self.is_connected:
             try:
-                entity = await self.client.get_entity(channel_username)
-            except errors.UsernameInvalidError:
-                logger.error(f"Неверное имя пользователя: {channel_username}")
-                return False
-            except errors.UsernameNotOccupiedError:
-                logger.error(f"Канал не существует: {channel_username}")
-                return False
-            
-            # Подписываемся на канал
+                await self.catchup.save(self.client)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить состояние обновлений: {e}")
+        await self.connection.stop()
+        logger.info("Монитор каналов остановлен")
+
+    async def join_worker(self):
+        """Фоновая подписка на каналы с учётом FloodWait и повторов, сохранённых в базе"""
+        while self.is_running:
             try:
-                await self.client.join_channel(entity)
-                await asyncio.sleep(2)  # Даем время для обработки
-                return True
-                
-            except errors.InviteRequestSentError:
-                logger.warning(f"Запрос на вступление отправлен для {channel_username}")
-                return True  # Считаем успехом, ждем подтверждения
-            except errors.UserAlreadyParticipantError:
-                logger.info(f"Уже подписан на {channel_username}")
-                return True
+                if not await self.ensure_connection():
+                    await asyncio.sleep(CHANNELS_REFRESH_INTERVAL)
+                    continue
+
+                channels = [ch for ch in await get_channels_to_subscribe() if self.owns(ch)]
+                for channel in channels:
+                    if not self.is_running:
+                        return
+                    await self.join_channel(channel)
+                    await asyncio.sleep(JOIN_INTERVAL)
+
+                if not channels:
+                    # Ждём ближайшего повтора, но проверяем новые каналы не реже CHANNELS_REFRESH_INTERVAL
+                    next_retry = await get_next_join_retry()
+                    delay = CHANNELS_REFRESH_INTERVAL
+                    if next_retry is not None:
+                        delay = min(delay, max(1, next_retry - time.time()))
+                    await asyncio.sleep(delay)
+
+            except errors.FloodWaitError as e:
+                # Лимит на вступления общий для аккаунта - ждём его целиком
+                logger.warning(f"FloodWait на подписку: ждём {e.seconds} с")
+                await asyncio.sleep(e.seconds)
+
             except Exception as e:
-                logger.error(f"Ошибка join_channel для {channel_username}: {e}")
-                return False
-            
+                logger.error(f"Ошибка в join_worker: {e}")
+                await asyncio.sleep(CHANNELS_REFRESH_INTERVAL)
+
+    async def join_channel(self, channel_username: str):
+        """Подписаться на канал; неудача сохраняется в базе с временем следующей попытки.
+        FloodWaitError пробрасывается, чтобы воркер приостановил все подписки"""
+        try:
+            await self.subscribe_to_channel(channel_username)
+            await set_channel_subscribed(channel_username, True)
+            logger.info(f"Успешно подписались на {channel_username}")
+
+        except errors.FloodWaitError as e:
+            FLOOD_WAITS.labels("join").inc()
+            FLOOD_WAIT_SECONDS.labels("join").inc(e.seconds)
+            await record_join_failure(channel_username, f"FloodWait {e.seconds} с", int(time.time()) + e.seconds)
+            raise
+
         except Exception as e:
-            logger.error(f"Общая ошибка подписки на {channel_username}: {e}")
-            return False
+            attempts = await get_join_attempts(channel_username)
+            delay = min(JOIN_RETRY_MAX, JOIN_RETRY_BASE * 2 ** attempts)
+            await record_join_failure(channel_username, str(e) or type(e).__name__, int(time.time()) + delay)
+            logger.warning(
+                f"Не удалось подписаться на {channel_username} (попытка {attempts + 1}): {e}; "
+                f"повтор через {delay} с"
+            )
+
+    async def subscribe_to_channel(self, channel_username: str):
+        """Подписаться на конкретный канал; ошибки пробрасываются вызывающему"""
+        if not await self.ensure_connection():
+            raise ConnectionError("Нет соединения для подписки")
+
+        # Пробуем найти канал (input peer из кэша, без запроса к Telegram)
+        entity = await self.resolver.resolve(self.client, channel_username, self.api_budget)
+
+        # Подписываемся на канал
+        try:
+            await self.api_budget.acquire()
+            await self.client(JoinChannelRequest(entity))
+
+        except errors.InviteRequestSentError:
+            logger.warning(f"Запрос на вступление отправлен для {channel_username}")  # ждём подтверждения
+        except errors.UserAlreadyParticipantError:
+            logger.info(f"Уже подписан на {channel_username}")
+        except (errors.ChannelPrivateError, errors.ChannelInvalidError):
+            await self.resolver.invalidate(channel_username)
+            raise
 
     async def get_channel_entity(self, channel_username):
         """Получить entity канала"""
         try:
             if not await self.ensure_connection():
                 return None
-                
-            if channel_username.startswith('@'):
-                channel_username = channel_username[1:]
-                
-            entity = await self.client.get_entity(channel_username)
-            return entity
+
+            return await self.resolver.resolve(self.client, channel_username, self.api_budget)
             
         except Exception as e:
             logger.error(f"Ошибка получения канала {channel_username}: {e}")
             return None
 
-    async def get_new_posts(self, channel_username):
-        """Получить новые посты из канала"""
+    async def get_new_posts(self, channel_username, last_post_id: int):
+        """Получить новые посты из канала (курсор - из состояния цикла).
+        Возвращает посты (от новых к старым) и при большом разрыве - диапазон пропущенных id (первый, последний)"""
         try:
             if not await self.ensure_connection():
-                return []
-
-            # Проверяем, подписан ли уже на канал
-            if not await is_channel_subscribed(channel_username):
-                logger.info(f"Пытаемся подписаться на {channel_username}")
-                success = await self.subscribe_to_channel(channel_username)
-                if success:
-                    await set_channel_subscribed(channel_username, True)
-                else:
-                    return []
+                return [], None
 
             entity = await self.get_channel_entity(channel_username)
             if not entity:
-                return []
+                return [], None
 
-            last_post_id = await get_last_post_id(channel_username)
-            messages = []
-            
-            async for message in self.client.iter_messages(entity, limit=5):
-                if message.id > last_post_id and (message.message or message.media):
-                    messages.append(message)
-                else:
-                    break
+            # Новый канал: без догонялок, только последние посты
+            if not last_post_id:
+                limit = CATCHUP_TAIL_POSTS
+            else:
+                limit = CATCHUP_MAX_POSTS + 1
+
+            # Всё, что новее курсора, пачками (iter_messages листает по 100)
+            fetched = []
+            await self.api_budget.acquire()
+            async for message in self.client.iter_messages(entity, min_id=last_post_id, limit=limit):
+                fetched.append(message)
+                if len(fetched) % 100 == 0:
+                    await self.api_budget.acquire()
+
+            if not fetched:
+                return [], None
+
+            # Канал мог сменить username - тогда кэш резолва устарел
+            await self.resolver.check_username(channel_username, fetched[0].chat)
+
+            # Служебные и пустые сообщения пропускаем, но не прерываемся на них
+            messages = [msg for msg in fetched if not msg.action and (msg.message or msg.media)]
+
+            gap = None
+            if last_post_id and len(fetched) > CATCHUP_MAX_POSTS:
+                # Слишком большой разрыв: доставляем хвост, остальное - сводкой
+                messages = messages[:CATCHUP_TAIL_POSTS]
+                gap = (last_post_id + 1, (messages[-1].id if messages else fetched[0].id + 1) - 1)
+                logger.warning(f"Разрыв в {channel_username}: ~{gap[1] - gap[0] + 1} постов пропущено")
+
+            # Курсор двигаем и за служебные сообщения, чтобы не читать их снова;
+            # в базе он дойдёт до постов, только когда они попадут в outbox
+            self.advance_cursor(channel_username, max(msg.id for msg in fetched), [msg.id for msg in messages])
 
             if messages:
-                # Обновляем последний ID поста
-                latest_id = max(msg.id for msg in messages)
-                await update_last_post_id(channel_username, latest_id)
                 logger.info(f"Найдено {len(messages)} новых постов в {channel_username}")
 
-            return messages
+            return messages, gap
+
+        except errors.FloodWaitError as e:
+            # Канал опросим в следующий раз, сам лимит соблюдает api_budget
+            FLOOD_WAITS.labels("fetch").inc()
+            FLOOD_WAIT_SECONDS.labels("fetch").inc(e.seconds)
+            logger.warning(f"FloodWait {e.seconds} с при чтении {channel_username}")
+            return [], None
+
+        except (errors.ChannelPrivateError, errors.ChannelInvalidError) as e:
+            # Нас удалили из канала или сохранённый access_hash больше не годится
+            await self.resolver.invalidate(channel_username)
+            await set_channel_subscribed(channel_username, False)
+            logger.error(f"Канал {channel_username} недоступен: {e}")
+            return [], None
 
         except Exception as e:
             logger.error(f"Ошибка получения постов из {channel_username}: {e}")
-            return []
+            return [], None
+
+    async def refresh_handlers(self):
+        """Перестроить обработчик NewMessage под текущий список подписанных каналов"""
+        if not await self.ensure_connection():
+            return
 
-    async def process_message(self, message, monitor_channel):
-        """Обработать сообщение и отправить уведомления"""
+        channels = frozenset(ch for ch in await get_subscribed_channels() if self.owns(ch))
+        if channels == self.handler_channels:
+            return
+
+        # Резолвим только новые каналы, удалённые просто выбрасываем
+        for channel in list(self.push_entities):
+            if channel not in channels:
+                del self.push_entities[channel]
+        for channel in channels - self.push_entities.keys():
+            entity = await self.get_channel_entity(channel)
+            if entity:
+                self.push_entities[channel] = entity
+
+        self.channel_by_peer = {
+            utils.get_peer_id(entity): channel
+            for channel, entity in self.push_entities.items()
+        }
+
+        if self.new_message_event is not None:
+            self.client.remove_event_handler(self.on_new_message, self.new_message_event)
+            self.new_message_event = None
+        if self.push_entities:
+            self.new_message_event = events.NewMessage(chats=list(self.push_entities.values()))
+            self.client.add_event_handler(self.on_new_message, self.new_message_event)
+
+        self.handler_channels = channels
+        logger.info(f"Push-обработчик обновлён: {len(self.push_entities)} каналов")
+
+    async def watch_channels(self):
+        """Следить за изменением списка каналов и пересобирать обработчик"""
+        while self.is_running:
+            try:
+                await self.refresh_handlers()
+                await self.flush_cursors()
+            except Exception as e:
+                logger.error(f"Ошибка обновления push-обработчика: {e}")
+            await asyncio.sleep(CHANNELS_REFRESH_INTERVAL)
+
+    async def accept_post(self, channel: str, message) -> bool:
+        """Принять пост вне опроса (push, догонялки): сдвинуть курсор и поставить в доставку"""
+        if not (message.message or message.media):
+            return False
+
+        async with self.channel_lock(channel):
+            if channel not in self.cursors:
+                self.cursors[channel] = await get_last_post_id(channel)
+            if message.id <= self.cursors[channel]:
+                return False  # уже доставлен опросом
+            self.advance_cursor(channel, message.id, (message.id,))
+
+        self.delivery_queue.put_nowait((message, channel))
+        return True
+
+    async def on_new_message(self, event):
+        """Обработать пост, пришедший через update-событие"""
         try:
-            # Получаем всех пользователей, которые мониторят этот канал
-            user_ids = await get_users_monitoring_channel(monitor_channel)
-            
+            channel = self.channel_by_peer.get(event.chat_id)
+            if channel is not None and await self.accept_post(channel, event.message):
+                POSTS_FOUND.labels("push").inc()
+                logger.info(f"Новый пост в {channel} (push)")
+
+        except Exception as e:
+            logger.error(f"Ошибка обработки push-события: {e}")
+
+    async def catch_up_missed(self):
+        """Догнать пропущенное после (пере)подключения через getDifference/getChannelDifference"""
+        if not self.needs_catch_up:
+            return
+        self.needs_catch_up = False
+        try:
+            channels = {}
+            for channel in await get_subscribed_channels():
+                if not self.owns(channel):
+                    continue
+                peer = await self.resolver.resolve(self.client, channel, self.api_budget)
+                if isinstance(peer, InputPeerChannel):
+                    channels[peer.channel_id] = (channel, peer)
+
+            messages, covered = await self.catchup.catch_up(
+                self.client, {channel_id: peer for channel_id, (_, peer) in channels.items()}
+            )
+
+            accepted = 0
+            for message in messages:
+                channel, _ = channels[message.peer_id.channel_id]
+                accepted += await self.accept_post(channel, message)
+            POSTS_FOUND.labels("catchup").inc(accepted)
+            # Догнанным каналам не нужен немедленный опрос истории
+            for channel_id in covered:
+                self.scheduler.postpone(channels[channel_id][0])
+            await self.flush_cursors()
+
+            logger.info(
+                f"Догонялки: {accepted} пропущенных постов, "
+                f"{len(covered)} из {len(channels)} каналов не требуют опроса"
+            )
+
+        except Exception as e:
+            logger.error(f"Ошибка догонялок через getDifference: {e}")
+
+    async def process_message(self, messages: list, monitor_channel):
+        """Записать пост (одно сообщение или альбом) и доставку каждому подписчику в outbox
+        одной транзакцией со сдвигом курсора канала"""
+        try:
+            ids = [msg.id for msg in messages]
+            cursor = self.durable_cursor(monitor_channel, ids)
+
+            # Текст альбома - подпись любой из его частей (обычно первой)
+            caption = next((msg.message for msg in messages if msg.message), "")
+            # Фильтры подписок применяются до рассылки: отсеянным не пишем доставки в outbox
+            user_ids = filter_index.select(monitor_channel, caption, subscriber_index.users(monitor_channel))
+
+            # Никто не мониторит канал или пост не прошёл фильтры - не качаем медиа, только сдвигаем курсор
             if not user_ids:
+                await enqueue_post(None, monitor_channel, None, (), cursor)
+                self.finish_posts(monitor_channel, ids)
+                self.post_attempts.pop((monitor_channel, ids[0]), None)
                 return
 
             # Формируем текст сообщения
             text = f"📢 **Новый пост в {monitor_channel}:**\n\n"
-            if message.message:
+            if caption:
                 # Обрезаем длинный текст
-                if len(message.message) > 1000:
-                    text += message.message[:1000] + "..."
+                if len(caption) > 1000:
+                    text += caption[:1000] + "..."
                 else:
-                    text += message.message
+                    text += caption
             else:
                 text += "📷 Фото/медиа"
-            
-            # Отправляем каждому пользователю
-            for user_id in user_ids:
-                try:
-                    # Если есть медиа, пытаемся отправить с медиа
-                    if message.media and hasattr(message.media, 'photo'):
-                        await self.send_message_with_media(user_id, text, message)
-                    else:
-                        # Для текстовых сообщений или других типов медиа
-                        await bot.send_message(user_id, text, parse_mode='Markdown')
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка отправки пользователю {user_id}: {e}")
+
+            # Ключ поста - первое сообщение (у альбома - первая часть); с user_id - ключ идемпотентности
+            username = normalize_username(monitor_channel)
+            post_key = f"{username}:{messages[0].id}"
+            post = {
+                'text': text,
+                'parse_mode': 'Markdown',
+                # Для дайджеста: строка о посте и ссылка на оригинал
+                'summary': caption.strip().split('\n')[0][:DIGEST_ITEM_LENGTH] if caption.strip() else "📷 Фото/медиа",
+                'link': f"https://t.me/{username}/{messages[0].id}",
+                # Дубли из других каналов отсеивает процесс рассылки по отпечаткам
+                'fingerprints': fingerprints(messages),
+                'media': await self.download_media(messages, post_key),
+            }
+            if not await enqueue_post(post_key, monitor_channel, json.dumps(post, ensure_ascii=False), user_ids, cursor):
+                # Пост уже разослан (перечитан после рестарта) - скачанные файлы не нужны
+                remove_files(post['media'])
+            self.finish_posts(monitor_channel, ids)
+            self.post_attempts.pop((monitor_channel, ids[0]), None)
 
         except Exception as e:
-            logger.error(f"Ошибка обработки сообщения: {e}")
+            self.retry_post(messages, monitor_channel, e)
 
-    async def send_message_with_media(self, user_id, text, message):
-        """Отправить сообщение с медиа"""
+    def retry_post(self, messages: list, monitor_channel: str, error: Exception):
+        """Пост не записан в outbox: повторить через POST_RETRY_DELAY, после POST_RETRY_ATTEMPTS попыток -
+        пропустить, чтобы курсор канала в базе не стоял на нём до рестарта"""
+        key = (monitor_channel, messages[0].id)
+        if not self.is_running:
+            # Монитор останавливается: курсор в базе остался перед постом, после рестарта он будет прочитан снова
+            logger.error(f"Ошибка обработки поста {key}: {error}")
+            return
+
+        attempts = self.post_attempts.get(key, 0) + 1
+        if attempts < POST_RETRY_ATTEMPTS:
+            self.post_attempts[key] = attempts
+            logger.error(f"Ошибка обработки поста {key}: {error}; повтор через {POST_RETRY_DELAY} с")
+            task = asyncio.create_task(self.process_later(messages, monitor_channel))
+            self.retry_tasks.add(task)
+            task.add_done_callback(self.retry_tasks.discard)
+            return
+
+        self.post_attempts.pop(key, None)
+        logger.error(f"Пост {key} пропущен после {attempts} попыток: {error}")
+        self.finish_posts(monitor_channel, [msg.id for msg in messages])
+        # Курсор в базе больше не держится за пост - запишется со следующей пачкой курсоров
+        self.dirty_cursors[monitor_channel] = self.cursors.get(monitor_channel, 0)
+
+    async def process_later(self, messages: list, monitor_channel: str):
+        await asyncio.sleep(POST_RETRY_DELAY)
+        if self.is_running:
+            await self.process_message(messages, monitor_channel)
+
+    async def download_media(self, messages: list, post_key: str) -> list:
+        """Скачать медиа поста в MEDIA_SPOOL_DIR один раз для всех процессов рассылки.
+        Возвращает [(вид, путь)]; если скачать не удалось - пустой список, пост уйдёт текстом"""
+        # Фото, видео и документы; остальное (опросы, превью ссылок) - только текстом
+        media = [(msg, kind) for msg in messages if (kind := media_kind(msg))]
+        files = []
         try:
-            # Скачиваем медиа
-            media_data = await message.download_media(file=bytes)
-            
-            # Отправляем фото с текстом
-            await bot.send_photo(
-                chat_id=user_id,
-                photo=media_data,
-                caption=text,
-                parse_mode='Markdown'
-            )
-            
+            os.makedirs(self.spool_dir, exist_ok=True)
+            for message, kind in media:
+                if (message.file.size or 0) > MEDIA_MAX_SIZE:
+                    raise ValueError(f"{kind} {message.id} больше лимита загрузки Bot API")
+                await self.api_budget.acquire()
+                path = os.path.join(self.spool_dir, f"{post_key.replace(':', '_')}_{message.id}{message.file.ext or ''}")
+                await message.download_media(file=path)
+                files.append((kind, path))
         except Exception as e:
-            logger.error(f"Ошибка отправки медиа пользователю {user_id}: {e}")
-            # Если не удалось отправить с медиа, отправляем просто текст
-            await bot.send_message(user_id, text, parse_mode='Markdown')
+            logger.error(f"Ошибка загрузки медиа поста {post_key}: {e}")
+            remove_files(files)
+            return []
+        return files
+
+    async def notify_gap(self, monitor_channel: str, gap: tuple[int, int]):
+        """Сводка вместо постов, которые не стали догонять (gap - диапазон их id)"""
+        username = normalize_username(monitor_channel)
+        first_id, last_id = gap
+        skipped = last_id - first_id + 1
+        text = (
+            f"⚠️ В {monitor_channel} вышло слишком много постов: ~{skipped} пропущено, "
+            f"последние {CATCHUP_TAIL_POSTS} - ниже.\nВсе посты: https://t.me/{username}"
+        )
+        # Ключ - по диапазону: повтор того же разрыва после падения не дублирует сводку
+        post_key = f"{username}:gap:{first_id}-{last_id}"
+        await enqueue_post(
+            post_key, monitor_channel,
+            json.dumps({'text': text, 'summary': f"⚠️ ~{skipped} постов пропущено", 'link': f"https://t.me/{username}"},
+                       ensure_ascii=False),
+            subscriber_index.users(monitor_channel), self.durable_cursor(monitor_channel)
+        )
+
+    async def deliver_posts(self):
+        """Передавать найденные посты в рассылку (отдельно от проверки каналов)"""
+        while self.is_running:
+            message, channel = await self.delivery_queue.get()
+            try:
+                await self.collect_post(message, channel)
+            except Exception as e:
+                logger.error(f"Ошибка доставки поста из {channel}: {e}")
+            finally:
+                self.delivery_queue.task_done()
+
+    async def collect_post(self, message, channel):
+        """Части альбома (общий grouped_id) собираются в один пост, остальное уходит сразу"""
+        group = (channel, message.grouped_id) if message.grouped_id else None
+        # Следующий пост канала значит, что начатый альбом уже пришёл целиком
+        for key in [key for key in self.albums if key[0] == channel and key != group]:
+            await self.flush_album(key)
+
+        if group is None:
+            await self.process_message([message], channel)
+            return
+
+        if group not in self.albums:
+            # Последний альбом канала отправляем по таймауту - следующего поста может не быть
+            self.albums[group] = []
+            self.album_timers[group] = asyncio.get_running_loop().call_later(
+                ALBUM_WAIT, self.start_album_flush, group
+            )
+        self.albums[group].append(message)
+
+    def start_album_flush(self, group):
+        task = asyncio.create_task(self.flush_album(group))
+        self.album_tasks.add(task)
+        task.add_done_callback(self.album_tasks.discard)
+
+    async def flush_album(self, group):
+        timer = self.album_timers.pop(group, None)
+        if timer:
+            timer.cancel()
+        messages = self.albums.pop(group, None)
+        if messages:
+            await self.process_message(sorted(messages, key=lambda msg: msg.id), group[0])
+
+    async def check_channel_worker(self, channels: asyncio.Queue) -> int:
+        """Воркер пула: проверяет каналы из очереди, пока она не опустеет"""
+        found = 0
+        while True:
+            try:
+                channel = channels.get_nowait()
+            except asyncio.QueueEmpty:
+                return found
+
+            try:
+                async with self.channel_lock(channel):
+                    with CHANNEL_FETCH_SECONDS.time():
+                        new_posts, gap = await self.get_new_posts(channel, self.cursors.get(channel, 0))
+                CHANNELS_CHECKED.inc()
+                self.scheduler.record(channel, len(new_posts))
+                if gap:
+                    await self.notify_gap(channel, gap)
+                for post in reversed(new_posts):  # От старых к новым
+                    self.delivery_queue.put_nowait((post, channel))
+                found += len(new_posts)
+
+            except Exception as e:
+                logger.error(f"Ошибка проверки канала {channel}: {e}")
 
     async def check_channels(self):
-        """Проверить все каналы на новые посты"""
+        """Проверить каналы, которым по расписанию пора на проверку"""
         try:
             if not await self.ensure_connection():
                 logger.warning("Пропускаем проверку - нет соединения")
                 return
-                
-            monitor_channels = await get_all_monitor_channels()
-            logger.info(f"Проверяем {len(monitor_channels)} каналов")
-            
+
+            started = time.monotonic()
+            # Курсоры и флаги подписки всех каналов - одним запросом.
+            # Опрашиваем только подписанные: подпиской занимается join_worker
+            state = {
+                ch: last_post_id for ch, (last_post_id, subscribed) in (await get_channels_state()).items()
+                if subscribed and self.owns(ch)
+            }
+            self.scheduler.sync(state)
+            MONITORED_CHANNELS.set(len(state))
+            monitor_channels = self.scheduler.due()
+            if not monitor_channels:
+                return
+            logger.info(f"Проверяем {len(monitor_channels)} из {len(state)} каналов")
+
+            channels = asyncio.Queue()
             for channel in monitor_channels:
-                try:
-                    new_posts = await self.get_new_posts(channel)
-                    for post in reversed(new_posts):  # От старых к новым
-                        await self.process_message(post, channel)
-                        await asyncio.sleep(1)  # Пауза между постами
-                        
-                except Exception as e:
-                    logger.error(f"Ошибка проверки канала {channel}: {e}")
-                    
+                self.cursors[channel] = max(self.cursors.get(channel, 0), state[channel])
+                channels.put_nowait(channel)
+
+            workers = min(CHECK_CONCURRENCY, len(monitor_channels))
+            found = await asyncio.gather(*(
+                self.check_channel_worker(channels) for _ in range(workers)
+            ))
+            await self.flush_cursors()
+
+            self.last_cycle_duration = time.monotonic() - started
+            CHECK_CYCLE_SECONDS.observe(self.last_cycle_duration)
+            POSTS_FOUND.labels("poll").inc(sum(found))
+            logger.info(
+                f"Цикл проверки: {len(monitor_channels)} каналов, {sum(found)} новых постов "
+                f"за {self.last_cycle_duration:.1f} с (воркеров: {workers}, "
+                f"в очереди доставки: {self.delivery_queue.qsize()}, "
+                f"опросов в час по расписанию: {self.scheduler.polls_per_hour():.0f})"
+            )
+            if self.last_cycle_duration > self.scheduler.min_interval:
+                logger.warning("Цикл проверки дольше минимального интервала опроса - увеличьте CHECK_CONCURRENCY")
+
         except Exception as e:
             logger.error(f"Ошибка в check_channels: {e}")
 
+    async def shard_heartbeat(self):
+        """Периодический heartbeat шарда и обновление его набора каналов"""
+        while self.is_running:
+            await asyncio.sleep(SHARD_HEARTBEAT_INTERVAL)
+            try:
+                await self.shard.heartbeat()
+            except Exception as e:
+                logger.error(f"Ошибка heartbeat шарда {self.shard.shard_id}: {e}")
+
+    async def sync_subscribers(self):
+        """Подписки меняет бот: получатели постов догоняют базу за SUBSCRIPTIONS_SYNC_INTERVAL"""
+        while self.is_running:
+            await asyncio.sleep(SUBSCRIPTIONS_SYNC_INTERVAL)
+            try:
+                applied = await subscriber_index.sync()
+                if applied:
+                    logger.info(f"Применено изменений подписок: {applied}")
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации подписчиков: {e}")
+
     async def periodic_check(self):
-        """Периодическая проверка каналов"""
-        check_count = 0
+        """Периодическая проверка каналов по расписанию"""
+        last_consistency = last_state_save = last_filters = time.monotonic()
         while self.is_running:
             try:
+                if await self.ensure_connection():
+                    await self.catch_up_missed()
                 await self.check_channels()
-                check_count += 1
-                
-                # Переподключаемся каждые 10 проверок
-                if check_count >= 10:
-                    if self.client and self.client.is_connected():
-                        await self.client.disconnect()
-                    self.is_connected = False
-                    check_count = 0
-                    logger.info("Переподключаемся для обновления сессии")
-                
-                logger.info(f"Ожидаем {CHECK_INTERVAL} секунд до следующей проверки...")
-                await asyncio.sleep(CHECK_INTERVAL)
-                
+
+                if time.monotonic() - last_state_save >= UPDATE_STATE_SAVE_INTERVAL and self.is_connected:
+                    await self.catchup.save(self.client)
+                    last_state_save = time.monotonic()
+
+                if time.monotonic() - last_consistency >= RECONCILE_INTERVAL:
+                    await subscriber_index.check_consistency()
+                    await delete_old_subscription_changes(SUBSCRIPTION_CHANGES_TTL)
+                    await delete_expired_outbox_sent()
+                    last_consistency = time.monotonic()
+
+                if time.monotonic() - last_filters >= FILTERS_REFRESH_INTERVAL:
+                    await filter_index.refresh()
+                    last_filters = time.monotonic()
+
+                # Спим до ближайшего опроса, но не дольше CHANNELS_REFRESH_INTERVAL,
+                # чтобы новые каналы проверялись сразу после добавления
+                await asyncio.sleep(min(self.scheduler.time_until_next(), CHANNELS_REFRESH_INTERVAL))
+
             except Exception as e:
                 logger.error(f"Ошибка в periodic_check: {e}")
-                # При ошибке переподключаемся
-                self.is_connected = False
+                # Ошибка могла быть сетевой - пусть супервизор проверит соединение, не дожидаясь пинга
+                self.connection.check_now()
                 await asyncio.sleep(60)
 
-# Глобальный экземпляр монитора
-monitor = ChannelMonitor()
+# Монитор однопроцессного запуска: создаётся при первом обращении, а не при импорте -
+# процессы шардов и бенчмарк строят свои экземпляры и не держат лишний планировщик и метрики
+monitor = None
+
+def get_monitor() -> ChannelMonitor:
+    global monitor
+    if monitor is None:
+        monitor = ChannelMonitor()
+    return monitor
 
 async def start_monitor():
     """Запустить монитор"""
-    await monitor.start()
+    await get_monitor().start()
 
 async def stop_monitor():
     """Остановить монитор"""
-    await monitor.stop()
+    if monitor is not None:
+        await monitor.stop()
+
+async def main(shard_id: str = None):
+    """Отдельный процесс монитора; с shard_id - шард со своим аккаунтом из SHARDS"""
+    if shard_id:
+        session, phone = SHARDS[shard_id]
+        instance = ChannelMonitor(session, phone, shard_id)
+    else:
+        instance = get_monitor()
+
+    # Каждый шард - отдельный процесс со своим портом метрик
+    port = METRICS_MONITOR_PORT
+    if port and shard_id:
+        port += sorted(SHARDS).index(shard_id) + 1
+
+    await init_db()
+    metrics_runner = await metrics.start_server(port)
+    await instance.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await instance.stop()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await close_db()
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -0,0 +1,313 @@
+# notifier.py
+import asyncio
+import json
+import os
+import sys
+from functools import partial
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+from aiogram.types import FSInputFile, InputMediaPhoto, InputMediaVideo, InputMediaDocument, LinkPreviewOptions
+from config import (
+    API_TOKEN, DELIVERY_PROCESSES, DELIVERY_GLOBAL_RATE,
+    OUTBOX_POLL_INTERVAL, OUTBOX_BATCH, OUTBOX_MAX_PENDING, METRICS_DELIVERY_PORT,
+    DIGEST_BACKLOG_THRESHOLD, DIGEST_BACKLOG_WINDOW, DIGEST_SETTINGS_REFRESH, OUTBOX_SENT_TTL
+)
+from database.db import init_db, close_db, get_outbox_batch, ack_outbox, get_digest_windows
+from delivery import DeliveryQueue
+from media import MediaCache
+from dedup import DeliveredPosts
+from digest import DigestBuffer, format_digest
+import metrics
+from metrics import QUEUE_DEPTH, DUPLICATES_SUPPRESSED, DIGEST_POSTS
+import logging
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Подпись к медиа в Bot API - не длиннее 1024 символов
+MEDIA_CAPTION_LIMIT = 1024
+# sendMediaGroup принимает от 2 до 10 элементов
+MEDIA_GROUP_LIMIT = 10
+INPUT_MEDIA = {'photo': InputMediaPhoto, 'video': InputMediaVideo, 'document': InputMediaDocument}
+# Сколько при остановке ждать уже начатые рассылки, с
+STOP_DRAIN_TIMEOUT = 10
+# Сколько выполненных доставок удалять из outbox за один запрос
+ACK_BATCH = 500
+# Как часто проверять истёкшие окна дайджестов, с
+DIGEST_CHECK_INTERVAL = 1
+
+# Процесс рассылки только отправляет сообщения: апдейты бота получает bot.py
+bot = Bot(token=API_TOKEN)
+
+
+def file_id_of(sent, kind: str) -> str:
+    """file_id медиа в сообщении, отправленном ботом"""
+    if kind == 'photo':
+        return sent.photo[-1].file_id
+    return getattr(sent, kind).file_id
+
+
+async def send_media(chat_id, kinds: list, files: list, caption: str) -> list:
+    """Отправить медиа (файлы или file_id): одно - sendPhoto/Video/Document, несколько - альбомом"""
+    if len(files) == 1:
+        kind = kinds[0]
+        send = {'photo': bot.send_photo, 'video': bot.send_video, 'document': bot.send_document}[kind]
+        return [await send(chat_id, files[0], caption=caption, parse_mode='Markdown')]
+
+    sent = []
+    for start in range(0, len(files), MEDIA_GROUP_LIMIT):
+        chunk_kinds = kinds[start:start + MEDIA_GROUP_LIMIT]
+        chunk_files = files[start:start + MEDIA_GROUP_LIMIT]
+        chunk_caption = caption if not start else None
+        if len(chunk_files) == 1:
+            # Хвост из одного элемента альбомом не отправить
+            sent += await send_media(chat_id, chunk_kinds, chunk_files, chunk_caption)
+            continue
+        # Подпись альбома - у первого элемента
+        group = [
+            INPUT_MEDIA[kind](media=file, caption=chunk_caption if not i else None, parse_mode='Markdown')
+            for i, (kind, file) in enumerate(zip(chunk_kinds, chunk_files))
+        ]
+        sent += await bot.send_media_group(chat_id, group)
+    return sent
+
+
+class Notifier:
+    """Процесс рассылки: забирает из outbox доставки своего раздела пачками и выполняет их.
+
+    Раздел partition - пользователи с user_id % partitions == partition, поэтому отпечатки
+    доставленного и пауза между сообщениями в чат каждого пользователя живут в одном процессе.
+    Доставка удаляется из outbox только после отправки: при падении она будет выполнена снова.
+    Посты пользователей в режиме дайджеста (или с большой очередью) копятся в DigestBuffer
+    и уходят одним сообщением"""
+
+    def __init__(self, partition: int = 0, partitions: int = DELIVERY_PROCESSES,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.partition = partition
+        self.partitions = partitions
+        self.poll_interval = poll_interval
+        self.delivery = DeliveryQueue(rate=DELIVERY_GLOBAL_RATE / partitions)
+        self.media_cache = MediaCache()
+        self.delivered = DeliveredPosts()
+        self.is_running = False
+        self.tasks = []
+        self.last_id = 0      # последняя взятая из outbox доставка
+        self.pending = {}     # id доставки в работе -> (отпечатки поста, user_id)
+        self.done = []        # выполненные доставки, ждущие удаления из outbox
+        self.queued = {}      # user_id -> отправок в очереди рассылки
+        self.digest = DigestBuffer()
+        self.digest_windows = {}  # user_id -> окно дайджеста, с
+        QUEUE_DEPTH.labels("notifier").set_function(lambda: len(self.pending))
+        QUEUE_DEPTH.labels("digest").set_function(lambda: len(self.digest))
+
+    async def start(self):
+        self.is_running = True
+        self.digest_windows = await get_digest_windows()
+        self.delivery.start()
+        self.tasks = [
+            asyncio.create_task(self.run()), asyncio.create_task(self.refresh_settings()),
+            asyncio.create_task(self.flush_digests()),
+        ]
+        logger.info(f"Рассылка запущена: раздел {self.partition} из {self.partitions}")
+
+    async def stop(self):
+        self.is_running = False
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        # Накопленное для дайджестов не ждём: доставки остаются в outbox до следующего запуска
+        for user_id, items, _ in self.digest.drain():
+            for queue_id, *_ in items:
+                keys, _ = self.pending.pop(queue_id)
+                self.delivered.forget(keys, (user_id,))
+        # Дослать начатое; невыполненные доставки остаются в outbox до следующего запуска
+        try:
+            await asyncio.wait_for(self.drain(), STOP_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались {len(self.pending)} доставок, они останутся в outbox")
+        await self.delivery.stop()
+        # Неотправленное не должно считаться доставленным после рестарта
+        for keys, user_id in self.pending.values():
+            self.delivered.forget(keys, (user_id,))
+        try:
+            await self.flush_done()
+            await self.delivered.flush()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояние рассылки: {e}")
+        logger.info("Рассылка остановлена")
+
+    async def drain(self):
+        """Дождаться выполнения всех взятых из outbox доставок"""
+        while self.pending:
+            await asyncio.sleep(0.05)
+
+    async def refresh_settings(self):
+        """Окна дайджестов меняет бот в своём процессе - периодически перечитываем"""
+        while self.is_running:
+            await asyncio.sleep(DIGEST_SETTINGS_REFRESH)
+            try:
+                self.digest_windows = await get_digest_windows()
+            except Exception as e:
+                logger.error(f"Ошибка чтения настроек дайджестов: {e}")
+
+    async def flush_digests(self):
+        """Отправлять дайджесты, окно которых истекло"""
+        while self.is_running:
+            await asyncio.sleep(DIGEST_CHECK_INTERVAL)
+            for user_id, items, reason in self.digest.due():
+                self.send_digest(user_id, items, reason)
+
+    async def run(self):
+        """Забирать доставки раздела пачками и ставить их в очередь рассылки"""
+        while self.is_running:
+            try:
+                await self.flush_done()
+                # Не набираем в память больше, чем успеваем разослать
+                # (накопленное для дайджестов не в счёт - его держит окно, а не скорость отправки)
+                if len(self.pending) - len(self.digest) >= OUTBOX_MAX_PENDING:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                rows = await get_outbox_batch(self.partition, self.partitions, self.last_id, OUTBOX_BATCH)
+                if rows:
+                    self.last_id = rows[-1][0]
+                    await self.dispatch(rows)
+                if len(rows) < OUTBOX_BATCH:
+                    await asyncio.sleep(self.poll_interval)
+            except Exception as e:
+                logger.error(f"Ошибка чтения outbox: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def dispatch(self, rows):
+        """Выполнить пачку доставок: payload каждого поста разбирается и проверяется на дубли один раз"""
+        posts = {}  # post_key -> (канал, payload, {user_id: id доставки})
+        for queue_id, post_key, user_id, channel, payload in rows:
+            posts.setdefault(post_key, (channel, payload, {}))[2][user_id] = queue_id
+
+        for post_key, (channel, payload, deliveries) in posts.items():
+            post = json.loads(payload)
+            keys = post.get('fingerprints') or []
+            targets = list(deliveries)
+            if keys:
+                # Тот же контент из другого канала (репост, пересылка) или уже выполненная
+                # до рестарта доставка пользователю не повторяется
+                targets = await self.delivered.filter(keys, targets)
+                if len(targets) < len(deliveries):
+                    DUPLICATES_SUPPRESSED.inc(len(deliveries) - len(targets))
+                    logger.info(f"Пост из {channel}: {len(deliveries) - len(targets)} получателей уже видели его")
+                    sent = set(targets)
+                    self.done.extend(queue_id for user_id, queue_id in deliveries.items() if user_id not in sent)
+
+            send = None
+            for user_id in targets:
+                queue_id = deliveries[user_id]
+                self.pending[queue_id] = (keys, user_id)
+                window, reason = self.digest_windows.get(user_id, 0), 'user'
+                if not window and self.queued.get(user_id, 0) >= DIGEST_BACKLOG_THRESHOLD:
+                    # Очередь пользователя не успевает - дальше сводкой, а не по сообщению в секунду
+                    window, reason = DIGEST_BACKLOG_WINDOW, 'backlog'
+                if window:
+                    self.digest.add(user_id, (queue_id, post_key, channel, post), window, reason)
+                    continue
+                send = send or self.make_send(post, post_key)
+                self.submit(user_id, send, [queue_id])
+
+    def submit(self, user_id: int, send, queue_ids: list[int]):
+        self.queued[user_id] = self.queued.get(user_id, 0) + 1
+        self.delivery.submit(user_id, send, partial(self._sent, user_id, queue_ids))
+
+    def send_digest(self, user_id: int, items: list, reason: str):
+        """Отправить накопленное одним сообщением; один пост - как обычно, с медиа"""
+        queue_ids = [queue_id for queue_id, *_ in items]
+        if len(items) == 1:
+            _, post_key, _, post = items[0]
+            self.submit(user_id, self.make_send(post, post_key), queue_ids)
+            return
+
+        text = format_digest([(channel, post) for _, _, channel, post in items])
+        DIGEST_POSTS.labels(reason).inc(len(items))
+
+        async def send(user_id):
+            await bot.send_message(user_id, text, link_preview_options=LinkPreviewOptions(is_disabled=True))
+        self.submit(user_id, send, queue_ids)
+
+    def make_send(self, post: dict, post_key: str):
+        text, media = post['text'], post.get('media')
+        if media:
+            # Если есть медиа, пытаемся отправить с медиа (альбом - одним sendMediaGroup)
+            return partial(self.send_message_with_media, text=text, media=media, post_key=post_key)
+
+        parse_mode = post.get('parse_mode')
+
+        async def send(user_id):
+            await bot.send_message(user_id, text, parse_mode=parse_mode)
+        return send
+
+    def _sent(self, user_id: int, queue_ids: list[int]):
+        self.queued[user_id] -= 1
+        if not self.queued[user_id]:
+            del self.queued[user_id]
+        for queue_id in queue_ids:
+            self.pending.pop(queue_id, None)
+            self.done.append(queue_id)
+
+    async def flush_done(self):
+        """Удалить выполненные доставки из outbox, а у полностью разосланных постов - файлы медиа"""
+        while self.done:
+            batch, self.done = self.done[:ACK_BATCH], self.done[ACK_BATCH:]
+            try:
+                finished = await ack_outbox(batch, OUTBOX_SENT_TTL)
+            except Exception:
+                self.done.extend(batch)
+                raise
+            for payload in finished:
+                for _, path in json.loads(payload).get('media') or ():
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+    async def send_message_with_media(self, user_id, text: str, media: list, post_key: str):
+        """Отправить пост с медиа: файлы загружаются один раз на пост, дальше - по file_id.
+        media - [(вид, путь к файлу)], несколько частей уходят одним альбомом"""
+        caption = text[:MEDIA_CAPTION_LIMIT]
+        kinds = [kind for kind, _ in media]
+
+        async def upload():
+            files = [FSInputFile(path) for _, path in media]
+            sent = await send_media(user_id, kinds, files, caption)
+            return [file_id_of(msg, kind) for msg, kind in zip(sent, kinds)]
+
+        async def send_by_id(file_ids):
+            await send_media(user_id, kinds, file_ids, caption)
+
+        try:
+            await self.media_cache.send_once(post_key, upload, send_by_id)
+
+        except TelegramRetryAfter:
+            raise  # очередь рассылки повторит отправку позже
+        except TelegramForbiddenError:
+            raise  # пользователь заблокировал бота - текстом тоже не отправить
+        except Exception as e:
+            logger.error(f"Ошибка отправки медиа пользователю {user_id}: {e}")
+            # Если не удалось отправить с медиа, отправляем просто текст
+            await bot.send_message(user_id, text, parse_mode='Markdown')
+
+
+async def main(partition: int = 0):
+    """Отдельный процесс рассылки для раздела partition"""
+    instance = Notifier(partition)
+    await init_db()
+    metrics_runner = await metrics.start_server(METRICS_DELIVERY_PORT + partition if METRICS_DELIVERY_PORT else 0)
+    await instance.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await instance.stop()
+        await bot.session.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await close_db()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 0))
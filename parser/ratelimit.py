@@ -0,0 +1,38 @@
+# ratelimit.py
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов (token bucket)"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        # updated в будущем - ведро на паузе до этого момента
+        now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def pause(self, seconds: float):
+        """Опустошить ведро и не выдавать токены seconds секунд (общий лимит сервиса, например RetryAfter)"""
+        self._refill()
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+    async def acquire(self, tokens: float = 1):
+        """Дождаться и забрать токены (ожидающие обслуживаются по очереди)"""
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                paused = max(0.0, self.updated - time.monotonic())
+                await asyncio.sleep(paused + (tokens - self.tokens) / self.rate)
@@ -0,0 +1,68 @@
+# resolver.py
+from collections import OrderedDict
+from telethon import utils
+from telethon.tl.types import InputPeerChannel
+from config import PEER_CACHE_SIZE
+from database.db import (
+    get_channel_peer, get_channel_peers, save_channel_peer, delete_channel_peer, normalize_username
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PeerResolver:
+    """Кэш username -> InputPeerChannel: LRU в памяти поверх таблицы channel_peers"""
+
+    def __init__(self, session: str, capacity: int = PEER_CACHE_SIZE):
+        self.session = session  # access_hash действителен только для своего аккаунта
+        self.capacity = capacity
+        self.cache = OrderedDict()
+
+    def _remember(self, username: str, peer):
+        self.cache[username] = peer
+        self.cache.move_to_end(username)
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+    async def load(self):
+        """Прогреть кэш из базы"""
+        for username, (channel_id, access_hash) in (await get_channel_peers(self.session, self.capacity)).items():
+            self._remember(username, InputPeerChannel(channel_id, access_hash))
+
+    async def resolve(self, client, channel: str, budget=None):
+        """Получить input peer канала; в Telegram идём только при промахе кэша"""
+        username = normalize_username(channel)
+
+        peer = self.cache.get(username)
+        if peer is not None:
+            self.cache.move_to_end(username)
+            return peer
+
+        row = await get_channel_peer(self.session, username)
+        if row:
+            peer = InputPeerChannel(*row)
+            self._remember(username, peer)
+            return peer
+
+        if budget:
+            await budget.acquire()
+        entity = await client.get_entity(username)
+        peer = utils.get_input_peer(entity)
+        if isinstance(peer, InputPeerChannel):
+            await save_channel_peer(self.session, username, peer.channel_id, peer.access_hash)
+        self._remember(username, peer)
+        return peer
+
+    async def invalidate(self, channel: str):
+        """Забыть канал (приватный, удалён, сменил username)"""
+        username = normalize_username(channel)
+        self.cache.pop(username, None)
+        await delete_channel_peer(self.session, username)
+        logger.info(f"Кэш резолва сброшен для {username}")
+
+    async def check_username(self, channel: str, entity):
+        """Сбросить кэш, если у канала сменился username"""
+        actual = getattr(entity, 'username', None)
+        if actual and actual.lower() != normalize_username(channel):
+            await self.invalidate(channel)
@@ -0,0 +1,90 @@
+# scheduler.py
+import heapq
+import time
+from config import POLL_MAX_INTERVAL, POLL_RATE_SMOOTHING, POLL_TARGET_POSTS
+
+
+class ChannelStats:
+    """Наблюдаемая активность канала"""
+
+    def __init__(self):
+        self.rate = 0.0          # сглаженная частота постов, постов/с
+        self.last_check = None
+        self.interval = None     # текущий интервал опроса
+
+
+class PollScheduler:
+    """Очередь с приоритетом по времени следующего опроса канала.
+    Активные каналы опрашиваются чаще, молчащие - реже, в пределах [min_interval, max_interval]"""
+
+    def __init__(self, min_interval: float, max_interval: float = POLL_MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.heap = []       # (время опроса, канал); устаревшие записи пропускаются при извлечении
+        self.next_due = {}   # канал -> актуальное время опроса
+        self.stats = {}
+
+    def sync(self, channels):
+        """Привести набор каналов к актуальному: новые - на немедленную проверку, удалённые - убрать"""
+        now = time.monotonic()
+        channels = set(channels)
+        for channel in channels - self.next_due.keys():
+            self.stats[channel] = ChannelStats()
+            self._schedule(channel, now)
+        for channel in self.next_due.keys() - channels:
+            del self.next_due[channel]
+            del self.stats[channel]
+
+    def _schedule(self, channel: str, when: float):
+        self.next_due[channel] = when
+        heapq.heappush(self.heap, (when, channel))
+
+    def postpone(self, channel: str):
+        """Отложить опрос на минимальный интервал - канал уже догнан другим путём"""
+        if channel not in self.stats:
+            self.stats[channel] = ChannelStats()
+        self._schedule(channel, time.monotonic() + self.min_interval)
+
+    def due(self) -> list[str]:
+        """Извлечь каналы, которым пора на проверку"""
+        now = time.monotonic()
+        channels = []
+        while self.heap and self.heap[0][0] <= now:
+            when, channel = heapq.heappop(self.heap)
+            if self.next_due.get(channel) == when:
+                channels.append(channel)
+        return channels
+
+    def time_until_next(self) -> float:
+        """Сколько ждать до ближайшего опроса"""
+        while self.heap and self.next_due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return self.max_interval
+        return max(0.0, self.heap[0][0] - time.monotonic())
+
+    def record(self, channel: str, new_posts: int):
+        """Учесть результат проверки и назначить следующий опрос"""
+        stats = self.stats.get(channel)
+        if stats is None:
+            return
+        now = time.monotonic()
+        if stats.last_check is not None:
+            observed = new_posts / max(now - stats.last_check, 1.0)
+            stats.rate = POLL_RATE_SMOOTHING * observed + (1 - POLL_RATE_SMOOTHING) * stats.rate
+        stats.last_check = now
+
+        if new_posts:
+            # Канал только что писал - вероятно, продолжит
+            interval = self.min_interval
+        elif stats.rate > 0:
+            # Ждём, пока в среднем накопится POLL_TARGET_POSTS постов
+            interval = POLL_TARGET_POSTS / stats.rate
+        else:
+            interval = self.max_interval
+        stats.interval = min(self.max_interval, max(self.min_interval, interval))
+        self._schedule(channel, now + stats.interval)
+
+    def polls_per_hour(self) -> float:
+        """Ожидаемое число опросов в час при текущих интервалах"""
+        return sum(3600 / (stats.interval or self.min_interval) for stats in self.stats.values())
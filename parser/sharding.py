@@ -0,0 +1,65 @@
+# sharding.py
+import bisect
+import hashlib
+from config import SHARD_TTL, SHARD_VNODES
+from database.db import (
+    get_all_monitor_channels, shard_heartbeat, remove_shard, get_live_shards,
+    get_channel_assignments, get_shard_channels, save_channel_assignments
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> int:
+    # Стабильный между процессами хэш (встроенный hash() рандомизирован)
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Консистентное хэширование: при смене набора шардов переезжает ~1/N каналов"""
+
+    def __init__(self, nodes, vnodes: int = SHARD_VNODES):
+        self.ring = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self.keys = [key for key, _ in self.ring]
+
+    def node(self, key: str) -> str:
+        index = bisect.bisect(self.keys, _hash(key)) % len(self.keys)
+        return self.ring[index][1]
+
+
+class ShardCoordinator:
+    """Участие шарда в кластере: heartbeat, перераспределение каналов, свой набор каналов"""
+
+    def __init__(self, shard_id: str):
+        self.shard_id = shard_id
+        self.assigned = frozenset()
+
+    async def heartbeat(self):
+        """Отметиться живым; координатор (живой шард с меньшим id) перераспределяет каналы"""
+        await shard_heartbeat(self.shard_id)
+        live = await get_live_shards(SHARD_TTL)
+        if live and live[0] == self.shard_id:
+            await self.rebalance(live)
+        self.assigned = frozenset(await get_shard_channels(self.shard_id))
+
+    async def rebalance(self, live: tuple[str, ...]):
+        ring = HashRing(live)
+        current = await get_channel_assignments()
+        wanted = {
+            channel: ring.node(channel)
+            for channel in await get_all_monitor_channels()
+        }
+        if wanted == current:
+            return
+
+        moved = [channel for channel, shard in wanted.items() if current.get(channel) not in (None, shard)]
+        await save_channel_assignments(wanted, moved)
+        logger.info(
+            f"Каналы перераспределены между шардами {', '.join(live)}: "
+            f"{len(wanted)} каналов, переехало {len(moved)}"
+        )
+
+    async def leave(self):
+        """Выйти из кластера - каналы уйдут другим шардам при следующем heartbeat"""
+        await remove_shard(self.shard_id)
@@ -0,0 +1,43 @@
+# storage.py
+import json
+from typing import Any, Mapping
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from config import FSM_TTL
+from database.db import get_fsm_record, set_fsm_state, set_fsm_data, delete_expired_fsm
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище aiogram в общей базе: переживает рестарт, записи истекают через ttl"""
+
+    def __init__(self, ttl: int = FSM_TTL):
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id or "",
+            key.business_connection_id or "", key.destiny
+        ))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await set_fsm_state(self._key(key), state.state if isinstance(state, State) else state, self.ttl)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        record = await get_fsm_record(self._key(key))
+        return record[0] if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await set_fsm_data(self._key(key), json.dumps(dict(data)) if data else None, self.ttl)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        record = await get_fsm_record(self._key(key))
+        return json.loads(record[1]) if record and record[1] else {}
+
+    async def purge(self) -> int:
+        """Удалить истёкшие записи; возвращает их число"""
+        return await delete_expired_fsm()
+
+    async def close(self) -> None:
+        # Пулом соединений владеет database.db (close_db)
+        pass
@@ -0,0 +1,119 @@
+# subscribers.py
+from database.db import get_all_user_channels, get_all_subscriptions, get_subscriptions_version, get_subscription_changes
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriberIndex:
+    """Индекс в памяти: канал мониторинга -> пользователи, которым слать посты.
+    Подписки меняет бот в другом процессе - индекс догоняет базу по журналу изменений (sync)"""
+
+    def __init__(self):
+        self.loaded = False
+        self.version = 0        # последнее применённое изменение из журнала
+        self.owners = {}        # user_channel -> user_id
+        self.monitors_of = {}   # user_channel -> {monitor_channel}
+        self.by_channel = {}    # monitor_channel -> {user_id: число подписок его каналов}
+
+    def _link(self, user_id: int, monitor_channel: str, delta: int):
+        users = self.by_channel.setdefault(monitor_channel, {})
+        users[user_id] = users.get(user_id, 0) + delta
+        if users[user_id] <= 0:
+            del users[user_id]
+        if not users:
+            del self.by_channel[monitor_channel]
+
+    def add_user_channel(self, user_id: int, user_channel: str):
+        """Зеркало add_user_channel (INSERT OR IGNORE: владелец не меняется)"""
+        if user_channel in self.owners:
+            return
+        self.owners[user_channel] = user_id
+        for monitor_channel in self.monitors_of.get(user_channel, ()):
+            self._link(user_id, monitor_channel, 1)
+
+    def add_monitor(self, user_channel: str, monitor_channel: str):
+        """Зеркало add_monitor_channel (повторная подписка игнорируется)"""
+        monitors = self.monitors_of.setdefault(user_channel, set())
+        if monitor_channel in monitors:
+            return
+        monitors.add(monitor_channel)
+        if user_channel in self.owners:
+            self._link(self.owners[user_channel], monitor_channel, 1)
+
+    def remove_monitor(self, user_channel: str, monitor_channel: str):
+        """Зеркало remove_monitor_channel"""
+        monitors = self.monitors_of.get(user_channel)
+        if not monitors or monitor_channel not in monitors:
+            return
+        monitors.remove(monitor_channel)
+        if not monitors:
+            del self.monitors_of[user_channel]
+        if user_channel in self.owners:
+            self._link(self.owners[user_channel], monitor_channel, -1)
+
+    def users(self, monitor_channel: str) -> tuple[int, ...]:
+        """Пользователи, мониторящие канал"""
+        return tuple(self.by_channel.get(monitor_channel, ()))
+
+    def snapshot(self) -> dict[str, frozenset]:
+        return {channel: frozenset(users) for channel, users in self.by_channel.items()}
+
+    @classmethod
+    async def from_db(cls) -> 'SubscriberIndex':
+        index = cls()
+        for user_id, user_channel in await get_all_user_channels():
+            index.add_user_channel(user_id, user_channel)
+        for user_channel, monitor_channel in await get_all_subscriptions():
+            index.add_monitor(user_channel, monitor_channel)
+        index.loaded = True
+        return index
+
+    async def load(self):
+        """Загрузить индекс из базы"""
+        # Версия - до выгрузки: изменения, попавшие между ними, применятся повторно, а это безопасно
+        version = await get_subscriptions_version()
+        index = await self.from_db()
+        self.owners, self.monitors_of, self.by_channel = index.owners, index.monitors_of, index.by_channel
+        self.version = version
+        self.loaded = True
+        logger.info(f"Индекс подписчиков загружен: {len(self.by_channel)} каналов")
+
+    async def sync(self) -> int:
+        """Применить изменения подписок из журнала; возвращает число применённых"""
+        first, changes = await get_subscription_changes(self.version)
+        if not changes:
+            return 0
+        if first is not None and first > self.version + 1:
+            # Часть журнала уже удалена - применять по кускам нельзя
+            logger.warning(f"Журнал подписок очищен дальше версии {self.version}, индекс перезагружается")
+            await self.load()
+            return len(changes)
+
+        for version, op, user_id, user_channel, monitor_channel in changes:
+            if op == 'user':
+                self.add_user_channel(user_id, user_channel)
+            elif op == 'add':
+                self.add_monitor(user_channel, monitor_channel)
+            else:
+                self.remove_monitor(user_channel, monitor_channel)
+            self.version = version
+        return len(changes)
+
+    async def check_consistency(self, repair: bool = True) -> bool:
+        """Сверить индекс с базой; при расхождении (по желанию) перезагрузить"""
+        expected = (await self.from_db()).snapshot()
+        actual = self.snapshot()
+        if expected == actual:
+            return True
+
+        diverged = {channel for channel in expected.keys() | actual.keys()
+                    if expected.get(channel) != actual.get(channel)}
+        logger.warning(f"Индекс подписчиков расходится с базой по {len(diverged)} каналам")
+        if repair:
+            await self.load()
+        return False
+
+
+# Индекс подписчиков монитора
+subscriber_index = SubscriberIndex()
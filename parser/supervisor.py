@@ -0,0 +1,109 @@
+# supervisor.py
+"""Запуск всей системы отдельными процессами и их перезапуск при падении:
+
+    python supervisor.py
+
+- bot.py - меню бота (апдейты Telegram);
+- monitor.py - монитор каналов, по процессу на шард из SHARDS;
+- notifier.py k - рассылка для раздела пользователей k из DELIVERY_PROCESSES.
+
+Процессы общаются только через базу (outbox с постами и доставками), поэтому занятый или
+зависший монитор не тормозит меню, а рассылку можно масштабировать отдельно.
+"""
+import asyncio
+import os
+import random
+import signal
+import sys
+import time
+from config import (
+    SHARDS, DELIVERY_PROCESSES, SUPERVISOR_RESTART_BASE, SUPERVISOR_RESTART_MAX,
+    SUPERVISOR_STABLE_TIME, SUPERVISOR_STOP_TIMEOUT
+)
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Скрипты запускаются из каталога проекта: пути в config (база, сессии) относительные
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def process_specs() -> dict[str, list[str]]:
+    """Имя процесса -> аргументы python"""
+    specs = {"bot": ["bot.py"]}
+    if SHARDS:
+        for shard_id in sorted(SHARDS):
+            specs[f"monitor-{shard_id}"] = ["monitor.py", shard_id]
+    else:
+        specs["monitor"] = ["monitor.py"]
+    for partition in range(DELIVERY_PROCESSES):
+        specs[f"notifier-{partition}"] = ["notifier.py", str(partition)]
+    return specs
+
+
+class Supervisor:
+    """Держит процессы запущенными: упавший перезапускается с нарастающей паузой"""
+
+    def __init__(self, specs: dict[str, list[str]]):
+        self.specs = specs
+        self.processes = {}   # имя -> asyncio.subprocess.Process
+        self.restarts = {}    # имя -> число перезапусков подряд
+        self.stopping = asyncio.Event()
+
+    def backoff(self, name: str) -> float:
+        attempt = self.restarts.get(name, 0)
+        return min(SUPERVISOR_RESTART_MAX, SUPERVISOR_RESTART_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def _spawn(self, name: str):
+        process = await asyncio.create_subprocess_exec(sys.executable, *self.specs[name], cwd=BASE_DIR)
+        self.processes[name] = process
+        logger.info(f"Запущен {name} (pid {process.pid})")
+        return process
+
+    async def keep_alive(self, name: str):
+        """Запускать процесс заново, пока супервизор не остановлен"""
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            process = await self._spawn(name)
+            code = await process.wait()
+            if self.stopping.is_set():
+                return
+            # Проработал долго - значит, падение не циклическое, паузу сбрасываем
+            if time.monotonic() - started >= SUPERVISOR_STABLE_TIME:
+                self.restarts[name] = 0
+            delay = self.backoff(name)
+            self.restarts[name] = self.restarts.get(name, 0) + 1
+            logger.error(f"{name} завершился с кодом {code}, перезапуск через {delay:.1f} с")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def terminate(self):
+        """Мягкая остановка (SIGINT - процессы сохраняют состояние), по таймауту - kill"""
+        running = [process for process in self.processes.values() if process.returncode is None]
+        for process in running:
+            process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(process.wait() for process in running)), SUPERVISOR_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            for process in running:
+                if process.returncode is None:
+                    logger.warning(f"Процесс {process.pid} не остановился за {SUPERVISOR_STOP_TIMEOUT} с")
+                    process.kill()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+
+        tasks = [asyncio.create_task(self.keep_alive(name)) for name in self.specs]
+        await self.stopping.wait()
+        logger.info("Останавливаем процессы")
+        await self.terminate()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(Supervisor(process_specs()).run())
@@ -0,0 +1,6 @@
+# conftest.py
+import os
+import sys
+
+# Модули проекта лежат плоско в parser/ и импортируются без пакета
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
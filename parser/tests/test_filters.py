@@ -0,0 +1,65 @@
+# test_filters.py
+import pytest
+
+import filters
+from filters import EXCLUDE, INCLUDE, AhoCorasick, ChannelMatcher, FilterIndex, parse_pattern
+from subscribers import SubscriberIndex
+
+
+@pytest.fixture
+def subscribers(monkeypatch):
+    """Пользователь 1 с двумя своими каналами, подписанными на news, и пользователь 2 с одним"""
+    index = SubscriberIndex()
+    index.add_user_channel(1, 'first')
+    index.add_user_channel(1, 'second')
+    index.add_user_channel(2, 'other')
+    for user_channel in ('first', 'second', 'other'):
+        index.add_monitor(user_channel, 'news')
+    monkeypatch.setattr(filters, 'subscriber_index', index)
+    return index
+
+
+def test_aho_corasick_finds_overlapping_keywords():
+    automaton = AhoCorasick(['he', 'she', 'his', 'hers'])
+    assert automaton.search('ushers') == {0, 1, 3}
+    assert automaton.search('nothing') == set()
+
+
+def test_include_and_exclude_keywords():
+    matcher = ChannelMatcher({
+        'crypto': frozenset({(INCLUDE, 'btc', False), (INCLUDE, 'eth', False)}),
+        'no_ads': frozenset({(EXCLUDE, 'реклама', False)}),
+    })
+    assert matcher.rejected("Курс BTC растёт") == []
+    assert matcher.rejected("Погода на завтра") == ['crypto']
+    assert sorted(matcher.rejected("РЕКЛАМА: купите ETH")) == ['no_ads']
+    assert sorted(matcher.rejected("Реклама погоды")) == ['crypto', 'no_ads']
+
+
+def test_regex_match():
+    pattern, is_regex = parse_pattern(r'/\d+%/')
+    assert (pattern, is_regex) == (r'\d+%', True)
+    matcher = ChannelMatcher({'percent': frozenset({(INCLUDE, pattern, is_regex)})})
+    assert matcher.rejected("Рост на 15%") == []
+    assert matcher.rejected("Рост на пятнадцать процентов") == ['percent']
+
+
+def test_user_kept_while_one_subscription_passes(subscribers):
+    index = FilterIndex()
+    index.rules = {'news': {
+        'first': frozenset({(INCLUDE, 'btc', False)}),
+        'second': frozenset({(EXCLUDE, 'погода', False)}),
+    }}
+    users = subscribers.users('news')
+
+    # 'first' отклоняет пост, 'second' пропускает - пользователь 1 его получает
+    assert sorted(index.select('news', "Новости дня", users)) == [1, 2]
+    # Обе подписки пользователя 1 отклоняют пост
+    assert sorted(index.select('news', "Погода на завтра", users)) == [2]
+    # Обе пропускают
+    assert sorted(index.select('news', "BTC обновил максимум", users)) == [1, 2]
+
+
+def test_dangerous_regex_is_rejected():
+    with pytest.raises(ValueError):
+        parse_pattern('/(a+)+$/')
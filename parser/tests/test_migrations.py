@@ -0,0 +1,136 @@
+# test_migrations.py
+import asyncio
+import logging
+
+import aiosqlite
+
+from database.migrations import MIGRATIONS, migrate
+
+# Схема и данные базы до появления миграций (user_version = 0)
+BASELINE = """
+CREATE TABLE users (
+    user_id INTEGER,
+    user_channel TEXT PRIMARY KEY
+);
+CREATE TABLE monitor_channels (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_channel TEXT,
+    monitor_channel TEXT,
+    is_subscribed INTEGER DEFAULT 0,
+    FOREIGN KEY(user_channel) REFERENCES users(user_channel)
+);
+CREATE TABLE last_posts (
+    monitor_channel TEXT PRIMARY KEY,
+    last_post_id INTEGER DEFAULT 0
+);
+INSERT INTO users VALUES (1, 'mine'), (2, 'other');
+INSERT INTO monitor_channels (user_channel, monitor_channel, is_subscribed) VALUES
+    ('mine', '@News', 1),
+    ('mine', 'https://t.me/news', 0),
+    ('other', 't.me/news/15', 0),
+    ('other', 'crypto', 0);
+INSERT INTO last_posts VALUES ('@News', 40), ('news', 42);
+"""
+
+TABLES = {
+    'users', 'channel_peers', 'shards', 'channels', 'subscriptions', 'update_state', 'fsm_state',
+    'bot_messages', 'delivered_posts', 'outbox_posts', 'outbox', 'subscription_filters',
+    'user_settings', 'subscription_changes', 'outbox_sent',
+}
+INDEXES = {
+    'idx_channels_shard', 'idx_subscriptions_channel', 'idx_users_user_id',
+    'idx_fsm_state_expires', 'idx_delivered_posts_expires', 'idx_outbox_sent_expires',
+}
+
+
+async def fetch(db, sql: str) -> list:
+    async with db.execute(sql) as cursor:
+        return await cursor.fetchall()
+
+
+async def schema(db) -> list:
+    return await fetch(db, "SELECT type, name, sql FROM sqlite_master ORDER BY type, name")
+
+
+async def columns(db) -> dict[str, list]:
+    """Столбцы всех таблиц: текст CREATE у баз с разной историей может отличаться форматированием"""
+    tables = [name for kind, name, _ in await schema(db) if kind == 'table']
+    return {table: await fetch(db, f"PRAGMA table_info({table})") for table in tables}
+
+
+async def user_version(db) -> int:
+    return (await fetch(db, "PRAGMA user_version"))[0][0]
+
+
+def test_migrate_baseline_to_latest(tmp_path):
+    async def main():
+        async with aiosqlite.connect(tmp_path / "bot.db") as db:
+            await db.executescript(BASELINE)
+            await db.commit()
+            await migrate(db)
+
+            assert await user_version(db) == len(MIGRATIONS)
+            tables = {name for kind, name, _ in await schema(db) if kind == 'table'} - {'sqlite_sequence'}
+            assert tables == TABLES
+            indexes = {name for kind, name, _ in await schema(db)
+                       if kind == 'index' and not name.startswith('sqlite_autoindex')}
+            assert indexes == INDEXES
+
+            # Разные написания одного канала сведены к одной строке
+            channels = await fetch(db, "SELECT username, is_subscribed, last_post_id FROM channels ORDER BY username")
+            assert channels == [('crypto', 0, 0), ('news', 1, 42)]
+            subscriptions = await fetch(db, """
+            SELECT s.user_channel, c.username FROM subscriptions s
+            JOIN channels c ON c.id = s.channel_id ORDER BY 1, 2
+            """)
+            assert subscriptions == [('mine', 'news'), ('other', 'crypto'), ('other', 'news')]
+
+    asyncio.run(main())
+
+
+def test_second_migrate_changes_nothing(tmp_path, caplog):
+    async def main():
+        async with aiosqlite.connect(tmp_path / "bot.db") as db:
+            await db.executescript(BASELINE)
+            await db.commit()
+            await migrate(db)
+            migrated = await schema(db)
+            data = await fetch(db, "SELECT * FROM channels ORDER BY id")
+
+            caplog.clear()
+            with caplog.at_level(logging.INFO, logger='database.migrations'):
+                await migrate(db)
+            assert not caplog.records
+            assert await user_version(db) == len(MIGRATIONS)
+            assert await schema(db) == migrated
+            assert await fetch(db, "SELECT * FROM channels ORDER BY id") == data
+
+    asyncio.run(main())
+
+
+def test_fresh_and_upgraded_databases_match(tmp_path):
+    async def main():
+        async with aiosqlite.connect(tmp_path / "fresh.db") as fresh:
+            await migrate(fresh)
+            expected_columns = await columns(fresh)
+            expected_indexes = {name for kind, name, _ in await schema(fresh) if kind == 'index'}
+
+        # База до миграций с кэшем резолва без сессии: кэш сбрасывается
+        async with aiosqlite.connect(tmp_path / "old.db") as db:
+            await db.executescript(BASELINE + """
+            CREATE TABLE channel_peers (
+                username TEXT PRIMARY KEY,
+                channel_id INTEGER NOT NULL,
+                access_hash INTEGER NOT NULL,
+                updated_at INTEGER DEFAULT (strftime('%s', 'now'))
+            );
+            INSERT INTO channel_peers (username, channel_id, access_hash) VALUES ('news', 100, 200);
+            """)
+            await db.commit()
+            await migrate(db)
+
+            assert await columns(db) == expected_columns
+            assert {name for kind, name, _ in await schema(db) if kind == 'index'} == expected_indexes
+            assert await fetch(db, "SELECT * FROM channel_peers") == []
+
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+# test_webhook.py
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from fakes import FakeBotSession, FakeNetwork, FakeWebhookClient
+from webhook import BoundedRequestHandler
+
+SECRET = "test-secret"
+
+
+def message_update(update_id: int) -> types.Update:
+    return types.Update(update_id=update_id, message=types.Message(
+        message_id=update_id, date=datetime.now(timezone.utc),
+        chat=types.Chat(id=1, type='private'),
+        from_user=types.User(id=1, is_bot=False, first_name="test"), text="ping"
+    ))
+
+
+async def serve(handle, max_concurrency: int = 1, queue_timeout: float = 0.1):
+    """Поднять webhook с хендлером сообщений handle на свободном порту"""
+    dp = Dispatcher()
+    dp.message.register(handle)
+    bot = Bot("123456:TEST", session=FakeBotSession(FakeNetwork()))
+    handler = BoundedRequestHandler(dp, bot, secret_token=SECRET,
+                                    max_concurrency=max_concurrency, queue_timeout=queue_timeout)
+    app = web.Application()
+    handler.register(app, path="/webhook")
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, handler, f"http://{host}:{port}/webhook"
+
+
+def test_wrong_secret_is_rejected():
+    handled = []
+
+    async def handle(message: types.Message):
+        handled.append(message.message_id)
+
+    async def main():
+        runner, handler, url = await serve(handle)
+        client = FakeWebhookClient(url, "wrong")
+        try:
+            with pytest.raises(PermissionError):
+                await client.send(message_update(1))
+            await handler.drain()
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return client
+
+    client = asyncio.run(main())
+    assert client.statuses == {401: 1}
+    assert handled == []
+
+
+def test_busy_slots_answer_503_until_released():
+    release = asyncio.Event()
+    handled = []
+
+    async def handle(message: types.Message):
+        await release.wait()
+        handled.append(message.message_id)
+
+    async def main():
+        runner, handler, url = await serve(handle, max_concurrency=1, queue_timeout=0.05)
+        first = FakeWebhookClient(url, SECRET)
+        second = FakeWebhookClient(url, SECRET, retry_delay=0.05)
+        try:
+            await first.send(message_update(1))
+            assert handler.in_flight == 1
+
+            # Единственный слот занят: второй апдейт получает 503 и повторяется
+            retrying = asyncio.create_task(second.send(message_update(2)))
+            while not second.statuses[503]:
+                await asyncio.sleep(0.01)
+            assert not retrying.done()
+
+            release.set()
+            await asyncio.wait_for(retrying, 5)
+            await handler.drain()
+        finally:
+            await first.close()
+            await second.close()
+            await runner.cleanup()
+        return handler, first, second
+
+    handler, first, second = asyncio.run(main())
+    assert first.statuses == {200: 1}
+    assert second.statuses[503] >= 1
+    assert second.statuses[200] == 1
+    assert sorted(handled) == [1, 2]
+    assert handler.in_flight == 0
+
+
+def test_close_drains_accepted_updates():
+    handled = []
+
+    async def handle(message: types.Message):
+        await asyncio.sleep(0.1)
+        handled.append(message.message_id)
+
+    async def main():
+        runner, handler, url = await serve(handle, max_concurrency=5)
+        client = FakeWebhookClient(url, SECRET)
+        try:
+            for update_id in range(1, 6):
+                await client.send(message_update(update_id))
+            # Ответ 200 уходит до обработки: апдейты ещё в работе
+            assert handler.in_flight == 5
+            await handler.close()
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return handler
+
+    handler = asyncio.run(main())
+    assert sorted(handled) == [1, 2, 3, 4, 5]
+    assert handler.in_flight == 0
+    assert not handler.tasks
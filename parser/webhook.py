@@ -0,0 +1,95 @@
+# webhook.py
+import asyncio
+import secrets
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from config import (
+    BOT_WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS, WEBHOOK_MAX_CONCURRENCY, WEBHOOK_QUEUE_TIMEOUT
+)
+from metrics import QUEUE_DEPTH, WEBHOOK_REJECTED
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Приём апдейтов с ограничением одновременной обработки.
+
+    Telegram получает ответ сразу, апдейт обрабатывается в фоне. Когда заняты все
+    max_concurrency слотов, запрос ждёт свободный до queue_timeout секунд, а затем
+    получает 503 - Telegram повторит доставку позже, память под очередь не растёт.
+    Переопределён только публичный handle(): фоновые задачи и слоты - свои, не aiogram"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str = None,
+                 max_concurrency: int = WEBHOOK_MAX_CONCURRENCY, queue_timeout: float = WEBHOOK_QUEUE_TIMEOUT):
+        super().__init__(dispatcher, bot, secret_token=secret_token)
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.tasks = set()  # апдейты в обработке (asyncio держит задачи слабо)
+        QUEUE_DEPTH.labels("webhook").set_function(lambda: self.in_flight)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.tasks)
+
+    async def _process(self, bot: Bot, update: dict):
+        try:
+            result = await self.dispatcher.feed_raw_update(bot, update, **self.data)
+            # Ответ хендлера методом Bot API отправляем отдельным запросом - ответ webhook уже ушёл
+            if isinstance(result, TelegramMethod):
+                await self.dispatcher.silent_call_request(bot, result)
+        except Exception as e:
+            logger.error(f"Ошибка обработки апдейта {update.get('update_id')}: {e}")
+        finally:
+            self.slots.release()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+        update = await request.json(loads=bot.session.json_loads)
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            WEBHOOK_REJECTED.inc()
+            return web.Response(status=503, text="Busy")
+        task = asyncio.create_task(self._process(bot, update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def drain(self):
+        """Дождаться обработки уже принятых апдейтов"""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def close(self):
+        # Сессию бота закрывает владелец бота, а не сервер
+        await self.drain()
+
+
+async def start_webhook(dispatcher: Dispatcher, bot: Bot, url: str = BOT_WEBHOOK_URL,
+                        host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH,
+                        secret: str = WEBHOOK_SECRET, max_concurrency: int = WEBHOOK_MAX_CONCURRENCY
+                        ) -> tuple[web.AppRunner, BoundedRequestHandler]:
+    """Поднять HTTP-сервер на host:port и, если задан url, зарегистрировать webhook в Telegram"""
+    # Без заданного секрета - случайный на каждый запуск: setWebhook всё равно его обновляет
+    secret = secret or secrets.token_urlsafe(32)
+    handler = BoundedRequestHandler(dispatcher, bot, secret_token=secret, max_concurrency=max_concurrency)
+    app = web.Application()
+    handler.register(app, path=path)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Webhook слушает http://{host}:{port}{path}")
+
+    if url:
+        await bot.set_webhook(
+            url, secret_token=secret, max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dispatcher.resolve_used_update_types()
+        )
+        logger.info(f"Webhook зарегистрирован: {url}")
+    return runner, handler